@@ -10,6 +10,24 @@ a = Analysis(
         ('app.py', '.'),
         ('auth.py', '.'),
         ('database.py', '.'),
+        ('cache.py', '.'),
+        ('shared_cache.py', '.'),
+        ('events.py', '.'),
+        ('ocr.py', '.'),
+        ('extraction_cache.py', '.'),
+        ('pdf_text.py', '.'),
+        ('document_parsers.py', '.'),
+        ('ai_providers.py', '.'),
+        ('document_pipeline.py', '.'),
+        ('jobs.py', '.'),
+        ('upload_store.py', '.'),
+        ('document_index.py', '.'),
+        ('fingerprints.py', '.'),
+        ('document_templates.py', '.'),
+        ('document_classifier.py', '.'),
+        ('model_cascade.py', '.'),
+        ('json_repair.py', '.'),
+        ('token_budget.py', '.'),
         ('.env', '.'),
     ],
     hiddenimports=[
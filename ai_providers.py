@@ -0,0 +1,284 @@
+"""
+Provedores de IA do CONT-AI (Gemini, OpenAI, Groq e Anthropic).
+
+Não importa o Streamlit: é usado tanto pela interface quanto pela análise
+de documentos executada em paralelo.
+"""
+
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Modelo usado em cada provedor
+AI_MODELS = {
+    'gemini': 'gemini-1.5-flash',
+    'openai': 'gpt-4o-mini',
+    'groq': 'llama-3.1-8b-instant',
+    'anthropic': 'claude-sonnet-4-20250514',
+}
+
+# Códigos HTTP que justificam nova tentativa (limite de taxa, sobrecarga e falhas do servidor)
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Erros sem código HTTP (conexão, tempo esgotado, cota do Gemini) mapeados para um código equivalente
+ERROR_STATUS_BY_NAME = {
+    'RateLimitError': 429,
+    'ResourceExhausted': 429,
+    'TooManyRequests': 429,
+    'APIConnectionError': 503,
+    'APITimeoutError': 504,
+    'ServiceUnavailable': 503,
+    'InternalServerError': 500,
+    'DeadlineExceeded': 504,
+    'OverloadedError': 529,
+}
+
+
+# Separa o prefixo fixo do prompt de sistema (instruções, exemplos, formato de resposta) da
+# parte variável (dados da empresa, do período ou do documento). O prefixo é idêntico entre
+# requisições e fica no cache de prompt do provedor: ponto de cache explícito na Anthropic,
+# cache automático de prefixo na OpenAI e na Groq. O marcador nunca é enviado ao modelo.
+PROMPT_CACHE_BREAK = "\n<<<FIM_DO_PREFIXO_FIXO>>>\n"
+
+
+def split_system_prompt(system_prompt: str) -> Tuple[str, str]:
+    """(prefixo fixo, parte variável) do prompt; sem marcador, tudo é tratado como variável."""
+    if PROMPT_CACHE_BREAK not in (system_prompt or ""):
+        return "", system_prompt or ""
+    prefix, volatile = system_prompt.split(PROMPT_CACHE_BREAK, 1)
+    return prefix, volatile
+
+
+def plain_system_prompt(system_prompt: str) -> str:
+    """Prompt sem o marcador, com o prefixo fixo no início (para provedores com cache automático)."""
+    prefix, volatile = split_system_prompt(system_prompt)
+    return f"{prefix}\n\n{volatile}" if prefix else volatile
+
+
+def anthropic_system_blocks(system_prompt: str) -> List[Dict[str, Any]]:
+    """Blocos de sistema da Anthropic com ponto de cache no fim do prefixo fixo."""
+    prefix, volatile = split_system_prompt(system_prompt)
+    blocks = []
+    if prefix:
+        blocks.append({"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}})
+    if volatile.strip():
+        blocks.append({"type": "text", "text": volatile})
+    return blocks
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa de tokens (≈ 4 caracteres por token)."""
+    return len(text or "") // 4 + 1
+
+
+def create_ai_client(model_type: str, api_key: str):
+    """Cria o cliente do provedor (levanta exceção se o pacote não estiver instalado)."""
+    if model_type == "gemini":
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(AI_MODELS['gemini'])
+
+    elif model_type == "openai":
+        from openai import OpenAI
+        return OpenAI(api_key=api_key)
+
+    elif model_type == "groq":
+        from groq import Groq
+        return Groq(api_key=api_key)
+
+    elif model_type == "anthropic":
+        from anthropic import Anthropic
+        return Anthropic(api_key=api_key)
+
+    return None
+
+
+def chat_with_ai(client, model_type: str, system_prompt: str, user_message: str, chat_history=None,
+                 raise_errors: bool = False, model: Optional[str] = None,
+                 json_schema: Optional[Dict[str, Any]] = None):
+    """
+    Conversa com o agente de IA.
+
+    Args:
+        model: modelo do provedor a usar no lugar do padrão de AI_MODELS
+        json_schema: pede a resposta como JSON no modo nativo do provedor
+            (json_schema na OpenAI, JSON na Groq e no Gemini, ferramenta
+            obrigatória na Anthropic); a resposta é o texto do JSON
+
+    Returns:
+        (resposta, histórico). Em caso de erro a resposta é a mensagem de erro,
+        a menos que raise_errors=True (usado quando quem chama faz novas tentativas).
+    """
+    try:
+        if model_type == "gemini":
+            if model and model != AI_MODELS['gemini']:
+                import google.generativeai as genai
+                client = genai.GenerativeModel(model)  # A chave já foi configurada em create_ai_client
+            if chat_history is None:
+                chat_history = client.start_chat(history=[])
+            full_message = f"{plain_system_prompt(system_prompt)}\n\n---\nUSUÁRIO: {user_message}"
+            if json_schema:
+                response = chat_history.send_message(
+                    full_message, generation_config={"response_mime_type": "application/json"}
+                )
+            else:
+                response = chat_history.send_message(full_message)
+            return response.text, chat_history
+
+        elif model_type in ("openai", "groq"):
+            options = {}
+            if json_schema and model_type == "openai":
+                options['response_format'] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": json_schema.get('title', 'resposta'), "schema": json_schema},
+                }
+            elif json_schema:
+                options['response_format'] = {"type": "json_object"}
+            response = client.chat.completions.create(
+                model=model or AI_MODELS[model_type],
+                messages=[
+                    {"role": "system", "content": plain_system_prompt(system_prompt)},
+                    {"role": "user", "content": user_message}
+                ],
+                **options
+            )
+            return response.choices[0].message.content, None
+
+        elif model_type == "anthropic":
+            if json_schema:
+                # Resposta estruturada: ferramenta obrigatória cujo input segue o schema
+                tool_name = json_schema.get('title', 'resposta')
+                response = client.messages.create(
+                    model=model or AI_MODELS['anthropic'],
+                    max_tokens=4000,
+                    system=anthropic_system_blocks(system_prompt),
+                    messages=[{"role": "user", "content": user_message}],
+                    tools=[{"name": tool_name, "description": json_schema.get('description', ''),
+                            "input_schema": json_schema}],
+                    tool_choice={"type": "tool", "name": tool_name}
+                )
+                for block in response.content:
+                    if getattr(block, 'type', None) == 'tool_use':
+                        return json.dumps(block.input, ensure_ascii=False), None
+                return response.content[0].text, None
+
+            response = client.messages.create(
+                model=model or AI_MODELS['anthropic'],
+                max_tokens=4000,
+                system=anthropic_system_blocks(system_prompt),
+                messages=[{"role": "user", "content": user_message}]
+            )
+            return response.content[0].text, None
+
+    except Exception as e:
+        if raise_errors:
+            raise
+        return f"Erro ao comunicar com IA: {str(e)}", chat_history
+
+
+class ChatStream:
+    """
+    Resposta do agente em trechos, na ordem em que chegam do provedor.
+
+    Iterar consome a resposta (st.write_stream aceita o objeto diretamente).
+    Ao final, `text` tem a resposta completa e `chat_history` o histórico do
+    Gemini (None nos demais provedores). Erros viram uma mensagem no próprio
+    texto, como em chat_with_ai.
+    """
+
+    def __init__(self, client, model_type: str, system_prompt: str, user_message: str,
+                 chat_history=None, model: Optional[str] = None):
+        self.client = client
+        self.model_type = model_type
+        self.system_prompt = system_prompt
+        self.user_message = user_message
+        self.chat_history = chat_history
+        self.model = model
+        self.text = ""
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._chunks():
+                if chunk:
+                    self.text += chunk
+                    yield chunk
+        except Exception as e:
+            message = f"Erro ao comunicar com IA: {str(e)}"
+            if self.text:
+                message = f"\n\n{message}"
+            self.text += message
+            yield message
+
+    def _chunks(self) -> Iterator[str]:
+        if self.model_type == "gemini":
+            client = self.client
+            if self.model and self.model != AI_MODELS['gemini']:
+                import google.generativeai as genai
+                client = genai.GenerativeModel(self.model)
+            if self.chat_history is None:
+                self.chat_history = client.start_chat(history=[])
+            full_message = f"{plain_system_prompt(self.system_prompt)}\n\n---\nUSUÁRIO: {self.user_message}"
+            for chunk in self.chat_history.send_message(full_message, stream=True):
+                yield chunk.text
+
+        elif self.model_type in ("openai", "groq"):
+            stream = self.client.chat.completions.create(
+                model=self.model or AI_MODELS[self.model_type],
+                messages=[
+                    {"role": "system", "content": plain_system_prompt(self.system_prompt)},
+                    {"role": "user", "content": self.user_message}
+                ],
+                stream=True
+            )
+            for event in stream:
+                if event.choices:
+                    yield event.choices[0].delta.content or ""
+
+        elif self.model_type == "anthropic":
+            with self.client.messages.stream(
+                model=self.model or AI_MODELS['anthropic'],
+                max_tokens=4000,
+                system=anthropic_system_blocks(self.system_prompt),
+                messages=[{"role": "user", "content": self.user_message}]
+            ) as stream:
+                yield from stream.text_stream
+
+
+def chat_with_ai_stream(client, model_type: str, system_prompt: str, user_message: str, chat_history=None,
+                        model: Optional[str] = None) -> ChatStream:
+    """
+    Variante de chat_with_ai que entrega a resposta à medida que é gerada.
+
+    Returns:
+        ChatStream: iterar devolve os trechos; depois, `text` e `chat_history`.
+    """
+    return ChatStream(client, model_type, system_prompt, user_message, chat_history, model)
+
+
+def get_error_status(error: Exception) -> Optional[int]:
+    """Código HTTP do erro do provedor (ou equivalente), se houver."""
+    for attr in ('status_code', 'code', 'http_status'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None)
+    if isinstance(value, int):
+        return value
+    return ERROR_STATUS_BY_NAME.get(type(error).__name__)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    return get_error_status(error) in RETRYABLE_STATUS
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Espera sugerida pelo provedor (cabeçalho Retry-After), em segundos."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
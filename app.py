@@ -18,6 +18,17 @@ import calendar
 # Importa módulos locais
 from database import *
 from auth import authenticate_user, register_user
+from cache import PartitionedRangeCache, Prefetcher, SessionCache, approx_size, iter_months
+from shared_cache import DEFAULT_TTL as SHARED_CACHE_TTL, get_shared_cache
+from events import publish
+from pdf_text import get_backend_timings as get_pdf_backend_timings
+from ai_providers import PROMPT_CACHE_BREAK, chat_with_ai_stream, create_ai_client
+from jobs import STATUS_DONE, STATUS_ERROR, get_job_store, recover_document_jobs, resume_document_jobs, submit_document_jobs
+from upload_store import get_upload_store
+from document_index import STATUS_APPROVED as DOCUMENT_STATUS_APPROVED, STATUS_REJECTED as DOCUMENT_STATUS_REJECTED, approved_analyses, set_document_status
+from document_classifier import classifier_is_stale, train_classifier
+from document_pipeline import learn_document_template
+from model_cascade import get_cascade_stats
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -26,6 +37,7 @@ load_dotenv()
 # No Windows, o caminho padrão é:
 # import pytesseract
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# O OCR de PDFs roda em processos separados: nesse caso defina também TESSERACT_CMD no .env
 
 # Configuração da página
 st.set_page_config(
@@ -73,6 +85,7 @@ def update_user_password(user_id: str, new_password_hash: str):
             .eq('id', user_id)
             .execute()
         )
+        publish(None, 'users')
         return bool(response.data)
     except Exception as e:
         print(f"❌ Erro ao atualizar senha: {e}")
@@ -134,11 +147,8 @@ def show_module_header(title: str, icon: str = "📊", show_date_range: bool = F
                                 st.session_state[date_range_key] = new_date_range
                                 # Marca que o usuário definiu manualmente o período
                                 st.session_state[f"{module}_date_range_user_set"] = True
-                                # Limpa o cache dos dados do DRE para forçar recarregamento
-                                cache_keys = [f"{module}_dre_data", "financial_dre_data"]
-                                for key in cache_keys:
-                                    if key in st.session_state:
-                                        del st.session_state[key]
+                                # Não limpa o cache: as partições mensais/diárias já carregadas são
+                                # reaproveitadas e apenas o delta do novo período é buscado
                                 st.rerun()
                         else:
                             st.error("A data inicial deve ser menor ou igual à data final")
@@ -247,74 +257,17 @@ def calculate_simples_nacional_tax(revenue: float, activity_annex: str = "III")
 def initialize_ai_client(model_type: str, api_key: str):
     """Inicializa cliente de IA - retorna apenas o client"""
     try:
-        if model_type == "gemini":
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            return genai.GenerativeModel('gemini-1.5-flash')
-        
-        elif model_type == "openai":
-            from openai import OpenAI
-            return OpenAI(api_key=api_key)
-        
-        elif model_type == "groq":
-            from groq import Groq
-            return Groq(api_key=api_key)
-        
-        elif model_type == "anthropic":
-            from anthropic import Anthropic
-            return Anthropic(api_key=api_key)
-        
-        return None
+        return create_ai_client(model_type, api_key)
     except Exception as e:
         st.error(f"Erro ao inicializar IA: {e}")
         return None
 
-def chat_with_ai(client, model_type: str, system_prompt: str, user_message: str, chat_history=None):
-    """Conversa com o agente de IA"""
-    try:
-        if model_type == "gemini":
-            if chat_history is None:
-                chat_history = client.start_chat(history=[])
-            full_message = f"{system_prompt}\n\n---\nUSUÁRIO: {user_message}"
-            response = chat_history.send_message(full_message)
-            return response.text, chat_history
-        
-        elif model_type == "openai":
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            return response.choices[0].message.content, None
-        
-        elif model_type == "groq":
-            response = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            return response.choices[0].message.content, None
-        
-        elif model_type == "anthropic":
-            response = client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4000,
-                system=system_prompt,
-                messages=[{"role": "user", "content": user_message}]
-            )
-            return response.content[0].text, None
-        
-    except Exception as e:
-        return f"Erro ao comunicar com IA: {str(e)}", chat_history
-
 def create_accounting_system_prompt(company_data: dict, dre_data: dict = None, financial_data: dict = None) -> str:
     """Cria prompt do sistema para o agente contábil com contexto completo da empresa"""
     
-    prompt = f"""Você é um ESPECIALISTA EM CONTABILIDADE SOCIETÁRIA E GERENCIAL.
+    # Instruções fixas primeiro: o prefixo é igual em todas as perguntas e fica no cache de
+    # prompt do provedor; os dados da empresa e do período vêm depois de PROMPT_CACHE_BREAK
+    instructions = """Você é um ESPECIALISTA EM CONTABILIDADE SOCIETÁRIA E GERENCIAL.
 
 🎯 SUA ESPECIALIDADE (CONTABILIDADE):
 - Contabilidade societária e gerencial
@@ -354,53 +307,13 @@ def create_accounting_system_prompt(company_data: dict, dre_data: dict = None, f
 - Responda em português brasileiro
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🏢 EMPRESA:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{company_data.get('name', 'N/A')}
-CNPJ: {company_data.get('cnpj', 'N/A')}
-Regime Tributário: {company_data.get('tax_regime', 'N/A')}
-
-"""
-    
-    if dre_data:
-        # Se tiver dados do período
-        if dre_data.get('period_start'):
-            prompt += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-� DRE DO PERÍODO: {dre_data.get('period_start')} até {dre_data.get('period_end')}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-💰 Receita Bruta: R$ {dre_data.get('gross_revenue', 0):,.2f}
-(-) Deduções: R$ {dre_data.get('deductions', 0):,.2f}
-= Receita Líquida: R$ {dre_data.get('net_revenue', 0):,.2f}
-
-(-) Custos: R$ {dre_data.get('costs', 0):,.2f}
-= Lucro Bruto: R$ {dre_data.get('gross_profit', 0):,.2f}
-
-(-) Despesas Operacionais: R$ {dre_data.get('expenses', 0):,.2f}
-= Lucro Líquido: R$ {dre_data.get('net_profit', 0):,.2f}
-
-� OBRIGAÇÕES FISCAIS:
-Total de obrigações: {dre_data.get('total_obligations', 0)}
-Urgentes (≤5 dias): {dre_data.get('urgent_obligations', 0)}
-
-"""
-        else:
-            # Dados simples de DRE
-            prompt += f"""💰 DRE RESUMIDO:
-Receita Bruta: R$ {dre_data.get('gross_revenue', 0):,.2f}
-Despesas: R$ {dre_data.get('expenses', 0):,.2f}
-Lucro Líquido: R$ {dre_data.get('net_profit', 0):,.2f}
-
-"""
-    
-    prompt += """━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ⚠️ INSTRUÇÕES DE RESPOSTA:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 🎯 FORMATO DE RESPOSTA:
 
 ✅ PERGUNTAS SOBRE DADOS DA EMPRESA:
-Use os números fornecidos acima, máximo 2-3 linhas.
+Use os números fornecidos abaixo, máximo 2-3 linhas.
 
 Exemplo:
 P: "Qual foi meu lucro líquido no período?"
@@ -435,11 +348,11 @@ R: "Para o regime do Simples Nacional Anexo III, a alíquota varia de 6% a 33% c
 🎯 FORMATO DE RESPOSTA:
 
 ✅ PERGUNTAS SOBRE DEMONSTRAÇÕES CONTÁBEIS:
-Use os números fornecidos acima, máximo 2-3 linhas.
+Use os números fornecidos abaixo, máximo 2-3 linhas.
 
 Exemplo:
 P: "Qual foi meu lucro líquido no período?"
-R: "No período de 01/01/2024 a 31/12/2024, o lucro líquido foi de R$ 125.000,00, conforme DRE acima."
+R: "No período de 01/01/2024 a 31/12/2024, o lucro líquido foi de R$ 125.000,00, conforme DRE abaixo."
 
 ✅ PERGUNTAS SOBRE LANÇAMENTOS CONTÁBEIS:
 Explique o procedimento, cite a base legal, mostre débito/crédito se necessário.
@@ -493,12 +406,52 @@ Resposta: "Esta pergunta é sobre gestão financeira. Por favor, consulte o Agen
 - Normas Brasileiras de Contabilidade
 """
     
-    return prompt
+    prompt = f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🏢 EMPRESA:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{company_data.get('name', 'N/A')}
+CNPJ: {company_data.get('cnpj', 'N/A')}
+Regime Tributário: {company_data.get('tax_regime', 'N/A')}
+
+"""
+    
+    if dre_data:
+        # Se tiver dados do período
+        if dre_data.get('period_start'):
+            prompt += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+� DRE DO PERÍODO: {dre_data.get('period_start')} até {dre_data.get('period_end')}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+💰 Receita Bruta: R$ {dre_data.get('gross_revenue', 0):,.2f}
+(-) Deduções: R$ {dre_data.get('deductions', 0):,.2f}
+= Receita Líquida: R$ {dre_data.get('net_revenue', 0):,.2f}
+
+(-) Custos: R$ {dre_data.get('costs', 0):,.2f}
+= Lucro Bruto: R$ {dre_data.get('gross_profit', 0):,.2f}
+
+(-) Despesas Operacionais: R$ {dre_data.get('expenses', 0):,.2f}
+= Lucro Líquido: R$ {dre_data.get('net_profit', 0):,.2f}
+
+� OBRIGAÇÕES FISCAIS:
+Total de obrigações: {dre_data.get('total_obligations', 0)}
+Urgentes (≤5 dias): {dre_data.get('urgent_obligations', 0)}
+
+"""
+        else:
+            # Dados simples de DRE
+            prompt += f"""💰 DRE RESUMIDO:
+Receita Bruta: R$ {dre_data.get('gross_revenue', 0):,.2f}
+Despesas: R$ {dre_data.get('expenses', 0):,.2f}
+Lucro Líquido: R$ {dre_data.get('net_profit', 0):,.2f}
+
+"""
+    
+    return instructions + PROMPT_CACHE_BREAK + prompt
 
 def create_financial_agent_prompt(company_data: dict, financial_data: dict = None, bank_accounts: list = None) -> str:
     """Cria prompt para o AGENTE FINANCEIRO - Especialista em Matemática Financeira"""
     
-    prompt = f"""Você é um ESPECIALISTA EM MATEMÁTICA FINANCEIRA e GESTÃO DE FLUXO DE CAIXA.
+    instructions = """Você é um ESPECIALISTA EM MATEMÁTICA FINANCEIRA e GESTÃO DE FLUXO DE CAIXA.
 
 🎯 SUA ESPECIALIDADE:
 - Análise de liquidez e solvência
@@ -527,6 +480,24 @@ def create_financial_agent_prompt(company_data: dict, financial_data: dict = Non
 - Resposta: máximo 3 linhas, objetiva e com números exatos
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ INSTRUÇÕES DE RESPOSTA:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎯 REGRAS OBRIGATÓRIAS:
+1. Use EXATAMENTE os números fornecidos abaixo - nunca invente ou estime
+2. SEMPRE mencione o período analisado na sua resposta
+3. Seja objetivo: máximo 2-3 linhas
+4. Se o valor for ZERO, diga explicitamente que é zero
+
+📊 TERMINOLOGIA IMPORTANTE:
+- "ATRASADAS" ou "VENCIDAS" = use o valor de "COM ATRASO" (já passou da data de vencimento e ainda não foi pago/recebido)
+- "NÃO PAGAS" = total em aberto (inclui atrasadas + pendentes)
+- "PENDENTES" = ainda não venceu (ainda está dentro do prazo)
+
+❌ NÃO responda sobre legislação fiscal - sugira consultar o agente contábil
+"""
+    
+    prompt = f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🏢 EMPRESA:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 {company_data.get('name', 'N/A')}
@@ -613,30 +584,12 @@ Variação: R$ {financial_data.get('projected_balance', 0) - financial_data.get(
 
 """
     
-    prompt += """━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ INSTRUÇÕES DE RESPOSTA:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🎯 REGRAS OBRIGATÓRIAS:
-1. Use EXATAMENTE os números fornecidos acima - nunca invente ou estime
-2. SEMPRE mencione o período analisado na sua resposta
-3. Seja objetivo: máximo 2-3 linhas
-4. Se o valor for ZERO, diga explicitamente que é zero
-
-📊 TERMINOLOGIA IMPORTANTE:
-- "ATRASADAS" ou "VENCIDAS" = use o valor de "COM ATRASO" (já passou da data de vencimento e ainda não foi pago/recebido)
-- "NÃO PAGAS" = total em aberto (inclui atrasadas + pendentes)
-- "PENDENTES" = ainda não venceu (ainda está dentro do prazo)
-
-❌ NÃO responda sobre legislação fiscal - sugira consultar o agente contábil
-"""
-    
-    return prompt
+    return instructions + PROMPT_CACHE_BREAK + prompt
 
 def create_fiscal_agent_prompt(company_data: dict, fiscal_data: dict = None) -> str:
     """Cria prompt para o AGENTE FISCAL - Consultor em Regime Tributário e Legislação Fiscal"""
     
-    prompt = f"""Você é um ESPECIALISTA EM REGIME TRIBUTÁRIO E LEGISLAÇÃO FISCAL BRASILEIRA (Federal, Estadual e Municipal).
+    instructions = """Você é um ESPECIALISTA EM REGIME TRIBUTÁRIO E LEGISLAÇÃO FISCAL BRASILEIRA (Federal, Estadual e Municipal).
 
 🎯 SUA ESPECIALIDADE:
 - Regime de tributação (Simples Nacional, Lucro Presumido, Lucro Real, MEI)
@@ -677,65 +630,6 @@ def create_fiscal_agent_prompt(company_data: dict, fiscal_data: dict = None) ->
 - Responda em português brasileiro
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🏢 EMPRESA:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{company_data.get('name', 'N/A')}
-CNPJ: {company_data.get('cnpj', 'N/A')}
-Regime Tributário: {company_data.get('tax_regime', 'N/A')}
-
-"""
-    
-    if fiscal_data:
-        prompt += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📊 ANÁLISE FISCAL DO PERÍODO: {fiscal_data.get('period_start')} até {fiscal_data.get('period_end')}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-💰 FATURAMENTO E REGIME:
-Receita Bruta do Período: R$ {fiscal_data.get('gross_revenue', 0):,.2f}
-Receita Bruta Últimos 12 Meses: R$ {fiscal_data.get('revenue_12m', 0):,.2f}
-Regime Atual: {fiscal_data.get('current_regime', 'N/A')}
-Limite do Regime: R$ {fiscal_data.get('regime_limit', 0):,.2f}
-% Atingido: {fiscal_data.get('regime_percentage', 0):.1f}%
-
-"""
-        
-        # ALERTAS DE REGIME
-        if fiscal_data.get('regime_percentage', 0) >= 80:
-            prompt += f"""⚠️ ALERTA CRÍTICO: Faturamento atingiu {fiscal_data.get('regime_percentage', 0):.1f}% do limite do {fiscal_data.get('current_regime')}!
-Faltam apenas R$ {fiscal_data.get('remaining_to_limit', 0):,.2f} para ultrapassar o limite.
-AÇÃO NECESSÁRIA: Analisar mudança de regime ou estratégias de elisão fiscal.
-
-"""
-        
-        # OBRIGAÇÕES DO PERÍODO
-        if fiscal_data.get('obligations'):
-            prompt += f"""📅 OBRIGAÇÕES FISCAIS DO PERÍODO:
-Total de obrigações: {fiscal_data.get('total_obligations', 0)}
-Urgentes (≤5 dias): {fiscal_data.get('urgent_obligations', 0)}
-Atenção (6-15 dias): {fiscal_data.get('warning_obligations', 0)}
-Normal (>15 dias): {fiscal_data.get('normal_obligations', 0)}
-
-Obrigações Detalhadas:
-"""
-            for obl in fiscal_data.get('obligations', [])[:5]:  # Mostra até 5 obrigações
-                days_left = obl.get('days_left', 0)
-                prompt += f"  • {obl.get('type', 'N/A')} - Vencimento: {obl.get('due_date', 'N/A')} ({days_left} dias) - R$ {obl.get('amount', 0):,.2f}\n"
-            
-            prompt += "\n"
-        
-        # ANÁLISE TRIBUTÁRIA
-        if fiscal_data.get('tax_analysis'):
-            tax = fiscal_data['tax_analysis']
-            prompt += f"""💳 ANÁLISE TRIBUTÁRIA ESTIMADA (Período):
-Simples Nacional: R$ {tax.get('simples', 0):,.2f} ({tax.get('simples_rate', 0):.2f}%)
-Lucro Presumido: R$ {tax.get('presumido', 0):,.2f} ({tax.get('presumido_rate', 0):.2f}%)
-Lucro Real: R$ {tax.get('real', 0):,.2f} ({tax.get('real_rate', 0):.2f}%)
-
-💡 Regime Mais Vantajoso: {tax.get('best_regime', 'N/A')} (Economia: R$ {tax.get('savings', 0):,.2f})
-
-"""
-    
-    prompt += """━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ⚠️ INSTRUÇÕES DE RESPOSTA:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
@@ -801,7 +695,66 @@ Resposta: "Esta pergunta é sobre gestão financeira. Por favor, consulte o Agen
 ⚠️ IMPORTANTE: Elisão fiscal (legal) ≠ Evasão fiscal (crime). Sempre sugira estratégias dentro da lei.
 """
     
-    return prompt
+    prompt = f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🏢 EMPRESA:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{company_data.get('name', 'N/A')}
+CNPJ: {company_data.get('cnpj', 'N/A')}
+Regime Tributário: {company_data.get('tax_regime', 'N/A')}
+
+"""
+    
+    if fiscal_data:
+        prompt += f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📊 ANÁLISE FISCAL DO PERÍODO: {fiscal_data.get('period_start')} até {fiscal_data.get('period_end')}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+💰 FATURAMENTO E REGIME:
+Receita Bruta do Período: R$ {fiscal_data.get('gross_revenue', 0):,.2f}
+Receita Bruta Últimos 12 Meses: R$ {fiscal_data.get('revenue_12m', 0):,.2f}
+Regime Atual: {fiscal_data.get('current_regime', 'N/A')}
+Limite do Regime: R$ {fiscal_data.get('regime_limit', 0):,.2f}
+% Atingido: {fiscal_data.get('regime_percentage', 0):.1f}%
+
+"""
+        
+        # ALERTAS DE REGIME
+        if fiscal_data.get('regime_percentage', 0) >= 80:
+            prompt += f"""⚠️ ALERTA CRÍTICO: Faturamento atingiu {fiscal_data.get('regime_percentage', 0):.1f}% do limite do {fiscal_data.get('current_regime')}!
+Faltam apenas R$ {fiscal_data.get('remaining_to_limit', 0):,.2f} para ultrapassar o limite.
+AÇÃO NECESSÁRIA: Analisar mudança de regime ou estratégias de elisão fiscal.
+
+"""
+        
+        # OBRIGAÇÕES DO PERÍODO
+        if fiscal_data.get('obligations'):
+            prompt += f"""📅 OBRIGAÇÕES FISCAIS DO PERÍODO:
+Total de obrigações: {fiscal_data.get('total_obligations', 0)}
+Urgentes (≤5 dias): {fiscal_data.get('urgent_obligations', 0)}
+Atenção (6-15 dias): {fiscal_data.get('warning_obligations', 0)}
+Normal (>15 dias): {fiscal_data.get('normal_obligations', 0)}
+
+Obrigações Detalhadas:
+"""
+            for obl in fiscal_data.get('obligations', [])[:5]:  # Mostra até 5 obrigações
+                days_left = obl.get('days_left', 0)
+                prompt += f"  • {obl.get('type', 'N/A')} - Vencimento: {obl.get('due_date', 'N/A')} ({days_left} dias) - R$ {obl.get('amount', 0):,.2f}\n"
+            
+            prompt += "\n"
+        
+        # ANÁLISE TRIBUTÁRIA
+        if fiscal_data.get('tax_analysis'):
+            tax = fiscal_data['tax_analysis']
+            prompt += f"""💳 ANÁLISE TRIBUTÁRIA ESTIMADA (Período):
+Simples Nacional: R$ {tax.get('simples', 0):,.2f} ({tax.get('simples_rate', 0):.2f}%)
+Lucro Presumido: R$ {tax.get('presumido', 0):,.2f} ({tax.get('presumido_rate', 0):.2f}%)
+Lucro Real: R$ {tax.get('real', 0):,.2f} ({tax.get('real_rate', 0):.2f}%)
+
+💡 Regime Mais Vantajoso: {tax.get('best_regime', 'N/A')} (Economia: R$ {tax.get('savings', 0):,.2f})
+
+"""
+    
+    return instructions + PROMPT_CACHE_BREAK + prompt
 
 def apply_futuristic_theme():
     """Aplica tema futurístico moderno"""
@@ -1088,8 +1041,8 @@ def init_session_state():
         'current_page': 'login',
         'ai_client': None,
         'ai_model_type': None,
-        'chat_history': None,
-        'messages': [],
+        # Chave da API só em memória (enviada aos processos de análise de documentos, nunca gravada)
+        'ai_api_key_value': None,
         # Financeiro: por padrão usar a data de hoje (saldos bancários) e listas padrão (próximas 10)
         'financial_date_range': (datetime.now().date(), datetime.now().date()),
         'financial_date_range_user_set': False,
@@ -1115,6 +1068,217 @@ init_session_state()
 # Aplica tema futurístico
 apply_futuristic_theme()
 
+# ==========================================
+# CACHE DA SESSÃO (ORÇAMENTO DE MEMÓRIA)
+# ==========================================
+
+# Orçamento de memória por sessão (MB), configurável por variável de ambiente
+SESSION_CACHE_BUDGET = int(os.getenv('CONTAI_SESSION_CACHE_MB', '64')) * 1024 * 1024
+
+# Número máximo de mensagens mantidas no histórico de cada agente
+AGENT_HISTORY_MAX_MESSAGES = 100
+
+def get_session_cache() -> SessionCache:
+    """Retorna o cache da sessão (LRU com orçamento de bytes) onde ficam todos os caches do app"""
+    if 'session_cache' not in st.session_state:
+        st.session_state.session_cache = SessionCache(SESSION_CACHE_BUDGET)
+    return st.session_state.session_cache
+
+def estimate_chat_history_size(chat_history) -> int:
+    """Estima o tamanho de um objeto de chat (ex.: sessão do Gemini) pelo seu histórico"""
+    history = getattr(chat_history, 'history', None) or []
+    return approx_size(chat_history) + sum(len(str(message)) for message in history)
+
+def get_agent_messages(key: str) -> list:
+    """Lista de mensagens exibidas de um agente (limitada a AGENT_HISTORY_MAX_MESSAGES)"""
+    return get_session_cache().get_or_create(key, list, max_items=AGENT_HISTORY_MAX_MESSAGES)
+
+def get_agent_chat_history(key: str):
+    """Objeto de histórico do provedor de IA (None se não existir ou tiver sido despejado)"""
+    return get_session_cache().get(key)
+
+def set_agent_chat_history(key: str, chat_history):
+    if chat_history is None:
+        get_session_cache().pop(key)
+    else:
+        get_session_cache().set(key, chat_history, size_of=estimate_chat_history_size)
+
+def reset_agent_conversation(messages_key: str, history_key: str):
+    """Limpa as mensagens e o histórico de um agente"""
+    cache = get_session_cache()
+    cache.set(messages_key, [], max_items=AGENT_HISTORY_MAX_MESSAGES)
+    cache.pop(history_key)
+
+def get_document_queue() -> list:
+    """Fila de documentos aguardando aprovação (entrada fixada, nunca despejada)"""
+    return get_session_cache().get_or_create('document_processing_queue', list, pinned=True)
+
+def set_document_queue(documents: list):
+    get_session_cache().set('document_processing_queue', documents, pinned=True)
+
+def mark_document_processed(document: dict, status: str = None):
+    """
+    Marca o documento como processado e libera os bytes do arquivo original.
+    Com `status` (aprovado/rejeitado), atualiza também o índice de documentos
+    usado na detecção de duplicatas
+    """
+    document['processed'] = True
+    document.pop('file_bytes', None)
+    if status and st.session_state.company:
+        set_document_status(st.session_state.company.get('cnpj'), document.get('upload_id'), status)
+    if document.get('job_id'):
+        get_job_store().mark_consumed(document['job_id'])
+
+# ==========================================
+# CACHE DE DADOS POR PERÍODO
+# ==========================================
+
+DRE_FIELDS = ['gross_revenue', 'deductions', 'net_revenue', 'costs', 'gross_profit', 'expenses', 'net_profit']
+
+# Data inicial considerada no cálculo de saldos bancários (todo o histórico)
+BANK_HISTORY_START = datetime(1900, 1, 1).date()
+
+# Segundos até a cobertura dos caches particionados expirar (alterações feitas fora do app)
+PARTITION_MAX_AGE = SHARED_CACHE_TTL
+
+def get_partition_cache(entity: str, owner_id, granularity: str = 'month') -> PartitionedRangeCache:
+    """
+    Retorna (criando se necessário) o cache particionado da sessão para a empresa/conta.
+    O cache é invalidado pelas escritas publicadas para a mesma entidade e empresa/conta
+    (inclusive em outros processos, pela versão do cache compartilhado) e expira após PARTITION_MAX_AGE.
+    """
+    return get_session_cache().get_or_create(
+        f"{entity}_partitions_{owner_id}",
+        lambda: PartitionedRangeCache(granularity, entity=entity, scope=owner_id, max_age=PARTITION_MAX_AGE),
+        size_of=lambda cache: cache.estimated_size()
+    )
+
+def get_monthly_dre(company_id, start_date, end_date) -> dict:
+    """Retorna {mês: DRE} do período, buscando no banco apenas os meses ainda não carregados"""
+    cache = get_partition_cache('dre', company_id, 'month')
+    return cache.get_range(start_date, end_date, lambda first, last: get_or_create_dre_range(company_id, first, last))
+
+def get_period_dre_totals(company_id, start_date, end_date) -> dict:
+    """Soma os campos da DRE de todos os meses do período a partir das partições em cache"""
+    monthly = get_monthly_dre(company_id, start_date, end_date)
+    totals = {field: 0 for field in DRE_FIELDS}
+    for month in iter_months(start_date, end_date):
+        month_dre = monthly.get(month, {})
+        for field in DRE_FIELDS:
+            totals[field] += month_dre.get(field, 0) or 0
+    return totals
+
+# Limites da pré-busca especulativa de períodos
+PREFETCH_MAX_WORKERS = 1
+PREFETCH_MAX_PENDING = 16
+PREFETCH_MEMORY_BUDGET = 32 * 1024 * 1024  # 32 MB por sessão
+
+def get_prefetcher() -> Prefetcher:
+    """Retorna o prefetcher da sessão (threads em segundo plano)"""
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = Prefetcher(
+            max_workers=PREFETCH_MAX_WORKERS,
+            max_pending=PREFETCH_MAX_PENDING,
+            memory_budget_bytes=PREFETCH_MEMORY_BUDGET
+        )
+    return st.session_state.prefetcher
+
+def get_adjacent_periods(start_date, end_date) -> list:
+    """Retorna os períodos anterior e seguinte com a mesma duração do período informado"""
+    length = end_date - start_date
+    previous_end = start_date - timedelta(days=1)
+    next_start = end_date + timedelta(days=1)
+    return [
+        (previous_end - length, previous_end),
+        (next_start, next_start + length)
+    ]
+
+def get_last_12_months_window(end_date) -> tuple:
+    """Período usado no cálculo da receita dos últimos 12 meses"""
+    start_date = end_date.replace(day=1)
+    if start_date.month <= 12:
+        start_date = start_date.replace(year=start_date.year - 1, month=start_date.month)
+    else:
+        start_date = start_date.replace(month=start_date.month - 12)
+    return start_date, end_date
+
+def schedule_period_prefetch():
+    """
+    Agenda a pré-busca dos períodos vizinhos aos exibidos nos dashboards.
+    Executado ao final da renderização; cancela a pré-busca anterior (o usuário já mudou de período).
+    """
+    company = st.session_state.get('company')
+    if not company:
+        return
+    
+    company_id = company['id']
+    prefetcher = get_prefetcher()
+    prefetcher.cancel()
+    
+    # DREs mensais: sem criar registros para meses ainda inexistentes
+    dre_cache = get_partition_cache('dre', company_id, 'month')
+    fetch_dre = lambda first, last: get_dre_range(company_id, first, last)
+    
+    periods = []
+    for module in ('financial', 'accounting', 'fiscal'):
+        date_range = st.session_state.get(f"{module}_date_range")
+        if not date_range or len(date_range) != 2:
+            continue
+        adjacent = get_adjacent_periods(*date_range)
+        periods.extend(adjacent)
+        if module == 'fiscal':
+            # Receita dos últimos 12 meses usada no enquadramento do regime tributário
+            periods.extend(get_last_12_months_window(period_end) for _, period_end in adjacent)
+    
+    for period_start, period_end in periods:
+        prefetcher.prefetch_range(dre_cache, period_start, period_end, fetch_dre)
+    
+    # Saldos bancários do próximo período do dashboard financeiro, para as contas já exibidas
+    # (sem consultar o banco aqui) e só até hoje: dias futuros ainda podem receber lançamentos
+    financial_range = st.session_state.get('financial_date_range')
+    account_ids = st.session_state.get('bank_accounts_shown', {}).get(company_id, [])
+    if financial_range and len(financial_range) == 2 and account_ids:
+        _, next_end = get_adjacent_periods(*financial_range)[1]
+        prefetch_end = min(next_end, datetime.now().date())
+        for account_id in account_ids:
+            prefetcher.prefetch_range(
+                get_partition_cache('bank_transactions', account_id, 'day'),
+                BANK_HISTORY_START,
+                prefetch_end,
+                lambda first, last, account_id=account_id: get_bank_daily_movements(account_id, first, last),
+                cover_span=True
+            )
+
+def get_bank_balances_asof_cached(company_id, as_of) -> list:
+    """
+    Saldos das contas bancárias até a data informada (inclusive).
+    Usa partições diárias de movimentações: ao mudar a data, busca apenas os dias ainda não carregados.
+    As contas exibidas ficam na sessão para a pré-busca do período seguinte.
+    """
+    result = []
+    accounts = list_bank_accounts(company_id)
+    st.session_state.setdefault('bank_accounts_shown', {})[company_id] = [acc['id'] for acc in accounts]
+    for acc in accounts:
+        cache = get_partition_cache('bank_transactions', acc['id'], 'day')
+        movements = cache.get_range(
+            BANK_HISTORY_START,
+            as_of,
+            lambda first, last, account_id=acc['id']: get_bank_daily_movements(account_id, first, last)
+        )
+        
+        try:
+            initial = float(acc.get('initial_balance') or 0)
+        except Exception:
+            initial = 0.0
+        
+        computed = initial + sum(movements.values())
+        new_acc = dict(acc)
+        new_acc['balance_as_of'] = computed
+        new_acc['balance'] = computed
+        result.append(new_acc)
+    
+    return result
+
 # ==========================================
 # MÓDULO FINANCEIRO
 # ==========================================
@@ -1138,58 +1302,12 @@ def show_financial_dashboard():
     start_date, end_date = st.session_state.financial_date_range
     user_set_range = st.session_state.get('financial_date_range_user_set', False)
 
-    # Define a chave do cache financeiro
-    financial_cache = "financial_dre_data"
-    date_key = f"{start_date}_{end_date}"
-    
-    # Inicializa o cache se não existir
-    if financial_cache not in st.session_state:
-        st.session_state[financial_cache] = {}
-    
-    # Se não tiver em cache ou as datas mudaram, recalcula
-    if date_key not in st.session_state[financial_cache]:
-        with st.spinner("Carregando dados financeiros..."):
-            total_revenue = 0
-            total_expenses = 0
-            total_profit = 0
-            
-            # Itera pelos meses do período
-            current_date = start_date.replace(day=1)
-            end_month = end_date.replace(day=1)
-            
-            while current_date <= end_month:
-                month_str = current_date.strftime('%Y-%m-01')
-                dre = get_or_create_dre(company['id'], month_str)
-                
-                total_revenue += dre.get('gross_revenue', 0)
-                total_expenses += dre.get('expenses', 0)
-                total_profit += dre.get('net_profit', 0)
-                
-                # Próximo mês
-                if current_date.month == 12:
-                    current_date = current_date.replace(year=current_date.year + 1, month=1)
-                else:
-                    current_date = current_date.replace(month=current_date.month + 1)
-            
-            # Salva no cache
-            st.session_state[financial_cache][date_key] = {
-                'total_revenue': total_revenue,
-                'total_expenses': total_expenses,
-                'total_profit': total_profit
-            }
-    
-    # Usa os dados do cache
-    data = st.session_state[financial_cache][date_key]
-    total_revenue = data['total_revenue']
-    total_expenses = data['total_expenses']
-    total_profit = data['total_profit']
-    
     # ===== SEÇÃO 1: CONTAS BANCÁRIAS =====
     st.markdown('<div class="section-header">🏦 Contas Bancárias</div>', unsafe_allow_html=True)
     
     # Saldos bancários: por padrão usar "hoje"; se usuário mudou o range, usa a data final selecionada
     as_of_date = end_date if user_set_range else datetime.now().date()
-    bank_accounts = get_bank_account_balances_asof(company['id'], as_of_date)
+    bank_accounts = get_bank_balances_asof_cached(company['id'], as_of_date)
     
     if not bank_accounts:
         st.info("Não há contas bancárias cadastradas.")
@@ -1444,27 +1562,26 @@ def show_financial_dashboard():
         """, unsafe_allow_html=True)
         
         # Inicializa histórico de mensagens específico do agente financeiro
-        if 'financial_agent_messages' not in st.session_state:
-            st.session_state.financial_agent_messages = []
+        agent_messages = get_agent_messages('financial_agent_messages')
         
         # Botão de reset
         col_reset1, col_reset2 = st.columns([5, 1])
         with col_reset2:
             if st.button("🔄 Limpar", key="reset_financial_chat", use_container_width=True):
-                st.session_state.financial_agent_messages = []
-                st.session_state.financial_agent_chat_history = None
+                reset_agent_conversation('financial_agent_messages', 'financial_agent_chat_history')
                 st.rerun()
         
         # Container com altura fixa e scroll (usando componente nativo do Streamlit)
-        with st.container(height=300):
-            for message in st.session_state.financial_agent_messages:
+        messages_container = st.container(height=300)
+        with messages_container:
+            for message in agent_messages:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
         
         # Input de chat
         if prompt := st.chat_input("Pergunte sobre fluxo de caixa, contas, projeções, riscos financeiros...", key="financial_agent_input"):
             # Adiciona mensagem do usuário
-            st.session_state.financial_agent_messages.append({"role": "user", "content": prompt})
+            agent_messages.append({"role": "user", "content": prompt})
             
             # Coleta dados do período SELECIONADO PELO USUÁRIO para o agente
             from datetime import timedelta
@@ -1662,7 +1779,7 @@ def show_financial_dashboard():
                 st.warning(f"⚠️ **Atenção**: Não há contas cadastradas para o período **{period_start.strftime('%d/%m/%Y')} a {period_end.strftime('%d/%m/%Y')}**. Tente selecionar outro período usando o filtro de datas no topo da página.")
                 # Adiciona resposta automática ao histórico
                 auto_response = f"Não há contas cadastradas para o período {period_start.strftime('%d/%m/%Y')} a {period_end.strftime('%d/%m/%Y')}. Por favor, selecione outro período usando o filtro de datas no topo da página para ver os dados disponíveis."
-                st.session_state.financial_agent_messages.append({"role": "assistant", "content": auto_response})
+                agent_messages.append({"role": "assistant", "content": auto_response})
                 st.rerun()
             
             # Saldo total bancário
@@ -1726,20 +1843,25 @@ def show_financial_dashboard():
                 bank_accounts=bank_accounts
             )
             
-            # Chama a IA
-            with st.spinner("🤔 Analisando dados financeiros..."):
-                response, chat_history = chat_with_ai(
-                    st.session_state.ai_client,
-                    st.session_state.ai_model_type,
-                    system_prompt,
-                    prompt,
-                    st.session_state.get('financial_agent_chat_history')
-                )
-                
-                st.session_state.financial_agent_chat_history = chat_history
+            # Chama a IA: a resposta aparece no quadro de mensagens à medida que é gerada
+            with messages_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+                with st.chat_message("assistant"):
+                    stream = chat_with_ai_stream(
+                        st.session_state.ai_client,
+                        st.session_state.ai_model_type,
+                        system_prompt,
+                        prompt,
+                        get_agent_chat_history('financial_agent_chat_history')
+                    )
+                    st.write_stream(stream)
+            
+            response = stream.text
+            set_agent_chat_history('financial_agent_chat_history', stream.chat_history)
             
             # Adiciona resposta ao histórico
-            st.session_state.financial_agent_messages.append({"role": "assistant", "content": response})
+            agent_messages.append({"role": "assistant", "content": response})
             st.rerun()
 
 # ==========================================
@@ -1999,6 +2121,7 @@ def show_sidebar():
                             if client:
                                 st.session_state.ai_client = client
                                 st.session_state.ai_model_type = model_map[model_choice]
+                                st.session_state.ai_api_key_value = api_key_input
                                 # Recolhe automaticamente após conectar
                                 st.session_state.sidebar_expanded['ai_config'] = False
                                 st.success("✅ IA Conectada!")
@@ -2155,6 +2278,7 @@ def show_employee_management():
                             # Atualiza para is_active = False
                             try:
                                 supabase.table('employees').update({'is_active': False}).eq('id', emp['id']).execute()
+                                publish(company_id, 'employees')
                                 st.success("✅ Funcionário desativado com sucesso!")
                                 st.rerun()
                             except Exception as e:
@@ -2323,6 +2447,59 @@ def show_user_management():
     else:
         st.info("👤 **Seu nível de acesso:** Geral (permissões limitadas)")
     
+    # Diagnóstico dos caches da sessão (memória e contadores)
+    if is_senior:
+        with st.expander("📈 Uso de memória dos caches"):
+            session_stats = get_session_cache().stats()
+            global_stats = SessionCache.global_stats()
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Sessão", f"{session_stats['bytes'] / 1024 / 1024:.1f} MB",
+                          help=f"Orçamento: {session_stats['budget_bytes'] / 1024 / 1024:.0f} MB")
+            with col2:
+                st.metric("Acertos / Falhas", f"{session_stats['hits']} / {session_stats['misses']}")
+            with col3:
+                st.metric("Despejos", session_stats['evictions'])
+            with col4:
+                st.metric("Sessões ativas", global_stats['sessions'],
+                          help=f"Total no processo: {global_stats['bytes'] / 1024 / 1024:.1f} MB, {global_stats['evictions']} despejos")
+            
+            shared_stats = get_shared_cache().stats()
+            st.caption(
+                f"Cache compartilhado ({shared_stats['backend']}): {shared_stats['hits']} acertos, "
+                f"{shared_stats['misses']} falhas, {shared_stats['invalidations']} invalidações, {shared_stats['errors']} erros"
+            )
+            
+            try:
+                cascade_stats = get_cascade_stats().summary()
+            except Exception as e:
+                print(f"⚠️ Erro ao ler estatísticas da cascata: {e}")
+                cascade_stats = []
+            if cascade_stats:
+                st.caption("Análise de documentos por IA: " + " | ".join(
+                    f"{stats['model_type']}/{stats['stage']} ({stats['model']}): {stats['calls']} chamada(s), "
+                    f"{stats['avg_seconds']:.1f} s/chamada, US$ {stats['cost']:.4f}, "
+                    f"{stats['escalation_rate'] * 100:.0f}% escalonadas"
+                    for stats in cascade_stats
+                ))
+            
+            pdf_timings = get_pdf_backend_timings()
+            if pdf_timings:
+                st.caption("Extração de texto de PDF: " + " | ".join(
+                    f"{name}: {stats['documents']} doc(s), {stats['ms_per_page']:.1f} ms/página, {stats['failures']} falha(s)"
+                    for name, stats in pdf_timings.items()
+                ))
+            
+            if session_stats['sizes']:
+                st.dataframe(
+                    pd.DataFrame(
+                        [{'Chave': key, 'KB': round(size / 1024, 1)} for key, size in session_stats['sizes'].items()]
+                    ).sort_values('KB', ascending=False),
+                    use_container_width=True,
+                    hide_index=True
+                )
+    
     # Tabs
     tab_list, tab_new, tab_approvals = st.tabs([
         "📋 Usuários Cadastrados", 
@@ -2744,6 +2921,7 @@ Verifique:
                     if st.session_state.company:
                         try:
                             supabase.table('companies').update(company_data).eq('id', st.session_state.company['id']).execute()
+                            publish(st.session_state.company['id'], 'companies')
                             st.success("✅ Empresa atualizada!")
                             st.session_state.company.update(company_data)
                             st.rerun()
@@ -2877,320 +3055,195 @@ def calculate_lucro_real_tax(revenue: float, expenses: float, atividade: str = '
 def get_revenue_last_12_months(company_id: int, end_date: date) -> float:
     """Calcula receita bruta dos últimos 12 meses"""
     # Calcula data de início (12 meses atrás)
-    start_date = end_date.replace(day=1)
-    if start_date.month <= 12:
-        start_date = start_date.replace(year=start_date.year - 1, month=start_date.month)
-    else:
-        start_date = start_date.replace(month=start_date.month - 12)
-    
-    # Soma receita bruta de todos os meses
-    total_revenue = 0
-    current_date = start_date
-    
-    while current_date <= end_date.replace(day=1):
-        month_str = current_date.strftime('%Y-%m-01')
-        month_dre = get_or_create_dre(company_id, month_str)
-        total_revenue += month_dre.get('gross_revenue', 0)
-        
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year + 1, month=1)
-        else:
-            current_date = current_date.replace(month=current_date.month + 1)
+    start_date, end_date = get_last_12_months_window(end_date)
     
-    return total_revenue
+    # Soma receita bruta de todos os meses (a partir das DREs mensais em cache)
+    return get_period_dre_totals(company_id, start_date, end_date)['gross_revenue']
 
 # ==========================================
 # SISTEMA DE PROCESSAMENTO DE DOCUMENTOS COM IA
 # ==========================================
 
-def create_document_analysis_prompt(file_name: str, file_type: str, content_preview: str = "") -> str:
-    """Cria prompt para o agente de análise de documentos"""
-    
-    prompt = f"""Você é um AGENTE ESPECIALISTA em CIÊNCIA DE DADOS e ANÁLISE DOCUMENTAL FISCAL/CONTÁBIL.
-
-🎯 SUA MISSÃO:
-Analisar documentos fiscais, contábeis e financeiros e extrair informações estruturadas para cadastro em banco de dados.
-
-📋 TIPOS DE DOCUMENTOS QUE VOCÊ PROCESSA:
-1. **Notas Fiscais** (NF-e, NFS-e) - XML ou PDF
-2. **Extratos Bancários** - PDF ou CSV
-3. **Guias de Impostos** (DAS, DARF, GPS, GARE) - PDF
-4. **Boletos Bancários** - PDF
-5. **Recibos e Comprovantes** - PDF, imagem
-
-⚙️ PROTOCOLO DE ANÁLISE:
-
-**PASSO 1: IDENTIFICAÇÃO DO DOCUMENTO**
-Identifique o tipo de documento analisando:
-- Cabeçalhos e títulos
-- Campos obrigatórios
-- Layout e estrutura
-- Palavras-chave específicas
-
-**PASSO 2: EXTRAÇÃO DE DADOS**
-Extraia TODAS as informações relevantes em formato JSON estruturado.
-
-**PASSO 3: VALIDAÇÃO**
-Verifique se todos os campos obrigatórios foram identificados.
-Se algum campo estiver FALTANDO ou INCERTO, marque como "PENDENTE_CONFIRMACAO".
-
-**PASSO 4: MAPEAMENTO PARA BANCO DE DADOS**
-Determine a tabela de destino e os campos correspondentes.
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📄 DOCUMENTO ATUAL:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-Nome do Arquivo: {file_name}
-Tipo de Arquivo: {file_type}
-
-{f"Prévia do Conteúdo:\\n{content_preview[:1000]}..." if content_preview else ""}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📊 FORMATO DE RESPOSTA ESPERADO:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# Intervalo de consulta do estado dos jobs de documentos (segundos)
+DOCUMENT_JOBS_POLL_SECONDS = 2
 
-Responda APENAS com um JSON no seguinte formato:
-
-{{
-    "tipo_documento": "NOTA_FISCAL | EXTRATO_BANCARIO | GUIA_IMPOSTO | BOLETO | RECIBO | OUTRO",
-    "confianca": 0.95,
-    "tabela_destino": "accounts_payable | accounts_receivable | bank_transactions | tax_obligations",
-    "dados_extraidos": {{
-        "campo1": "valor1",
-        "campo2": "valor2",
-        ...
-    }},
-    "campos_pendentes": [
-        {{
-            "campo": "nome_do_campo",
-            "motivo": "Não encontrado no documento",
-            "sugestao": "Valor sugerido (se houver)"
-        }}
-    ],
-    "validacao": {{
-        "completo": true/false,
-        "erros": ["lista de erros se houver"],
-        "avisos": ["lista de avisos se houver"]
-    }},
-    "acao_recomendada": "CADASTRAR_AUTOMATICO | SOLICITAR_CONFIRMACAO | SOLICITAR_APROVACAO"
-}}
+def get_document_job_owner() -> str:
+    """Dono dos jobs de documentos: usuário + empresa (sobrevive a reconexões do navegador)"""
+    return f"{st.session_state.user['id']}:{st.session_state.company['id']}"
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🗂️ MAPEAMENTO DE CAMPOS POR TIPO:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-**NOTA FISCAL → accounts_payable (se compra) ou accounts_receivable (se venda)**
-- description: Descrição da NF
-- amount: Valor total
-- due_date: Data de vencimento
-- emission_date: Data de emissão
-- supplier/customer: Fornecedor ou Cliente
-- document_number: Número da NF
-- category: Categoria fiscal
-
-**EXTRATO BANCÁRIO → bank_transactions**
-- transaction_date: Data da transação
-- description: Descrição
-- amount: Valor (positivo=entrada, negativo=saída)
-- balance: Saldo
-- category: Categoria da transação
-
-**GUIA DE IMPOSTO → tax_obligations**
-- obligation_type: Tipo (DAS, DARF, etc)
-- due_date: Vencimento
-- amount: Valor
-- reference_period: Período de referência
-- status: Situação
-
-**BOLETO → accounts_payable**
-- description: Descrição do boleto
-- amount: Valor
-- due_date: Vencimento
-- supplier: Beneficiário
-- barcode: Código de barras
-- document_number: Nosso número
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-⚠️ REGRAS CRÍTICAS:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-1. SEMPRE responda APENAS com JSON válido (sem explicações adicionais)
-2. Se não tiver CERTEZA (confiança < 70%), marque como PENDENTE_CONFIRMACAO
-3. Datas devem estar no formato YYYY-MM-DD
-4. Valores monetários devem ser números decimais (sem R$, pontos ou vírgulas)
-5. Para campos obrigatórios ausentes, SEMPRE peça confirmação
-6. Se o documento for ilegível ou corrompido, retorne erro claro
-
-Agora analise o documento e retorne o JSON estruturado.
-"""
+def train_document_classifier():
+    """Treina novamente o classificador local de documentos da empresa, se o modelo salvo estiver velho"""
+    company = st.session_state.company
+    if not company or not classifier_is_stale(company.get('cnpj')):
+        return
     
-    return prompt
+    # Exemplos: solicitações aprovadas por um Senior e documentos aprovados diretamente
+    analyses = [
+        {**(request.get('ai_analysis') or {}), 'tipo_documento': request.get('document_type')}
+        for request in get_approved_requests(company['id'])
+    ]
+    analyses.extend(approved_analyses(company.get('cnpj')))
+    train_classifier(company.get('cnpj'), analyses)
 
-def extract_text_from_pdf(file_bytes) -> str:
-    """Extrai texto de PDF usando pdfplumber (melhor que PyPDF2)"""
+def process_uploaded_documents(uploaded_files):
+    """Envia os documentos para a fila de processamento em segundo plano (extração + IA)"""
+    
+    if not st.session_state.ai_client or not st.session_state.ai_api_key_value:
+        st.error("❌ Configure um modelo de IA primeiro para processar documentos!")
+        return
+    
+    if not st.session_state.company:
+        st.error("❌ Cadastre sua empresa primeiro!")
+        return
+    
     try:
-        import pdfplumber
-        from io import BytesIO
+        train_document_classifier()
         
-        text = ""
-        with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        # Arquivos vão para o disco em blocos; a sessão e os jobs guardam só o identificador (hash)
+        upload_store = get_upload_store()
+        files = []
+        for uploaded_file in uploaded_files:
+            uploaded_file.seek(0)
+            upload_id = upload_store.spool(uploaded_file)
+            if any(upload_id == queued_id for _, _, queued_id in files):
+                st.warning(f"⚠️ {uploaded_file.name} é uma cópia de outro arquivo deste envio e foi ignorado")
+                continue
+            files.append((uploaded_file.name, uploaded_file.type, upload_id))
         
-        if text.strip():
-            return text
-        else:
-            # Se não conseguiu extrair texto, tenta OCR
-            return extract_text_from_pdf_with_ocr(file_bytes)
+        submit_document_jobs(
+            get_document_job_owner(),
+            st.session_state.company.get('cnpj'),
+            files,
+            st.session_state.ai_model_type,
+            st.session_state.ai_api_key_value
+        )
     except Exception as e:
-        st.warning(f"⚠️ Erro ao extrair texto do PDF: {str(e)}. Tentando OCR...")
-        return extract_text_from_pdf_with_ocr(file_bytes)
+        st.error(f"❌ Erro ao enviar documentos para processamento: {str(e)}")
+        return
+    
+    st.session_state.sidebar_expanded['uploads'] = False
+    st.rerun()
 
-def extract_text_from_pdf_with_ocr(file_bytes) -> str:
-    """Extrai texto de PDF usando OCR (para PDFs escaneados)"""
+def sync_document_jobs() -> list:
+    """
+    Traz para a fila de aprovação os jobs concluídos que ainda não estão nela
+    (inclusive os de sessões anteriores) e devolve os jobs ainda em andamento
+    """
+    if not st.session_state.user or not st.session_state.company:
+        return []
+    
     try:
-        from pdf2image import convert_from_bytes
-        import pytesseract
-        from io import BytesIO
+        store = get_job_store()
+        owner = get_document_job_owner()
         
-        # Converte PDF para imagens
-        images = convert_from_bytes(file_bytes, dpi=300)
+        # Jobs de processos que morreram viram erro; os sem sinal de vida voltam para a fila
+        requeued = recover_document_jobs()
         
-        text = ""
-        for i, image in enumerate(images):
-            # Aplica OCR em cada página
-            page_text = pytesseract.image_to_string(image, lang='por')
-            text += f"\n--- Página {i+1} ---\n{page_text}\n"
+        # Jobs que ficaram na fila sem processo (servidor reiniciado ou job recuperado) voltam a ser enviados
+        if st.session_state.ai_api_key_value and (requeued or not st.session_state.get('document_jobs_resumed')):
+            resume_document_jobs(owner, st.session_state.ai_model_type, st.session_state.ai_api_key_value)
+            st.session_state.document_jobs_resumed = True
         
-        return text if text.strip() else "[Não foi possível extrair texto do PDF]"
+        jobs = store.list_jobs(owner)
     except Exception as e:
-        return f"[Erro ao aplicar OCR no PDF: {str(e)}. Instale o Tesseract-OCR em seu sistema]"
-
-def extract_text_from_image(file_bytes) -> str:
-    """Extrai texto de imagem usando OCR"""
+        print(f"⚠️ Erro ao consultar jobs de documentos: {e}")
+        return []
+    
+    document_queue = get_document_queue()
+    known_jobs = {doc.get('job_id') for doc in document_queue}
+    active = []
+    for job in jobs:
+        if job['status'] not in (STATUS_DONE, STATUS_ERROR):
+            active.append(job)
+        elif job['id'] not in known_jobs:
+            document_queue.append({
+                'file_name': job['file_name'],
+                'analysis': job['result'],
+                'error': job['error'],
+                'job_id': job['id'],
+                'upload_id': job['upload_id'],
+                'file_type': job['file_type'],
+                'processed': False
+            })
+            if job['status'] == STATUS_ERROR:
+                store.mark_consumed(job['id'])  # O erro é exibido uma vez; o arquivo pode ser reenviado
+    return active
+
+@st.fragment(run_every=DOCUMENT_JOBS_POLL_SECONDS)
+def show_document_jobs_status():
+    """Progresso dos documentos em processamento (atualizado periodicamente sem recarregar a página)"""
     try:
-        import pytesseract
-        from PIL import Image
-        from io import BytesIO
-        
-        # Abre a imagem
-        image = Image.open(BytesIO(file_bytes))
-        
-        # Aplica OCR
-        text = pytesseract.image_to_string(image, lang='por')
-        
-        return text if text.strip() else "[Não foi possível extrair texto da imagem]"
+        # Processo de trabalho morto ou job sem sinal de vida: o job sai de 'running'
+        if recover_document_jobs() and st.session_state.ai_api_key_value:
+            resume_document_jobs(get_document_job_owner(), st.session_state.ai_model_type, st.session_state.ai_api_key_value)
+        jobs = get_job_store().list_jobs(get_document_job_owner())
     except Exception as e:
-        return f"[Erro ao aplicar OCR na imagem: {str(e)}. Instale o Tesseract-OCR em seu sistema]"
+        st.warning(f"⚠️ Não foi possível consultar o processamento: {str(e)}")
+        return
+    
+    known_jobs = {doc.get('job_id') for doc in get_document_queue()}
+    finished = [job for job in jobs if job['status'] in (STATUS_DONE, STATUS_ERROR)]
+    running = sum(1 for job in jobs if job['status'] == 'running')
+    queued = sum(1 for job in jobs if job['status'] == 'queued')
+    
+    # Novos resultados (ou fim do processamento): recarrega o app para exibir a aprovação
+    if any(job['id'] not in known_jobs for job in finished) or not (running or queued):
+        st.rerun()
+    
+    total = len(jobs)
+    st.progress(len(finished) / total if total else 0.0,
+                text=f"⏳ Processando documentos: {running} em análise, {queued} na fila, {len(finished)}/{total} concluído(s)")
 
-def extract_text_from_xml(file_bytes) -> str:
-    """Extrai informações de XML (NFe)"""
+def learn_supplier_template(document: dict):
+    """Aprende o layout do fornecedor com o documento aprovado (próximos do mesmo layout dispensam a IA)"""
+    upload_id = document.get('upload_id')
+    if not upload_id or not get_upload_store().exists(upload_id):
+        return
+    
     try:
-        import xml.etree.ElementTree as ET
-        
-        xml_text = file_bytes.decode('utf-8')
-        return xml_text[:2000]  # Primeiros 2000 caracteres
-    except:
-        return "[Erro ao ler XML]"
+        with get_upload_store().open(upload_id) as file_bytes:
+            learned = learn_document_template(
+                document['file_name'],
+                document.get('file_type') or '',
+                file_bytes,
+                document['analysis'],
+                st.session_state.company.get('cnpj')
+            )
+        if learned:
+            print(f"🧩 Modelo do fornecedor aprendido com {document['file_name']}")
+    except Exception as e:
+        print(f"⚠️ Erro ao aprender modelo do fornecedor: {e}")
 
-def extract_text_from_csv(file_bytes) -> str:
-    """Extrai preview de CSV"""
-    try:
-        import pandas as pd
-        from io import BytesIO
-        
-        df = pd.read_csv(BytesIO(file_bytes), nrows=10)
-        return df.to_string()
-    except:
-        return "[Erro ao ler CSV]"
+def force_document_analysis(document: dict) -> bool:
+    """Reenvia o arquivo para análise completa, sem a comparação com documentos parecidos"""
+    upload_id = document.get('upload_id')
+    if not upload_id or not get_upload_store().exists(upload_id):
+        st.error(f"❌ O arquivo {document['file_name']} não está mais disponível. Envie-o novamente.")
+        return False
 
-def process_uploaded_documents(uploaded_files):
-    """Processa documentos enviados usando IA"""
-    
-    if not st.session_state.ai_client:
+    if not st.session_state.ai_client or not st.session_state.ai_api_key_value:
         st.error("❌ Configure um modelo de IA primeiro para processar documentos!")
-        return
-    
-    if not st.session_state.company:
-        st.error("❌ Cadastre sua empresa primeiro!")
-        return
-    
-    # Inicializa lista de processamento
-    if 'document_processing_queue' not in st.session_state:
-        st.session_state.document_processing_queue = []
-    
-    with st.spinner("🔍 Analisando documentos..."):
-        results = []
-        
-        for uploaded_file in uploaded_files:
-            file_name = uploaded_file.name
-            file_type = uploaded_file.type
-            file_bytes = uploaded_file.read()
-            
-            # Extrai texto baseado no tipo
-            content_preview = ""
-            if file_type == "application/pdf":
-                content_preview = extract_text_from_pdf(file_bytes)
-            elif file_type in ["text/xml", "application/xml"]:
-                content_preview = extract_text_from_xml(file_bytes)
-            elif file_type == "text/csv":
-                content_preview = extract_text_from_csv(file_bytes)
-            elif file_type in ["image/jpeg", "image/png", "image/jpg"]:
-                content_preview = extract_text_from_image(file_bytes)
-            else:
-                content_preview = "[Tipo de arquivo não suportado para extração automática]"
-            
-            # Cria prompt para análise
-            analysis_prompt = create_document_analysis_prompt(file_name, file_type, content_preview)
-            
-            # Chama IA para análise
-            try:
-                import json
-                
-                response, _ = chat_with_ai(
-                    st.session_state.ai_client,
-                    st.session_state.ai_model_type,
-                    analysis_prompt,
-                    f"Analise o documento: {file_name}",
-                    None
-                )
-                
-                # Tenta extrair JSON da resposta
-                # Remove markdown code blocks se houver
-                if "```json" in response:
-                    response = response.split("```json")[1].split("```")[0].strip()
-                elif "```" in response:
-                    response = response.split("```")[1].split("```")[0].strip()
-                
-                analysis_result = json.loads(response)
-                
-                results.append({
-                    'file_name': file_name,
-                    'analysis': analysis_result,
-                    'file_bytes': file_bytes,
-                    'processed': False
-                })
-                
-            except Exception as e:
-                st.error(f"❌ Erro ao analisar {file_name}: {str(e)}")
-                results.append({
-                    'file_name': file_name,
-                    'analysis': None,
-                    'error': str(e),
-                    'processed': False
-                })
-        
-        # Armazena resultados no session state
-        st.session_state.document_processing_queue = results
-        st.session_state.sidebar_expanded['uploads'] = False
-        st.rerun()
+        return False
+
+    try:
+        submit_document_jobs(
+            get_document_job_owner(),
+            st.session_state.company.get('cnpj'),
+            [(document['file_name'], document.get('file_type') or '', upload_id)],
+            st.session_state.ai_model_type,
+            st.session_state.ai_api_key_value,
+            force_analysis=True
+        )
+        return True
+    except Exception as e:
+        st.error(f"❌ Erro ao enviar documento para análise: {str(e)}")
+        return False
 
 def show_document_approval_interface():
     """Interface para revisar e aprovar documentos processados"""
     
-    if 'document_processing_queue' not in st.session_state or not st.session_state.document_processing_queue:
+    document_queue = get_document_queue()
+    if not document_queue:
         return
     
     # Verifica nível de acesso do usuário
@@ -3206,12 +3259,12 @@ def show_document_approval_interface():
         st.markdown("### 📋 Documentos Processados - Aguardando Envio para Aprovação")
         st.caption("👤 Como usuário **Geral**, seus documentos serão enviados para aprovação de um usuário Senior")
     
-    pending_docs = [doc for doc in st.session_state.document_processing_queue if not doc.get('processed', False)]
+    pending_docs = [doc for doc in document_queue if not doc.get('processed', False)]
     
     if not pending_docs:
         st.success("✅ Todos os documentos foram processados!")
         if st.button("🔄 Limpar Fila"):
-            st.session_state.document_processing_queue = []
+            set_document_queue([])
             st.rerun()
         return
     
@@ -3230,6 +3283,14 @@ def show_document_approval_interface():
                 st.markdown(f"**Confiança:** {analysis.get('confianca', 0)*100:.0f}%")
                 st.markdown(f"**Destino:** `{analysis.get('tabela_destino')}`")
                 
+                duplicate_of = analysis.get('duplicata_de')
+                if duplicate_of:
+                    st.error(
+                        f"🔁 **Possível duplicata** ({duplicate_of.get('reason')}) de "
+                        f"**{duplicate_of.get('file_name')}**, processado em {duplicate_of.get('processed_at')}. "
+                        f"Confira antes de aprovar para não cadastrar duas vezes."
+                    )
+                
                 st.markdown("**📊 Dados Extraídos:**")
                 st.json(analysis.get('dados_extraidos', {}))
                 
@@ -3267,11 +3328,18 @@ def show_document_approval_interface():
                 col_btn1, col_btn2 = st.columns(2)
                 
                 with col_btn1:
-                    if is_senior:
+                    if analysis.get('analise_pendente'):
+                        # Quase idêntico a um documento já enviado: a análise só é feita se o usuário pedir
+                        if st.button("🔍 Analisar mesmo assim", key=f"force_analysis_{idx}", use_container_width=True):
+                            if force_document_analysis(doc):
+                                mark_document_processed(doc)
+                                st.rerun()
+                    elif is_senior:
                         # Senior aprova diretamente
                         if st.button("✅ Aprovar", key=f"approve_{idx}", use_container_width=True):
                             save_document_to_database(doc)
-                            st.session_state.document_processing_queue[idx]['processed'] = True
+                            learn_supplier_template(doc)
+                            mark_document_processed(doc, DOCUMENT_STATUS_APPROVED)
                             st.success(f"✅ {doc['file_name']} cadastrado!")
                             st.rerun()
                     else:
@@ -3301,7 +3369,7 @@ def show_document_approval_interface():
                             }
                             
                             if create_approval_request(request_data):
-                                st.session_state.document_processing_queue[idx]['processed'] = True
+                                mark_document_processed(doc)
                                 st.success(f"✅ {doc['file_name']} enviado para aprovação!")
                                 st.info("💡 Um usuário Senior receberá sua solicitação")
                                 st.rerun()
@@ -3310,7 +3378,7 @@ def show_document_approval_interface():
                 
                 with col_btn2:
                     if st.button("❌ Rejeitar", key=f"reject_{idx}", use_container_width=True):
-                        st.session_state.document_processing_queue[idx]['processed'] = True
+                        mark_document_processed(doc, DOCUMENT_STATUS_REJECTED)
                         st.warning(f"❌ {doc['file_name']} rejeitado!")
                         st.rerun()
 
@@ -3554,22 +3622,9 @@ def show_fiscal_dashboard():
     st.markdown('<div class="section-header">💳 Análise Tributária Comparativa</div>', unsafe_allow_html=True)
     
     # Calcula receita e despesas do período para análise
-    period_revenue = 0
-    period_expenses = 0
-    
-    current_date = start_date.replace(day=1)
-    end_month = end_date.replace(day=1)
-    
-    while current_date <= end_month:
-        month_str = current_date.strftime('%Y-%m-01')
-        month_dre = get_or_create_dre(company['id'], month_str)
-        period_revenue += month_dre.get('gross_revenue', 0)
-        period_expenses += month_dre.get('expenses', 0) + month_dre.get('costs', 0)
-        
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year + 1, month=1)
-        else:
-            current_date = current_date.replace(month=current_date.month + 1)
+    period_totals = get_period_dre_totals(company['id'], start_date, end_date)
+    period_revenue = period_totals['gross_revenue']
+    period_expenses = period_totals['expenses'] + period_totals['costs']
     
     # Calcula impostos em cada regime
     simples_tax = calculate_simples_tax(revenue_12m)
@@ -3694,27 +3749,26 @@ def show_fiscal_dashboard():
         """, unsafe_allow_html=True)
         
         # Inicializa histórico de mensagens
-        if 'fiscal_agent_messages' not in st.session_state:
-            st.session_state.fiscal_agent_messages = []
+        agent_messages = get_agent_messages('fiscal_agent_messages')
         
         # Botão de reset
         col_reset1, col_reset2 = st.columns([5, 1])
         with col_reset2:
             if st.button("🔄 Limpar", key="reset_fiscal_chat", use_container_width=True):
-                st.session_state.fiscal_agent_messages = []
-                st.session_state.fiscal_agent_chat_history = None
+                reset_agent_conversation('fiscal_agent_messages', 'fiscal_agent_chat_history')
                 st.rerun()
         
         # Container de chat
-        with st.container(height=300):
-            for message in st.session_state.fiscal_agent_messages:
+        messages_container = st.container(height=300)
+        with messages_container:
+            for message in agent_messages:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
         
         # Input de chat
         if prompt := st.chat_input("Pergunte sobre impostos, regime tributário, obrigações fiscais, elisão fiscal...", key="fiscal_agent_input"):
             # Adiciona mensagem do usuário
-            st.session_state.fiscal_agent_messages.append({"role": "user", "content": prompt})
+            agent_messages.append({"role": "user", "content": prompt})
             
             # Prepara dados para o agente
             obligations_data = []
@@ -3759,20 +3813,25 @@ def show_fiscal_dashboard():
                 fiscal_data=fiscal_stats
             )
             
-            # Chama a IA
-            with st.spinner("🤔 Analisando legislação fiscal e regime tributário..."):
-                response, chat_history = chat_with_ai(
-                    st.session_state.ai_client,
-                    st.session_state.ai_model_type,
-                    system_prompt,
-                    prompt,
-                    st.session_state.get('fiscal_agent_chat_history')
-                )
-                
-                st.session_state.fiscal_agent_chat_history = chat_history
+            # Chama a IA: a resposta aparece no quadro de mensagens à medida que é gerada
+            with messages_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+                with st.chat_message("assistant"):
+                    stream = chat_with_ai_stream(
+                        st.session_state.ai_client,
+                        st.session_state.ai_model_type,
+                        system_prompt,
+                        prompt,
+                        get_agent_chat_history('fiscal_agent_chat_history')
+                    )
+                    st.write_stream(stream)
+            
+            response = stream.text
+            set_agent_chat_history('fiscal_agent_chat_history', stream.chat_history)
             
             # Adiciona resposta
-            st.session_state.fiscal_agent_messages.append({"role": "assistant", "content": response})
+            agent_messages.append({"role": "assistant", "content": response})
             st.rerun()
 
 # ==========================================
@@ -3795,50 +3854,13 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
     company = st.session_state.company
     start_date, end_date = st.session_state.accounting_date_range
     
-    # Verifica se já temos os dados em cache para o dashboard específico
-    accounting_cache = "accounting_dre_data"
-    date_key = f"{start_date}_{end_date}"
-    
-    if accounting_cache not in st.session_state:
-        st.session_state[accounting_cache] = {}
-    
-    # Se não tiver em cache ou as datas mudaram, recalcula
-    if date_key not in st.session_state[accounting_cache]:
-        with st.spinner("Carregando dados..."):
-            total_revenue = 0
-            total_expenses = 0
-            total_profit = 0
-            
-            # Itera pelos meses do período
-            current_date = start_date.replace(day=1)
-            end_month = end_date.replace(day=1)
-            
-            while current_date <= end_month:
-                month_str = current_date.strftime('%Y-%m-01')
-                dre = get_or_create_dre(company['id'], month_str)
-                
-                total_revenue += dre.get('gross_revenue', 0)
-                total_expenses += dre.get('expenses', 0)
-                total_profit += dre.get('net_profit', 0)
-                
-                # Próximo mês
-                if current_date.month == 12:
-                    current_date = current_date.replace(year=current_date.year + 1, month=1)
-                else:
-                    current_date = current_date.replace(month=current_date.month + 1)
-            
-            # Salva no cache
-            st.session_state[accounting_cache][date_key] = {
-                'total_revenue': total_revenue,
-                'total_expenses': total_expenses,
-                'total_profit': total_profit
-            }
-    
-    # Usa os dados do cache
-    data = st.session_state[accounting_cache][date_key]
-    total_revenue = data['total_revenue']
-    total_expenses = data['total_expenses']
-    total_profit = data['total_profit']
+    # DREs mensais do período vindas do cache particionado (busca apenas os meses ainda não carregados)
+    with st.spinner("Carregando dados..."):
+        monthly_dre = get_monthly_dre(company['id'], start_date, end_date)
+        period_totals = get_period_dre_totals(company['id'], start_date, end_date)
+    total_revenue = period_totals['gross_revenue']
+    total_expenses = period_totals['expenses']
+    total_profit = period_totals['net_profit']
     
     obligations = get_pending_obligations(company['id'], start_date=start_date, end_date=end_date)
     
@@ -3872,20 +3894,10 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
         months = []
         expenses_data = []
         
-        current_date = start_date.replace(day=1)
-        end_month = end_date.replace(day=1)
-        while current_date <= end_month:
-            month_str = current_date.strftime('%Y-%m-01')
-            month_label = current_date.strftime('%b/%y')
-            
-            month_dre = get_or_create_dre(company['id'], month_str)
-            months.append(month_label)
+        for month in iter_months(start_date, end_date):
+            month_dre = monthly_dre.get(month, {})
+            months.append(month.strftime('%b/%y'))
             expenses_data.append(month_dre.get('expenses', 0))
-            
-            if current_date.month == 12:
-                current_date = current_date.replace(year=current_date.year + 1, month=1)
-            else:
-                current_date = current_date.replace(month=current_date.month + 1)
         
         fig_expenses = go.Figure()
         fig_expenses.add_trace(go.Bar(
@@ -3912,18 +3924,8 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
         
         profit_data = []
         
-        current_date = start_date.replace(day=1)
-        end_month = end_date.replace(day=1)
-        while current_date <= end_month:
-            month_str = current_date.strftime('%Y-%m-01')
-            
-            month_dre = get_or_create_dre(company['id'], month_str)
-            profit_data.append(month_dre.get('net_profit', 0))
-            
-            if current_date.month == 12:
-                current_date = current_date.replace(year=current_date.year + 1, month=1)
-            else:
-                current_date = current_date.replace(month=current_date.month + 1)
+        for month in iter_months(start_date, end_date):
+            profit_data.append(monthly_dre.get(month, {}).get('net_profit', 0))
         
         fig_profit = go.Figure()
         fig_profit.add_trace(go.Scatter(
@@ -3954,32 +3956,7 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
     
     with col1:
         # Soma de todos os meses do período
-        period_dre = {
-            'gross_revenue': total_revenue,
-            'deductions': 0,
-            'net_revenue': 0,
-            'costs': 0,
-            'gross_profit': 0,
-            'expenses': total_expenses,
-            'net_profit': total_profit
-        }
-        
-        # Calcula valores agregados
-        current_date = start_date.replace(day=1)
-        end_month = end_date.replace(day=1)
-        while current_date <= end_month:
-            month_str = current_date.strftime('%Y-%m-01')
-            month_dre = get_or_create_dre(company['id'], month_str)
-            
-            period_dre['deductions'] += month_dre.get('deductions', 0)
-            period_dre['net_revenue'] += month_dre.get('net_revenue', 0)
-            period_dre['costs'] += month_dre.get('costs', 0)
-            period_dre['gross_profit'] += month_dre.get('gross_profit', 0)
-            
-            if current_date.month == 12:
-                current_date = current_date.replace(year=current_date.year + 1, month=1)
-            else:
-                current_date = current_date.replace(month=current_date.month + 1)
+        period_dre = period_totals
         
         dre_data = {
             'Item': ['Receita Bruta', '(-) Deduções', 'Receita Líquida', '(-) Custos', 
@@ -4094,56 +4071,29 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
         """, unsafe_allow_html=True)
         
         # Inicializa histórico de mensagens específico do agente contábil
-        if 'accounting_agent_messages' not in st.session_state:
-            st.session_state.accounting_agent_messages = []
+        agent_messages = get_agent_messages('accounting_agent_messages')
         
         # Botão de reset
         col_reset1, col_reset2 = st.columns([5, 1])
         with col_reset2:
             if st.button("🔄 Limpar", key="reset_accounting_chat", use_container_width=True):
-                st.session_state.accounting_agent_messages = []
-                st.session_state.accounting_agent_chat_history = None
+                reset_agent_conversation('accounting_agent_messages', 'accounting_agent_chat_history')
                 st.rerun()
         
         # Container com altura fixa e scroll (usando componente nativo do Streamlit)
-        with st.container(height=300):
-            for message in st.session_state.accounting_agent_messages:
+        messages_container = st.container(height=300)
+        with messages_container:
+            for message in agent_messages:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
         
         # Input de chat
         if prompt := st.chat_input("Pergunte sobre contabilidade, demonstrações contábeis, lançamentos, conciliações, auditoria...", key="accounting_agent_input"):
             # Adiciona mensagem do usuário
-            st.session_state.accounting_agent_messages.append({"role": "user", "content": prompt})
+            agent_messages.append({"role": "user", "content": prompt})
             
-            # Calcula DRE do período completo para contexto
-            period_dre = {
-                'gross_revenue': total_revenue,
-                'net_revenue': 0,
-                'gross_profit': 0,
-                'net_profit': total_profit,
-                'expenses': total_expenses,
-                'deductions': 0,
-                'costs': 0
-            }
-            
-            # Itera pelos meses do período para calcular valores agregados
-            current_date = start_date.replace(day=1)
-            end_month = end_date.replace(day=1)
-            
-            while current_date <= end_month:
-                month_str = current_date.strftime('%Y-%m-01')
-                month_dre = get_or_create_dre(company['id'], month_str)
-                
-                period_dre['deductions'] += month_dre.get('deductions', 0)
-                period_dre['net_revenue'] += month_dre.get('net_revenue', 0)
-                period_dre['costs'] += month_dre.get('costs', 0)
-                period_dre['gross_profit'] += month_dre.get('gross_profit', 0)
-                
-                if current_date.month == 12:
-                    current_date = current_date.replace(year=current_date.year + 1, month=1)
-                else:
-                    current_date = current_date.replace(month=current_date.month + 1)
+            # Calcula DRE do período completo para contexto (a partir das partições mensais em cache)
+            period_dre = get_period_dre_totals(company['id'], start_date, end_date)
             
             # Busca obrigações fiscais do período
             all_obligations = get_pending_obligations(company['id'], start_date=start_date, end_date=end_date)
@@ -4170,20 +4120,25 @@ def show_dashboard(module: str = "accounting", unique_id: str = ""):
                 financial_data=None  # Agente contábil não precisa de dados financeiros detalhados
             )
             
-            # Chama a IA
-            with st.spinner("🤔 Analisando dados contábeis e legislação..."):
-                response, chat_history = chat_with_ai(
-                    st.session_state.ai_client,
-                    st.session_state.ai_model_type,
-                    system_prompt,
-                    prompt,
-                    st.session_state.get('accounting_agent_chat_history')
-                )
-                
-                st.session_state.accounting_agent_chat_history = chat_history
+            # Chama a IA: a resposta aparece no quadro de mensagens à medida que é gerada
+            with messages_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+                with st.chat_message("assistant"):
+                    stream = chat_with_ai_stream(
+                        st.session_state.ai_client,
+                        st.session_state.ai_model_type,
+                        system_prompt,
+                        prompt,
+                        get_agent_chat_history('accounting_agent_chat_history')
+                    )
+                    st.write_stream(stream)
+            
+            response = stream.text
+            set_agent_chat_history('accounting_agent_chat_history', stream.chat_history)
             
             # Adiciona resposta ao histórico
-            st.session_state.accounting_agent_messages.append({"role": "assistant", "content": response})
+            agent_messages.append({"role": "assistant", "content": response})
             st.rerun()
 
 # ==========================================
@@ -4201,25 +4156,7 @@ def show_ai_agent_page():
     start_date, end_date = st.session_state.date_range
     
     # Calcula DRE do período para contexto
-    period_dre = {'gross_revenue': 0, 'net_revenue': 0, 'gross_profit': 0, 'net_profit': 0, 'expenses': 0}
-    
-    current_date = start_date.replace(day=1)
-    end_month = end_date.replace(day=1)
-    
-    while current_date <= end_month:
-        month_str = current_date.strftime('%Y-%m-01')
-        month_dre = get_or_create_dre(company['id'], month_str)
-        
-        period_dre['gross_revenue'] += month_dre.get('gross_revenue', 0)
-        period_dre['net_revenue'] += month_dre.get('net_revenue', 0)
-        period_dre['gross_profit'] += month_dre.get('gross_profit', 0)
-        period_dre['net_profit'] += month_dre.get('net_profit', 0)
-        period_dre['expenses'] += month_dre.get('expenses', 0)
-        
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year + 1, month=1)
-        else:
-            current_date = current_date.replace(month=current_date.month + 1)
+    period_dre = get_period_dre_totals(company['id'], start_date, end_date)
     
     # Container fixo com scroll
     st.markdown('<div class="chat-fixed-container">', unsafe_allow_html=True)
@@ -4228,14 +4165,14 @@ def show_ai_agent_page():
     col1, col2 = st.columns([5, 1])
     with col2:
         if st.button("🔄 Resetar", use_container_width=True):
-            st.session_state.messages = []
-            st.session_state.chat_history = None
+            reset_agent_conversation('messages', 'chat_history')
             st.rerun()
     
     # Área de mensagens com scroll
     st.markdown('<div class="chat-messages">', unsafe_allow_html=True)
     
-    for message in st.session_state.messages:
+    agent_messages = get_agent_messages('messages')
+    for message in agent_messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
     
@@ -4243,7 +4180,7 @@ def show_ai_agent_page():
     
     # Input de chat
     if prompt := st.chat_input("Faça sua pergunta sobre contabilidade, impostos, DRE..."):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        agent_messages.append({"role": "user", "content": prompt})
         
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -4251,20 +4188,18 @@ def show_ai_agent_page():
         system_prompt = create_accounting_system_prompt(company, period_dre)
         
         with st.chat_message("assistant"):
-            with st.spinner("🤔 Analisando..."):
-                response, chat_history = chat_with_ai(
-                    st.session_state.ai_client,
-                    st.session_state.ai_model_type,
-                    system_prompt,
-                    prompt,
-                    st.session_state.chat_history
-                )
-                
-                st.markdown(response)
-                
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                if chat_history:
-                    st.session_state.chat_history = chat_history
+            stream = chat_with_ai_stream(
+                st.session_state.ai_client,
+                st.session_state.ai_model_type,
+                system_prompt,
+                prompt,
+                get_agent_chat_history('chat_history')
+            )
+            st.write_stream(stream)
+            
+            agent_messages.append({"role": "assistant", "content": stream.text})
+            if stream.chat_history:
+                set_agent_chat_history('chat_history', stream.chat_history)
         
         st.rerun()
     
@@ -4275,11 +4210,19 @@ def show_ai_agent_page():
 # ==========================================
 
 def main():
+    # Mantém os caches da sessão dentro do orçamento de memória. No início de cada execução:
+    # as que terminam em st.rerun() não chegam ao fim de main(), e a pré-busca cresce entre execuções
+    get_session_cache().enforce_budget()
+    
     if st.session_state.current_page == 'login':
         show_login_page()
     else:
         show_sidebar()
         
+        # Documentos processados em segundo plano entram na fila de aprovação
+        if sync_document_jobs():
+            show_document_jobs_status()
+        
         # Interface de aprovação de documentos (aparece em todas as abas se houver documentos pendentes)
         show_document_approval_interface()
         
@@ -4319,6 +4262,9 @@ def main():
             
             with subtab4:
                 st.info("Em desenvolvimento: Folha de pagamento")
+        
+        # Pré-busca em segundo plano dos períodos vizinhos (após a renderização dos dashboards)
+        schedule_period_prefetch()
 
 if __name__ == "__main__":
     main()
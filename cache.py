@@ -0,0 +1,573 @@
+"""
+Caches em memória usados pelos dashboards do CONT-AI.
+"""
+
+import queue
+import sys
+import threading
+import time
+import weakref
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from events import subscribe
+from shared_cache import get_shared_cache
+
+
+# =======================================================
+# 1. UTILITÁRIOS DE DATAS
+# =======================================================
+
+def to_date(value: Any) -> date:
+    """Converte date, datetime ou string 'YYYY-MM-DD...' em date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def month_start(d: date) -> date:
+    """Primeiro dia do mês da data."""
+    return d.replace(day=1)
+
+
+def next_month(d: date) -> date:
+    """Primeiro dia do mês seguinte."""
+    if d.month == 12:
+        return d.replace(year=d.year + 1, month=1, day=1)
+    return d.replace(month=d.month + 1, day=1)
+
+
+def previous_month(d: date) -> date:
+    """Primeiro dia do mês anterior."""
+    if d.month == 1:
+        return d.replace(year=d.year - 1, month=12, day=1)
+    return d.replace(month=d.month - 1, day=1)
+
+
+def iter_months(start: date, end: date):
+    """Itera pelo primeiro dia de cada mês entre start e end (inclusive)."""
+    current = month_start(start)
+    last = month_start(end)
+    while current <= last:
+        yield current
+        current = next_month(current)
+
+
+def approx_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """Estimativa (em bytes) da memória ocupada por um objeto e seus filhos."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, _seen) for item in obj)
+    return size
+
+
+# =======================================================
+# 2. CACHE PARTICIONADO POR PERÍODO
+# =======================================================
+
+class PartitionedRangeCache:
+    """
+    Cache de partições mensais ou diárias com controle de cobertura.
+
+    Cada partição (ex.: a DRE de um mês ou o movimento líquido de um dia) é
+    guardada separadamente, junto com a lista de intervalos já buscados no
+    banco. Quando o período muda, apenas os intervalos ainda não cobertos são
+    buscados e os totais são recalculados a partir das partições em cache.
+
+    Com entity/scope informados, o cache se inscreve no barramento de
+    escritas (events.py) e descarta apenas o período alterado. Escritas de
+    outros processos são percebidas pela versão da entidade no cache
+    compartilhado (contai:v:{entity}:{scope}): se ela mudou desde a última
+    leitura, tudo é descartado. Com max_age, a cobertura também expira após
+    esse número de segundos (alterações feitas direto no banco).
+    """
+
+    def __init__(self, granularity: str = 'month', entity: Optional[str] = None, scope: Any = None,
+                 max_age: Optional[float] = None):
+        if granularity not in ('month', 'day'):
+            raise ValueError(f"Granularidade inválida: {granularity}")
+        self.granularity = granularity
+        self.entity = entity
+        self.scope = scope
+        self.max_age = max_age
+        self._partitions: Dict[date, Any] = {}
+        self._covered: List[Tuple[date, date]] = []  # Intervalos [início, fim] de chaves já buscadas
+        self._covered_since: Optional[float] = None  # Momento da busca mais antiga ainda em cache
+        self._lock = threading.RLock()
+        self._version = self._shared_version()
+        if entity:
+            subscribe(self.handle_write)
+
+    # ----- chaves de partição -----
+
+    def partition_key(self, value: Any) -> date:
+        d = to_date(value)
+        return month_start(d) if self.granularity == 'month' else d
+
+    def _next_key(self, key: date) -> date:
+        return next_month(key) if self.granularity == 'month' else key + timedelta(days=1)
+
+    def _prev_key(self, key: date) -> date:
+        return previous_month(key) if self.granularity == 'month' else key - timedelta(days=1)
+
+    # ----- validade -----
+
+    def _shared_version(self) -> Optional[str]:
+        return get_shared_cache().version(self.entity, self.scope) if self.entity else None
+
+    def refresh(self):
+        """Descarta tudo se a versão compartilhada mudou (escrita em outro processo) ou se a cobertura expirou."""
+        version = self._shared_version()
+        with self._lock:
+            expired = (self.max_age is not None and self._covered_since is not None
+                       and time.time() - self._covered_since > self.max_age)
+            if version != self._version or expired:
+                self._partitions.clear()
+                self._covered = []
+                self._covered_since = None
+                self._version = version
+
+    # ----- cobertura -----
+
+    def missing_spans(self, start: Any, end: Any) -> List[Tuple[date, date]]:
+        """Retorna os intervalos de [start, end] que ainda não foram buscados."""
+        first, last = self.partition_key(start), self.partition_key(end)
+        spans = []
+        cursor = first
+        with self._lock:
+            for covered_start, covered_end in self._covered:
+                if covered_end < cursor:
+                    continue
+                if covered_start > last:
+                    break
+                if covered_start > cursor:
+                    spans.append((cursor, self._prev_key(covered_start)))
+                cursor = self._next_key(covered_end)
+                if cursor > last:
+                    break
+        if cursor <= last:
+            spans.append((cursor, last))
+        return spans
+
+    def is_covered(self, start: Any, end: Any) -> bool:
+        return not self.missing_spans(start, end)
+
+    def _mark_covered(self, first: date, last: date):
+        if not self._covered:
+            self._covered_since = time.time()
+        intervals = sorted(self._covered + [(first, last)])
+        merged = [intervals[0]]
+        for current_start, current_end in intervals[1:]:
+            prev_start, prev_end = merged[-1]
+            if current_start <= self._next_key(prev_end):
+                merged[-1] = (prev_start, max(prev_end, current_end))
+            else:
+                merged.append((current_start, current_end))
+        self._covered = merged
+
+    # ----- leitura / escrita -----
+
+    def store_span(self, first: date, last: date, data: Dict[Any, Any]):
+        """Guarda as partições buscadas para o intervalo e marca-o como coberto."""
+        with self._lock:
+            for key, value in data.items():
+                partition = self.partition_key(key)
+                if first <= partition <= last:
+                    self._partitions[partition] = value
+            self._mark_covered(first, last)
+
+    def store_partitions(self, data: Dict[Any, Any]):
+        """Guarda partições avulsas, marcando como coberta apenas cada chave recebida."""
+        with self._lock:
+            for key, value in data.items():
+                partition = self.partition_key(key)
+                self._partitions[partition] = value
+                self._mark_covered(partition, partition)
+
+    def get_range(self, start: Any, end: Any, fetch_span: Callable[[date, date], Dict[Any, Any]]) -> Dict[date, Any]:
+        """
+        Retorna as partições de [start, end], buscando apenas o delta.
+
+        Args:
+            start: Data inicial do período
+            end: Data final do período
+            fetch_span: Função (início, fim) -> {chave: valor} usada para buscar
+                        cada intervalo ainda não coberto. Se retornar None
+                        (erro), o intervalo não é marcado como coberto.
+
+        Returns:
+            Dict esparso {chave_da_partição: valor} com as partições do período
+        """
+        self.refresh()
+        spans = self.missing_spans(start, end)
+        for first, last in spans:
+            data = fetch_span(first, last)
+            if data is None:
+                continue
+            self.store_span(first, last, data)
+
+        first, last = self.partition_key(start), self.partition_key(end)
+        with self._lock:
+            return {key: value for key, value in self._partitions.items() if first <= key <= last}
+
+    def invalidate(self, start: Any = None, end: Any = None):
+        """Descarta as partições (e a cobertura) do intervalo; sem argumentos, limpa tudo."""
+        with self._lock:
+            if start is None and end is None:
+                self._partitions.clear()
+                self._covered = []
+                self._covered_since = None
+                return
+
+            first = self.partition_key(start) if start is not None else date.min
+            last = self.partition_key(end) if end is not None else date.max
+
+            self._partitions = {k: v for k, v in self._partitions.items() if not (first <= k <= last)}
+
+            remaining = []
+            for covered_start, covered_end in self._covered:
+                if covered_end < first or covered_start > last:
+                    remaining.append((covered_start, covered_end))
+                    continue
+                if covered_start < first:
+                    remaining.append((covered_start, self._prev_key(first)))
+                if covered_end > last:
+                    remaining.append((self._next_key(last), covered_end))
+            self._covered = remaining
+            if not remaining:
+                self._covered_since = None
+
+    def handle_write(self, company_id: Any, entity: str, start: Optional[date], end: Optional[date], scope: Any):
+        """Callback do barramento de escritas: invalida o período alterado (ou tudo, se desconhecido)."""
+        if entity != self.entity or (scope is not None and scope != self.scope):
+            return
+        if start is None:
+            self.invalidate()
+        else:
+            self.invalidate(start, end or start)
+
+    def estimated_size(self) -> int:
+        """Memória aproximada (bytes) ocupada pelas partições."""
+        with self._lock:
+            return approx_size(self._partitions)
+
+    def __len__(self) -> int:
+        return len(self._partitions)
+
+
+# =======================================================
+# 3. PRÉ-BUSCA EM SEGUNDO PLANO
+# =======================================================
+
+class Prefetcher:
+    """
+    Pré-busca especulativa de períodos em threads de baixa prioridade.
+
+    As tarefas aquecem PartitionedRangeCache já existentes (ex.: período
+    anterior/seguinte ao exibido). A pré-busca é limitada por:
+      - número de threads (concorrência)
+      - tamanho da fila (tarefas excedentes são descartadas)
+      - orçamento de memória somado dos caches aquecidos
+
+    cancel() descarta as tarefas pendentes e interrompe as que estão em
+    andamento antes do próximo intervalo a buscar. As threads terminam após
+    idle_timeout segundos sem tarefas e são recriadas no próximo agendamento,
+    então uma sessão encerrada não deixa threads (nem o prefetcher) vivas.
+
+    Importante: as tarefas rodam fora da thread do Streamlit e não devem
+    acessar st.session_state nem chamar funções st.*.
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 16,
+                 memory_budget_bytes: int = 32 * 1024 * 1024, idle_delay: float = 0.2,
+                 idle_timeout: float = 30.0):
+        self.max_workers = max(1, max_workers)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_delay = idle_delay  # Pausa antes de cada tarefa para ceder lugar às buscas da interface
+        self.idle_timeout = idle_timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._generation = 0
+        self._pending = set()
+        self._caches = weakref.WeakSet()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    # ----- controle -----
+
+    def _ensure_workers(self):
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._run, name=f"prefetch-{len(self._workers)}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def cancel(self):
+        """Cancela tudo o que está na fila e sinaliza as tarefas em andamento."""
+        with self._lock:
+            self._generation += 1
+            self._pending.clear()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def shutdown(self):
+        """Cancela a pré-busca e encerra as threads."""
+        self.cancel()
+        self._stopped = True
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def memory_usage(self) -> int:
+        """Memória aproximada ocupada pelos caches aquecidos por este prefetcher."""
+        return sum(cache.estimated_size() for cache in list(self._caches))
+
+    def is_cancelled(self, generation: int) -> bool:
+        return self._stopped or generation != self._generation
+
+    # ----- agendamento -----
+
+    def prefetch_range(self, cache: PartitionedRangeCache, start: Any, end: Any,
+                       fetch_span: Callable[[date, date], Optional[Dict[Any, Any]]],
+                       cover_span: bool = False) -> bool:
+        """
+        Agenda o aquecimento de [start, end] no cache.
+
+        Por padrão só as chaves retornadas por fetch_span são marcadas como
+        cobertas, de modo que partições ausentes (ex.: DRE ainda não criada)
+        continuam sendo tratadas pela busca normal da interface. Com
+        cover_span=True o intervalo inteiro é marcado (ex.: movimentos
+        bancários, em que dia ausente significa dia sem movimento).
+
+        Returns:
+            True se a tarefa foi enfileirada; False se já estava coberta,
+            já pendente, a fila está cheia ou o orçamento foi atingido.
+        """
+        if self._stopped:
+            return False
+        cache.refresh()
+        if cache.is_covered(start, end):
+            return False
+
+        task_key = (id(cache), cache.partition_key(start), cache.partition_key(end))
+        with self._lock:
+            if task_key in self._pending:
+                return False
+            generation = self._generation
+
+        if self.memory_usage() >= self.memory_budget_bytes:
+            return False
+
+        try:
+            self._queue.put_nowait((generation, task_key, cache, start, end, fetch_span, cover_span))
+        except queue.Full:
+            return False
+
+        with self._lock:
+            self._pending.add(task_key)
+            self._caches.add(cache)
+            self._ensure_workers()
+        return True
+
+    # ----- execução -----
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Ocioso: encerra a thread (sob o lock, para que um agendamento simultâneo crie outra)
+                with self._lock:
+                    if self._queue.empty():
+                        self._workers = [w for w in self._workers if w is not threading.current_thread()]
+                        break
+                continue
+            if item is None:
+                break
+
+            generation, task_key, cache, start, end, fetch_span, cover_span = item
+            try:
+                time.sleep(self.idle_delay)
+                for first, last in cache.missing_spans(start, end):
+                    if self.is_cancelled(generation) or self.memory_usage() >= self.memory_budget_bytes:
+                        break
+                    data = fetch_span(first, last)
+                    if data is None or self.is_cancelled(generation):
+                        continue
+                    if cover_span:
+                        cache.store_span(first, last, data)
+                    else:
+                        cache.store_partitions(data)
+            except Exception as e:
+                print(f"⚠️ Erro na pré-busca {start} a {end}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(task_key)
+
+
+# =======================================================
+# 4. CACHE DE SESSÃO COM ORÇAMENTO DE MEMÓRIA
+# =======================================================
+
+class SessionCache:
+    """
+    Cache da sessão com contabilização de bytes por chave e despejo LRU.
+
+    Cada entrada tem o tamanho estimado (approx_size ou função própria) e o
+    total da sessão é mantido abaixo de budget_bytes despejando as entradas
+    usadas há mais tempo. Entradas fixadas (pinned) nunca são despejadas mas
+    contam no total; listas podem ter um limite de itens (max_items), em que
+    os itens mais antigos são descartados.
+
+    Os tamanhos são recalculados em enforce_budget(), pois os valores (listas
+    de mensagens, caches particionados) são alterados no próprio lugar.
+    """
+
+    # Contadores agregados de todas as sessões do processo (para operação)
+    _global_lock = threading.Lock()
+    _global_counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0, 'trimmed_items': 0}
+    _instances = weakref.WeakSet()
+
+    def __init__(self, budget_bytes: int = 64 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries: Dict[str, Dict[str, Any]] = {}  # Ordem de inserção = ordem LRU (mais antigo primeiro)
+        self._lock = threading.RLock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0, 'trimmed_items': 0}
+        SessionCache._instances.add(self)
+
+    # ----- contadores -----
+
+    def _count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+        with SessionCache._global_lock:
+            SessionCache._global_counters[name] += amount
+
+    # ----- acesso -----
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Retorna o valor e marca a chave como usada recentemente."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._count('misses')
+                return default
+            self._entries[key] = entry
+            self._count('hits')
+            return entry['value']
+
+    def get_or_create(self, key: str, factory: Callable[[], Any], **options) -> Any:
+        """Retorna o valor da chave, criando-o com factory() se não existir (ou tiver sido despejado)."""
+        with self._lock:
+            if key in self._entries:
+                return self.get(key)
+            self._count('misses')
+            value = factory()
+            self.set(key, value, **options)
+            return value
+
+    def set(self, key: str, value: Any, pinned: bool = False, max_items: Optional[int] = None,
+            size_of: Optional[Callable[[Any], int]] = None):
+        """
+        Grava o valor na sessão.
+
+        Args:
+            key: Chave da entrada
+            value: Valor (qualquer objeto)
+            pinned: Se True, a entrada nunca é despejada
+            max_items: Para listas, número máximo de itens mantidos (descarta os mais antigos)
+            size_of: Função de estimativa de tamanho (padrão: approx_size)
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            entry = {'value': value, 'pinned': pinned, 'max_items': max_items, 'size_of': size_of or approx_size, 'size': 0}
+            self._entries[key] = entry
+            self._measure(entry)
+            self._evict(protect=key)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry['value'] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # ----- contabilização e despejo -----
+
+    def _measure(self, entry: Dict[str, Any]):
+        value = entry['value']
+        max_items = entry['max_items']
+        if max_items is not None and isinstance(value, list) and len(value) > max_items:
+            excess = len(value) - max_items
+            del value[:excess]
+            self._count('trimmed_items', excess)
+        try:
+            entry['size'] = entry['size_of'](value)
+        except Exception:
+            entry['size'] = approx_size(value)
+
+    def _evict(self, protect: Optional[str] = None):
+        total = self.total_bytes()
+        for key in list(self._entries.keys()):
+            if total <= self.budget_bytes:
+                break
+            entry = self._entries[key]
+            if entry['pinned'] or key == protect:
+                continue
+            del self._entries[key]
+            total -= entry['size']
+            self._count('evictions')
+            self._count('evicted_bytes', entry['size'])
+            print(f"🧹 Cache da sessão: '{key}' despejado ({entry['size'] / 1024:.1f} KB)")
+
+    def enforce_budget(self):
+        """Recalcula o tamanho de todas as entradas, aplica max_items e despeja até caber no orçamento."""
+        with self._lock:
+            for entry in self._entries.values():
+                self._measure(entry)
+            self._evict()
+
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self._entries.values())
+
+    # ----- estatísticas -----
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores e uso de memória desta sessão."""
+        with self._lock:
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes(),
+                'budget_bytes': self.budget_bytes,
+                'sizes': {key: entry['size'] for key, entry in self._entries.items()},
+            }
+
+    @classmethod
+    def global_stats(cls) -> Dict[str, Any]:
+        """Contadores agregados de todas as sessões ativas no processo."""
+        sessions = list(cls._instances)
+        with cls._global_lock:
+            counters = dict(cls._global_counters)
+        counters['sessions'] = len(sessions)
+        counters['bytes'] = sum(session.total_bytes() for session in sessions)
+        return counters
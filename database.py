@@ -1,10 +1,13 @@
 import os
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple
 from datetime import datetime, date
 import json
 
+from events import publish
+from shared_cache import shared_cached
+
 # Carregar variáveis de ambiente (SUPABASE_URL e SUPABASE_KEY)
 load_dotenv()
 
@@ -27,6 +30,15 @@ else:
     print("As funções de DB não funcionarão.")
 
 
+# --- Cache compartilhado entre processos (ver shared_cache.py) ---
+
+def _db_cached(entity: str, scope_arg: Optional[str] = 'company_id'):
+    """Decorador das funções de leitura: resultado compartilhado entre processos, invalidado por escrita."""
+    return shared_cached(entity, scope_arg=scope_arg, enabled=lambda: supabase is not None)
+
+# Toda escrita publica (empresa, entidade, período) em events.publish; os caches se inscrevem lá.
+
+
 # =======================================================
 # 1. USUÁRIOS (public.users)
 # =======================================================
@@ -57,6 +69,7 @@ def create_user(email: str, password_hash: str, full_name: str, plan: str = "Pro
             "plan": plan
         }
         response = supabase.table("users").insert(user_data).execute()
+        publish(user_data.get('company_id'), 'users')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar usuário (possivelmente email já existe): {e}")
@@ -113,6 +126,7 @@ def create_company(user_id: str, company_data: dict) -> Optional[Dict[str, Any]]
     try:
         company_data['user_id'] = user_id
         response = supabase.table("companies").insert(company_data).execute()
+        publish(None, 'companies')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar empresa: {e}")
@@ -208,6 +222,7 @@ def update_company_logo(company_id: str, logo_url: str) -> bool:
             .eq("id", company_id)
             .execute()
         )
+        publish(company_id, 'companies')
         
         if response.data:
             print(f"✅ Logo path atualizado no banco de dados")
@@ -228,6 +243,7 @@ def update_company_logo(company_id: str, logo_url: str) -> bool:
 # 3. CONTAS BANCÁRIAS (public.bank_accounts)
 # =======================================================
 
+@_db_cached('bank')
 def get_bank_accounts(company_id: str, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
     """
     Busca todas as contas bancárias ativas de uma empresa.
@@ -307,10 +323,75 @@ def get_company_bank_accounts(company_id: str, start_date: str = None, end_date:
     return get_bank_accounts(company_id, start_date, end_date)
 
 
+@_db_cached('bank')
+def list_bank_accounts(company_id: str) -> List[Dict[str, Any]]:
+    """Lista as contas bancárias ativas sem recalcular saldos (sem consultar transações)."""
+    if not supabase:
+        return []
+    try:
+        response = (
+            supabase.table("bank_accounts")
+            .select("*")
+            .eq("company_id", company_id)
+            .eq("is_active", True)
+            .order("bank_name", desc=False)
+            .execute()
+        )
+        return response.data if response.data else []
+    except Exception as e:
+        print(f"❌ Erro ao listar contas bancárias: {e}")
+        return []
+
+
+@_db_cached('bank_transactions', scope_arg='bank_account_id')
+def get_bank_daily_movements(bank_account_id: str, start_date: Any, end_date: Any) -> Optional[Dict[date, float]]:
+    """
+    Soma as movimentações de uma conta por dia (entradas - saídas) no intervalo.
+
+    Returns:
+        Dict {data: movimento_líquido} apenas para os dias com transações,
+        ou None em caso de erro (para que o resultado não seja guardado em cache)
+    """
+    if not supabase:
+        return {}
+    try:
+        s = start_date.isoformat() if hasattr(start_date, 'isoformat') else str(start_date)
+        e = end_date.isoformat() if hasattr(end_date, 'isoformat') else str(end_date)
+        response = (
+            supabase.table('bank_transactions')
+            .select('type, amount, transaction_date')
+            .eq('bank_account_id', bank_account_id)
+            .gte('transaction_date', s)
+            .lte('transaction_date', e)
+            .execute()
+        )
+
+        movements: Dict[date, float] = {}
+        for t in response.data or []:
+            try:
+                day = datetime.strptime(str(t['transaction_date'])[:10], '%Y-%m-%d').date()
+                amount = float(t.get('amount', 0) or 0)
+                transaction_type = (t.get('type') or '').lower()
+
+                # Aceita tanto português quanto inglês
+                if transaction_type in ['entrada', 'credit', 'credito', 'crédito']:
+                    movements[day] = movements.get(day, 0.0) + amount
+                elif transaction_type in ['saida', 'debit', 'debito', 'débito', 'saída']:
+                    movements[day] = movements.get(day, 0.0) - amount
+            except Exception:
+                pass
+
+        return movements
+    except Exception as e:
+        print(f"❌ Erro ao buscar movimentações diárias: {e}")
+        return None
+
+
 # =======================================================
 # 4. TRANSAÇÕES BANCÁRIAS (public.bank_transactions)
 # =======================================================
 
+@_db_cached('bank_transactions', scope_arg='bank_account_id')
 def get_transactions_by_account(bank_account_id: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
     """Busca transações de uma conta em um período."""
     if not supabase:
@@ -338,6 +419,9 @@ def save_bank_transaction(transaction_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("bank_transactions").insert(transaction_data).execute()
+        transaction_date = transaction_data.get('transaction_date')
+        publish(transaction_data.get('company_id'), 'bank_transactions', transaction_date, scope=transaction_data.get('bank_account_id'))
+        publish(transaction_data.get('company_id'), 'bank', transaction_date)
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao salvar transação: {e}")
@@ -350,6 +434,19 @@ def insert_batch_transactions(transactions_list: List[Dict[str, Any]]):
         return
     try:
         supabase.table("bank_transactions").insert(transactions_list).execute()
+        # Um aviso por conta com o intervalo de datas do lote (não um por transação)
+        dates_by_account: Dict[Tuple[Any, Any], List[str]] = {}
+        for t in transactions_list:
+            dates_by_account.setdefault((t.get('company_id'), t.get('bank_account_id')), []).append(
+                str(t['transaction_date'])[:10] if t.get('transaction_date') else None
+            )
+        for (company_id, account_id), dates in dates_by_account.items():
+            if None in dates:
+                publish(company_id, 'bank_transactions', scope=account_id)  # Data desconhecida: a conta inteira
+            else:
+                publish(company_id, 'bank_transactions', min(dates), max(dates), scope=account_id)
+        for company_id in {t.get('company_id') for t in transactions_list}:
+            publish(company_id, 'bank')
         print(f"✅ Inseridas {len(transactions_list)} transações com sucesso.")
     except Exception as e:
         print(f"❌ Erro ao inserir lote de transações: {e}")
@@ -359,6 +456,7 @@ def insert_batch_transactions(transactions_list: List[Dict[str, Any]]):
 # 5. NOTAS FISCAIS (public.invoices)
 # =======================================================
 
+@_db_cached('invoices')
 def get_invoices_by_company(company_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
     """Busca notas fiscais de uma empresa, opcionalmente filtrando por status."""
     if not supabase:
@@ -383,6 +481,7 @@ def save_invoice(invoice_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("invoices").insert(invoice_data).execute()
+        publish(invoice_data.get('company_id'), 'invoices', invoice_data.get('issue_date'))
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao salvar nota fiscal: {e}")
@@ -430,6 +529,7 @@ def get_or_create_dre(company_id: str, reference_month: str) -> Dict[str, Any]:
         
         # 2. Se não existir, cria um novo registro com valores zerados
         response = supabase.table('income_statement').insert(default_dre).execute()
+        publish(company_id, 'dre', reference_month)
         
         if response.data and len(response.data) > 0:
             return response.data[0]
@@ -446,10 +546,100 @@ def fetch_or_create_income_statement(company_id: str, reference_month: str) -> O
     return get_or_create_dre(company_id, reference_month)
 
 
+@_db_cached('dre')
+def get_dre_range(company_id: str, start_month: date, end_month: date) -> Optional[Dict[date, Dict[str, Any]]]:
+    """
+    Busca as DREs mensais de um intervalo com uma única consulta (só leitura:
+    meses sem registro ficam de fora; ver get_or_create_dre_range).
+
+    Args:
+        company_id: ID da empresa
+        start_month: Primeiro mês do intervalo (qualquer dia do mês)
+        end_month: Último mês do intervalo (qualquer dia do mês)
+
+    Returns:
+        Dict {primeiro_dia_do_mês: dre}, ou None se a consulta falhar (nada é
+        marcado como carregado nem gravado no cache; meses zerados não substituem o erro)
+    """
+    months = _month_starts(start_month, end_month)
+
+    result = {}
+    if supabase:
+        try:
+            response = (
+                supabase.table('income_statement')
+                .select('*')
+                .eq('company_id', company_id)
+                .gte('reference_month', months[0].isoformat())
+                .lte('reference_month', months[-1].isoformat())
+                .execute()
+            )
+            for row in response.data or []:
+                month = datetime.strptime(str(row['reference_month'])[:10], '%Y-%m-%d').date().replace(day=1)
+                result[month] = row
+        except Exception as e:
+            print(f"❌ Erro ao buscar DREs do intervalo: {e}")
+            return None
+
+    return result
+
+
+def create_dre_months(company_id: str, months: List[date]) -> bool:
+    """Cria as DREs zeradas dos meses informados com um único insert e um único aviso de escrita."""
+    if not supabase or not months:
+        return False
+    rows = [
+        {
+            'company_id': company_id,
+            'reference_month': month.strftime('%Y-%m-01'),
+            'gross_revenue': 0,
+            'deductions': 0,
+            'net_revenue': 0,
+            'costs': 0,
+            'gross_profit': 0,
+            'expenses': 0,
+            'net_profit': 0
+        }
+        for month in months
+    ]
+    try:
+        supabase.table('income_statement').insert(rows).execute()
+        publish(company_id, 'dre', min(months), max(months))
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao criar DREs do intervalo: {e}")
+        return False
+
+
+def get_or_create_dre_range(company_id: str, start_month: date, end_month: date) -> Optional[Dict[date, Dict[str, Any]]]:
+    """
+    DREs mensais do intervalo, criando antes (fora da leitura em cache) os meses sem registro.
+    None se a consulta falhar.
+    """
+    result = get_dre_range(company_id, start_month, end_month)
+    if result is None or not supabase:
+        return result
+    missing = [month for month in _month_starts(start_month, end_month) if month not in result]
+    if missing and create_dre_months(company_id, missing):
+        # A escrita mudou a versão da entidade: esta leitura já vem do banco
+        result = get_dre_range(company_id, start_month, end_month)
+    return result
+
+
+def _month_starts(start_month: date, end_month: date) -> List[date]:
+    months = []
+    current = start_month.replace(day=1)
+    while current <= end_month.replace(day=1):
+        months.append(current)
+        current = current.replace(year=current.year + 1, month=1) if current.month == 12 else current.replace(month=current.month + 1)
+    return months
+
+
 # =======================================================
 # 6. CONTAS A PAGAR E RECEBER
 # =======================================================
 
+@_db_cached('payables')
 def get_upcoming_bills(company_id: str, limit: int = 10, start_date: Optional[Any] = None, end_date: Optional[Any] = None, include_paid: bool = True) -> List[Dict[str, Any]]:
     """Retorna as próximas contas a pagar. Tenta usar novo schema (accounts_payable), 
     faz fallback para schema antigo (tax_obligations + invoices entrada) se necessário.
@@ -644,6 +834,7 @@ def get_upcoming_bills(company_id: str, limit: int = 10, start_date: Optional[An
         traceback.print_exc()
         return []
 
+@_db_cached('receivables')
 def get_upcoming_receivables(company_id: str, limit: int = 10, start_date: Optional[Any] = None, end_date: Optional[Any] = None, include_paid: bool = True) -> List[Dict[str, Any]]:
     """Retorna os próximos recebimentos previstos. Tenta usar novo schema (accounts_receivable),
     faz fallback para schema antigo (invoices saída) se necessário.
@@ -783,6 +974,7 @@ def get_upcoming_receivables(company_id: str, limit: int = 10, start_date: Optio
 # 7. OBRIGAÇÕES FISCAIS (public.tax_obligations)
 # =======================================================
 
+@_db_cached('obligations')
 def get_pending_obligations(company_id: str, start_date: Optional[Any] = None, end_date: Optional[Any] = None) -> List[Dict[str, Any]]:
     """Busca obrigações fiscais pendentes. Por padrão, próximos 30 dias; se start_date/end_date forem fornecidos, usa o período informado."""
     if not supabase:
@@ -821,6 +1013,7 @@ def create_tax_obligation(obligation_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("tax_obligations").insert(obligation_data).execute()
+        publish(obligation_data.get('company_id'), 'obligations', obligation_data.get('due_date'))
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar obrigação: {e}")
@@ -831,6 +1024,7 @@ def create_tax_obligation(obligation_data: dict) -> Optional[Dict[str, Any]]:
 # 8. FUNCIONÁRIOS (public.employees)
 # =======================================================
 
+@_db_cached('employees')
 def get_employees_by_company(company_id: str, is_active: bool = True) -> List[Dict[str, Any]]:
     """Busca funcionários de uma empresa."""
     if not supabase:
@@ -857,6 +1051,7 @@ def create_employee(employee_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("employees").insert(employee_data).execute()
+        publish(employee_data.get('company_id'), 'employees')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar funcionário: {e}")
@@ -867,6 +1062,7 @@ def create_employee(employee_data: dict) -> Optional[Dict[str, Any]]:
 # 9. FOLHA DE PAGAMENTO (public.payroll)
 # =======================================================
 
+@_db_cached('payroll')
 def get_payroll_by_month(company_id: str, reference_month: str) -> List[Dict[str, Any]]:
     """Busca folha de pagamento de um mês específico."""
     if not supabase:
@@ -892,6 +1088,7 @@ def create_payroll_entry(payroll_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("payroll").insert(payroll_data).execute()
+        publish(payroll_data.get('company_id'), 'payroll', payroll_data.get('reference_month'))
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar folha: {e}")
@@ -933,6 +1130,7 @@ def create_file_upload(upload_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("file_uploads").insert(upload_data).execute()
+        publish(upload_data.get('company_id'), 'file_uploads')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao registrar upload: {e}")
@@ -974,6 +1172,7 @@ def update_dre(company_id: str, reference_month: str, dre_data: dict) -> Optiona
             .eq('reference_month', reference_month)
             .execute()
         )
+        publish(company_id, 'dre', reference_month)
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao atualizar DRE: {e}")
@@ -990,6 +1189,7 @@ def get_recent_transactions(bank_account_id: str, limit: int = 100) -> List[Dict
 # 12A. SALDOS DE CONTAS BANCÁRIAS POR DATA
 # =======================================================
 
+@_db_cached('bank')
 def get_bank_account_balances_asof(company_id: str, as_of: Any) -> List[Dict[str, Any]]:
     """
     Retorna as contas bancárias com saldo recalculado até a data informada (inclusive).
@@ -1121,12 +1321,14 @@ def create_third_party(company_id: str, data: Dict[str, Any]) -> Optional[Dict[s
             'is_active': data.get('is_active', True)
         }
         response = supabase.table('third_parties').insert(third_party_data).execute()
+        publish(company_id, 'third_parties')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar terceiro: {e}")
         return None
 
 
+@_db_cached('third_parties')
 def get_third_parties(company_id: str, party_type: Optional[str] = None) -> List[Dict[str, Any]]:
     """Lista terceiros da empresa. Se party_type especificado, filtra por tipo."""
     if not supabase:
@@ -1219,6 +1421,8 @@ def recalculate_payable_status(company_id: str, payable_id: Optional[str] = None
             
             updated_count += 1
         
+        if updated_count:
+            publish(company_id, 'payables')
         print(f"✅ {updated_count} contas a pagar atualizadas")
         return True
         
@@ -1297,6 +1501,8 @@ def recalculate_receivable_status(company_id: str, receivable_id: Optional[str]
             
             updated_count += 1
         
+        if updated_count:
+            publish(company_id, 'receivables')
         print(f"✅ {updated_count} contas a receber atualizadas")
         return True
         
@@ -1358,6 +1564,7 @@ def create_account_payable(company_id: str, data: Dict[str, Any]) -> Optional[Di
             'recurrence_day': data.get('recurrence_day')
         }
         response = supabase.table('accounts_payable').insert(payable_data).execute()
+        publish(company_id, 'payables', payable_data['due_date'])
         
         # Recalcula automaticamente o status da conta recém-criada
         if response.data:
@@ -1373,6 +1580,7 @@ def create_account_payable(company_id: str, data: Dict[str, Any]) -> Optional[Di
         return None
 
 
+@_db_cached('payables')
 def get_accounts_payable(
     company_id: str, 
     status: Optional[str] = None,
@@ -1428,9 +1636,12 @@ def update_account_payable_status(payable_id: str, status: str, payment_date: Op
         
         # Recalcula automaticamente o status baseado nas datas atualizadas
         # Busca company_id para fazer a recalculação
-        account = supabase.table('accounts_payable').select('company_id').eq('id', payable_id).execute()
+        account = supabase.table('accounts_payable').select('company_id, due_date').eq('id', payable_id).execute()
         if account.data:
+            publish(account.data[0]['company_id'], 'payables', account.data[0].get('due_date'))
             recalculate_payable_status(account.data[0]['company_id'], payable_id)
+        else:
+            publish(None, 'payables')
         
         return True
     except Exception as e:
@@ -1466,6 +1677,7 @@ def create_account_receivable(company_id: str, data: Dict[str, Any]) -> Optional
             'recurrence_day': data.get('recurrence_day')
         }
         response = supabase.table('accounts_receivable').insert(receivable_data).execute()
+        publish(company_id, 'receivables', receivable_data['due_date'])
         
         # Recalcula automaticamente o status da conta recém-criada
         if response.data:
@@ -1481,6 +1693,7 @@ def create_account_receivable(company_id: str, data: Dict[str, Any]) -> Optional
         return None
 
 
+@_db_cached('receivables')
 def get_accounts_receivable(
     company_id: str,
     status: Optional[str] = None,
@@ -1527,9 +1740,12 @@ def update_account_receivable_status(receivable_id: str, status: str, payment_da
         
         # Recalcula automaticamente o status baseado nas datas atualizadas
         # Busca company_id para fazer a recalculação
-        account = supabase.table('accounts_receivable').select('company_id').eq('id', receivable_id).execute()
+        account = supabase.table('accounts_receivable').select('company_id, due_date').eq('id', receivable_id).execute()
         if account.data:
+            publish(account.data[0]['company_id'], 'receivables', account.data[0].get('due_date'))
             recalculate_receivable_status(account.data[0]['company_id'], receivable_id)
+        else:
+            publish(None, 'receivables')
         
         return True
     except Exception as e:
@@ -1553,12 +1769,14 @@ def create_financial_category(company_id: str, name: str, category_type: str, pa
             'parent_id': parent_id
         }
         response = supabase.table('financial_categories').insert(category_data).execute()
+        publish(company_id, 'categories')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar categoria: {e}")
         return None
 
 
+@_db_cached('categories')
 def get_financial_categories(company_id: str, category_type: Optional[str] = None) -> List[Dict[str, Any]]:
     """Lista categorias financeiras."""
     if not supabase:
@@ -1618,6 +1836,7 @@ def create_company_user(company_id: str, email: str, full_name: str, access_leve
         }
         
         response = supabase.table("users").insert(user_data).execute()
+        publish(user_data.get('company_id'), 'users')
         return response.data[0] if response.data else None
         
     except Exception as e:
@@ -1636,6 +1855,7 @@ def update_user_access_level(user_id: str, access_level: str) -> bool:
             .eq("id", user_id)
             .execute()
         )
+        publish(None, 'users')
         return bool(response.data)
     except Exception as e:
         print(f"❌ Erro ao atualizar nível de acesso: {e}")
@@ -1653,6 +1873,7 @@ def deactivate_user(user_id: str) -> bool:
             .eq("id", user_id)
             .execute()
         )
+        publish(None, 'users')
         return bool(response.data)
     except Exception as e:
         print(f"❌ Erro ao desativar usuário: {e}")
@@ -1702,6 +1923,7 @@ def create_approval_request(request_data: dict) -> Optional[Dict[str, Any]]:
         return None
     try:
         response = supabase.table("approval_requests").insert(request_data).execute()
+        publish(request_data.get('company_id'), 'approvals')
         return response.data[0] if response.data else None
     except Exception as e:
         print(f"❌ Erro ao criar solicitação de aprovação: {e}")
@@ -1746,6 +1968,7 @@ def approve_request(approval_id: str, approver_user_id: str, notes: Optional[str
             .eq("id", approval_id)
             .execute()
         )
+        publish(None, 'approvals')
         return bool(response.data)
     except Exception as e:
         print(f"❌ Erro ao aprovar solicitação: {e}")
@@ -1770,12 +1993,33 @@ def reject_request(approval_id: str, approver_user_id: str, reason: str) -> bool
             .eq("id", approval_id)
             .execute()
         )
+        publish(None, 'approvals')
         return bool(response.data)
     except Exception as e:
         print(f"❌ Erro ao rejeitar solicitação: {e}")
         return False
 
 
+def get_approved_requests(company_id: str, limit: int = 500) -> List[Dict[str, Any]]:
+    """Solicitações aprovadas mais recentes (tipo e análise), usadas para treinar o classificador local."""
+    if not supabase:
+        return []
+    try:
+        response = (
+            supabase.table("approval_requests")
+            .select("document_type, ai_analysis")
+            .eq("company_id", company_id)
+            .eq("status", "approved")
+            .order("approved_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return response.data if response.data else []
+    except Exception as e:
+        print(f"❌ Erro ao buscar solicitações aprovadas: {e}")
+        return []
+
+
 def get_approval_by_id(approval_id: str) -> Optional[Dict[str, Any]]:
     """Busca uma aprovação específica com informações do solicitante."""
     if not supabase:
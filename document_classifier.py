@@ -0,0 +1,210 @@
+"""
+Classificador local do tipo de documento (sem IA).
+
+Aprende com os documentos aprovados (solicitações de aprovação aprovadas e
+aprovações diretas do índice de documentos) a prever o par
+tipo_documento + tabela_destino a partir dos termos do texto extraído.
+
+Modelo: Naive Bayes multinomial sobre termos ponderados por IDF — um modelo
+linear (um peso por termo e classe) treinado em uma única passada e que
+classifica em microssegundos. O modelo de cada empresa fica em um JSON em
+disco, lido pelos processos de análise; com confiança suficiente, o
+documento vai para o extrator determinístico do tipo ou para um prompt
+menor, específico do tipo.
+"""
+
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from document_parsers import only_digits
+
+CLASSIFIER_DIR = os.getenv('CONTAI_CLASSIFIER_DIR') or os.path.join(tempfile.gettempdir(), 'contai_classifiers')
+
+# Termos guardados por documento (os mais frequentes) para treino
+MAX_DOCUMENT_TERMS = 200
+
+# Mínimo de exemplos (e de classes) para treinar; abaixo disso tudo segue para o prompt completo
+CLASSIFIER_MIN_SAMPLES = 20
+
+# Probabilidade mínima da classe prevista para usar a rota específica
+CLASSIFIER_MIN_CONFIDENCE = 0.85
+
+# Idade máxima do modelo salvo antes de treinar novamente (segundos)
+CLASSIFIER_RETRAIN_SECONDS = 3600
+
+# Suavização de Laplace
+ALPHA = 0.1
+
+_LABEL_SEPARATOR = '|'
+
+
+def tokenize(text: str) -> List[str]:
+    """Palavras com 3+ letras, em minúsculas (números variam de um documento para outro)."""
+    return re.findall(r'[^\W\d_]{3,}', (text or '').casefold())
+
+
+def document_terms(text: str, limit: int = MAX_DOCUMENT_TERMS) -> List[str]:
+    """Termos mais frequentes do documento, guardados na análise para treinar o classificador."""
+    return [term for term, _ in Counter(tokenize(text)).most_common(limit)]
+
+
+def make_label(document_type: Optional[str], table: Optional[str]) -> str:
+    return f"{document_type or 'OUTRO'}{_LABEL_SEPARATOR}{table or ''}"
+
+
+def split_label(label: str) -> Tuple[str, Optional[str]]:
+    document_type, table = label.split(_LABEL_SEPARATOR, 1)
+    return document_type, table or None
+
+
+class DocumentClassifier:
+    """Naive Bayes multinomial com termos ponderados por IDF."""
+
+    def __init__(self, idf: Optional[Dict[str, float]] = None, priors: Optional[Dict[str, float]] = None,
+                 weights: Optional[Dict[str, Dict[str, float]]] = None, defaults: Optional[Dict[str, float]] = None,
+                 samples: int = 0):
+        self.idf = idf or {}
+        self.priors = priors or {}
+        self.weights = weights or {}
+        self.defaults = defaults or {}
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, samples: Iterable[Tuple[Iterable[str], str]]) -> 'DocumentClassifier':
+        """Treina com (termos, rótulo). Cada termo conta uma vez por documento, com peso IDF."""
+        documents = [(set(terms), label) for terms, label in samples if terms]
+        document_frequency = Counter(term for terms, _ in documents for term in terms)
+        total = len(documents)
+        idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in document_frequency.items()}
+
+        class_counts = Counter(label for _, label in documents)
+        term_mass: Dict[str, Counter] = {label: Counter() for label in class_counts}
+        for terms, label in documents:
+            for term in terms:
+                term_mass[label][term] += idf[term]
+
+        vocabulary = len(idf)
+        weights, defaults = {}, {}
+        for label, mass in term_mass.items():
+            denominator = sum(mass.values()) + ALPHA * vocabulary
+            weights[label] = {term: math.log((value + ALPHA) / denominator) for term, value in mass.items()}
+            defaults[label] = math.log(ALPHA / denominator)  # Termo nunca visto na classe
+        priors = {label: math.log(count / total) for label, count in class_counts.items()}
+        return cls(idf, priors, weights, defaults, total)
+
+    def predict(self, terms: Iterable[str]) -> Optional[Tuple[str, float]]:
+        """Classe mais provável e sua probabilidade (None se o modelo estiver vazio)."""
+        if not self.priors:
+            return None
+        known = [term for term in set(terms) if term in self.idf]
+        scores = {
+            label: prior + sum(self.idf[term] * self.weights[label].get(term, self.defaults[label]) for term in known)
+            for label, prior in self.priors.items()
+        }
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'idf': self.idf, 'priors': self.priors, 'weights': self.weights,
+                'defaults': self.defaults, 'samples': self.samples}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DocumentClassifier':
+        return cls(data['idf'], data['priors'], data['weights'], data['defaults'], data.get('samples', 0))
+
+
+# =======================================================
+# MODELO POR EMPRESA (ARQUIVO JSON)
+# =======================================================
+
+_loaded: Dict[str, Tuple[float, DocumentClassifier]] = {}
+_loaded_lock = threading.Lock()
+
+
+def classifier_path(company_cnpj: Optional[str]) -> str:
+    return os.path.join(CLASSIFIER_DIR, f"{only_digits(company_cnpj) or 'sem_cnpj'}.json")
+
+
+def classifier_is_stale(company_cnpj: Optional[str], max_age: float = CLASSIFIER_RETRAIN_SECONDS) -> bool:
+    try:
+        return time.time() - os.path.getmtime(classifier_path(company_cnpj)) > max_age
+    except OSError:
+        return True
+
+
+def training_samples(analyses: Iterable[Dict[str, Any]]) -> List[Tuple[List[str], str]]:
+    """Exemplos (termos, rótulo) das análises aprovadas que guardaram os termos do documento."""
+    samples = []
+    for analysis in analyses:
+        if analysis and analysis.get('termos_documento') and analysis.get('tipo_documento'):
+            samples.append((analysis['termos_documento'], make_label(analysis['tipo_documento'], analysis.get('tabela_destino'))))
+    return samples
+
+
+def train_classifier(company_cnpj: Optional[str], analyses: Iterable[Dict[str, Any]]) -> Optional[DocumentClassifier]:
+    """Treina e salva o modelo da empresa; None se não houver exemplos suficientes."""
+    samples = training_samples(analyses)
+    if len(samples) < CLASSIFIER_MIN_SAMPLES or len({label for _, label in samples}) < 2:
+        return None
+    try:
+        classifier = DocumentClassifier.fit(samples)
+        os.makedirs(CLASSIFIER_DIR, exist_ok=True)
+        path = classifier_path(company_cnpj)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(classifier.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        print(f"🧠 Classificador de documentos treinado com {len(samples)} exemplos")
+        return classifier
+    except Exception as e:
+        print(f"⚠️ Erro ao treinar classificador de documentos: {e}")
+        return None
+
+
+def load_classifier(company_cnpj: Optional[str]) -> Optional[DocumentClassifier]:
+    """Modelo salvo da empresa (relido quando o arquivo muda)."""
+    path = classifier_path(company_cnpj)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, encoding='utf-8') as f:
+            classifier = DocumentClassifier.from_dict(json.load(f))
+    except Exception as e:
+        print(f"⚠️ Erro ao carregar classificador de documentos: {e}")
+        return None
+    with _loaded_lock:
+        _loaded[path] = (mtime, classifier)
+    return classifier
+
+
+def classify_document(company_cnpj: Optional[str], text: str,
+                      min_confidence: float = CLASSIFIER_MIN_CONFIDENCE) -> Optional[Dict[str, Any]]:
+    """
+    Tipo e tabela previstos para o texto.
+
+    Returns:
+        {'tipo_documento', 'tabela_destino', 'confianca'} ou None se não houver
+        modelo ou a confiança ficar abaixo de min_confidence.
+    """
+    classifier = load_classifier(company_cnpj)
+    if classifier is None:
+        return None
+    prediction = classifier.predict(document_terms(text))
+    if prediction is None or prediction[1] < min_confidence:
+        return None
+    document_type, table = split_label(prediction[0])
+    return {'tipo_documento': document_type, 'tabela_destino': table, 'confianca': round(prediction[1], 2)}
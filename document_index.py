@@ -0,0 +1,368 @@
+"""
+Índice local dos documentos já analisados (SQLite).
+
+Cada análise é registrada por empresa com o hash do conteúdo do arquivo e,
+quando existe, uma chave de negócio (chave de acesso da NF-e, código de
+barras do boleto/guia, CNPJ do emitente + número da nota). Antes de
+qualquer OCR ou chamada à IA o pipeline consulta o índice: o mesmo arquivo,
+ou o mesmo documento em outro arquivo, devolve a análise anterior marcada
+como duplicata, evitando o cadastro em dobro.
+
+Também guarda impressões aproximadas (hash perceptual da imagem e SimHash
+do texto, ver fingerprints.py), indexadas por faixas: um documento já
+enviado, reescaneado ou fotografado de novo, é reconhecido pelo texto antes
+da IA. A imagem semelhante sozinha (mesmo layout) só gera um aviso.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from document_parsers import only_digits
+from fingerprints import BANDS, MAX_DISTANCE, band_values, hamming_distance
+
+INDEX_DB_PATH = os.getenv('CONTAI_DOCUMENT_INDEX_PATH') or os.path.join(tempfile.gettempdir(), 'contai_documents.sqlite3')
+
+STATUS_PENDING = 'pending'
+STATUS_APPROVED = 'approved'
+STATUS_REJECTED = 'rejected'
+
+STATUS_LABELS = {
+    STATUS_PENDING: 'aguardando aprovação',
+    STATUS_APPROVED: 'aprovado',
+    STATUS_REJECTED: 'rejeitado',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_documents (
+    company TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    business_key TEXT,
+    file_name TEXT,
+    analysis TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (company, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_processed_documents_key ON processed_documents (company, business_key);
+CREATE TABLE IF NOT EXISTS document_fingerprints (
+    company TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (company, content_hash, kind)
+);
+CREATE TABLE IF NOT EXISTS fingerprint_bands (
+    company TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fingerprint_bands ON fingerprint_bands (company, kind, band, value);
+"""
+
+# Motivo exibido para cada tipo de impressão semelhante
+SIMILARITY_REASONS = {'phash': 'imagem semelhante', 'simhash': 'texto semelhante'}
+
+
+def business_key(analysis: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Chave que identifica o documento independentemente do arquivo (None se não houver)."""
+    if not analysis:
+        return None
+    data = analysis.get('dados_extraidos') or {}
+    access_key = only_digits(data.get('access_key'))
+    if len(access_key) >= 44:
+        return f"chave:{access_key}"
+    barcode = only_digits(data.get('barcode'))
+    if len(barcode) in (44, 47, 48):
+        return f"barras:{barcode}"
+    issuer = data.get('issuer') if isinstance(data.get('issuer'), dict) else {}
+    issuer_document = only_digits(issuer.get('cnpj') or issuer.get('cpf'))
+    number = only_digits(data.get('document_number'))
+    if analysis.get('tipo_documento') == 'NOTA_FISCAL' and issuer_document and number:
+        return f"nota:{issuer_document}:{number.lstrip('0')}"
+    return None
+
+
+class DocumentIndex:
+    """Documentos analisados por empresa, com busca por hash do conteúdo e por chave de negócio."""
+
+    def __init__(self, path: str = INDEX_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        document = dict(row)
+        document['analysis'] = json.loads(document['analysis']) if document.get('analysis') else None
+        return document
+
+    def find_by_hash(self, company: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT * FROM processed_documents WHERE company = ? AND content_hash = ?", (company, content_hash)
+        ).fetchone()
+        return self._to_dict(row)
+
+    def find_by_key(self, company: str, key: str, exclude_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Outro arquivo com a mesma chave de negócio (rejeitados são ignorados)."""
+        row = self._connect().execute(
+            "SELECT * FROM processed_documents WHERE company = ? AND business_key = ? AND content_hash != ? "
+            "AND status != ? ORDER BY created_at LIMIT 1",
+            (company, key, exclude_hash or '', STATUS_REJECTED)
+        ).fetchone()
+        return self._to_dict(row)
+
+    def record(self, company: str, content_hash: str, file_name: str, analysis: Dict[str, Any]):
+        """Registra (ou atualiza) a análise de um arquivo, mantendo o status já definido."""
+        now = time.time()
+        stored = {key: value for key, value in analysis.items() if key != 'duplicata_de'}
+        self._connect().execute(
+            "INSERT INTO processed_documents (company, content_hash, business_key, file_name, analysis, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (company, content_hash) DO UPDATE SET business_key = excluded.business_key, "
+            "analysis = excluded.analysis, updated_at = excluded.updated_at",
+            (company, content_hash, business_key(analysis), file_name,
+             json.dumps(stored, ensure_ascii=False, default=str), STATUS_PENDING, now, now)
+        )
+
+    def set_status(self, company: str, content_hash: str, status: str):
+        self._connect().execute(
+            "UPDATE processed_documents SET status = ?, updated_at = ? WHERE company = ? AND content_hash = ?",
+            (status, time.time(), company, content_hash)
+        )
+
+    def list_analyses(self, company: str, status: str, limit: int = 500) -> List[Dict[str, Any]]:
+        """Análises mais recentes com o status informado."""
+        rows = self._connect().execute(
+            "SELECT analysis FROM processed_documents WHERE company = ? AND status = ? AND analysis IS NOT NULL "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (company, status, limit)
+        ).fetchall()
+        return [json.loads(row['analysis']) for row in rows]
+
+    def record_fingerprint(self, company: str, content_hash: str, kind: str, fingerprint: int):
+        """Guarda a impressão e suas faixas (substitui a anterior do mesmo arquivo)."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM fingerprint_bands WHERE company = ? AND kind = ? AND content_hash = ?",
+                (company, kind, content_hash)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO document_fingerprints (company, content_hash, kind, fingerprint) VALUES (?, ?, ?, ?)",
+                (company, content_hash, kind, format(fingerprint, '016x'))
+            )
+            conn.executemany(
+                "INSERT INTO fingerprint_bands (company, kind, band, value, content_hash) VALUES (?, ?, ?, ?, ?)",
+                [(company, kind, band, value, content_hash)
+                 for band, value in enumerate(band_values(fingerprint, BANDS[kind]))]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def find_similar(self, company: str, kind: str, fingerprint: int,
+                     exclude_hash: Optional[str] = None) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Documento com impressão a no máximo MAX_DISTANCE[kind] bits (rejeitados são ignorados).
+
+        Só os arquivos com alguma faixa idêntica são comparados; devolve o mais
+        próximo e a distância, ou None.
+        """
+        bands = band_values(fingerprint, BANDS[kind])
+        conditions = " OR ".join("(b.band = ? AND b.value = ?)" for _ in bands)
+        params = [value for band, band_value in enumerate(bands) for value in (band, band_value)]
+        rows = self._connect().execute(
+            "SELECT DISTINCT f.content_hash, f.fingerprint FROM fingerprint_bands b "
+            "JOIN document_fingerprints f ON f.company = b.company AND f.kind = b.kind AND f.content_hash = b.content_hash "
+            f"WHERE b.company = ? AND b.kind = ? AND b.content_hash != ? AND ({conditions})",
+            [company, kind, exclude_hash or ''] + params
+        ).fetchall()
+
+        best = None
+        for row in rows:
+            distance = hamming_distance(fingerprint, int(row['fingerprint'], 16))
+            if distance <= MAX_DISTANCE[kind] and (best is None or distance < best[1]):
+                previous = self.find_by_hash(company, row['content_hash'])
+                if previous and previous['status'] != STATUS_REJECTED:
+                    best = (previous, distance)
+        return best
+
+
+_index: Optional[DocumentIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_document_index() -> DocumentIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DocumentIndex()
+        return _index
+
+
+def company_key(company_cnpj: Optional[str]) -> str:
+    return only_digits(company_cnpj) or 'sem_cnpj'
+
+
+def mark_duplicate(analysis: Dict[str, Any], previous: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    """Cópia da análise marcada como duplicata do documento anterior (exige confirmação)."""
+    marked = dict(analysis)
+    status = STATUS_LABELS.get(previous['status'], previous['status'])
+    processed_at = time.strftime('%d/%m/%Y %H:%M', time.localtime(previous['created_at']))
+    marked['duplicata_de'] = {
+        'file_name': previous.get('file_name'),
+        'status': previous['status'],
+        'processed_at': processed_at,
+        'reason': reason,
+    }
+    validation = dict(marked.get('validacao') or {})
+    validation['avisos'] = list(validation.get('avisos') or []) + [
+        f"Possível duplicata ({reason}) de '{previous.get('file_name')}', processado em {processed_at} ({status})"
+    ]
+    marked['validacao'] = validation
+    marked['acao_recomendada'] = 'SOLICITAR_CONFIRMACAO'
+    return marked
+
+
+def check_duplicate(company_cnpj: Optional[str], content_hash: str,
+                    analysis: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Procura o documento no índice.
+
+    Sem `analysis`, procura o mesmo arquivo (hash) e devolve a análise anterior
+    (marcada como duplicata se o anterior não foi rejeitado). Com `analysis`,
+    procura outro arquivo com a mesma chave de negócio e devolve a análise
+    recebida marcada como duplicata. None se não houver duplicata.
+    """
+    try:
+        index = get_document_index()
+        company = company_key(company_cnpj)
+        if analysis is None:
+            previous = index.find_by_hash(company, content_hash)
+            if previous is None or previous['analysis'] is None:
+                return None
+            if previous['status'] == STATUS_REJECTED:
+                return previous['analysis']  # Reaproveita a análise, sem aviso (reenvio após rejeição)
+            return mark_duplicate(previous['analysis'], previous, 'mesmo arquivo')
+
+        key = business_key(analysis)
+        if not key:
+            return None
+        previous = index.find_by_key(company, key, exclude_hash=content_hash)
+        return mark_duplicate(analysis, previous, 'mesmo documento') if previous else None
+    except Exception as e:
+        print(f"⚠️ Erro ao consultar índice de documentos: {e}")
+        return None
+
+
+def similar_document_analysis(file_name: str, previous: Dict[str, Any], kind: str, distance: int) -> Dict[str, Any]:
+    """
+    Análise provisória de um provável reenvio: nada é extraído nem cobrado.
+
+    Leva `analise_pendente`, para a interface oferecer a análise completa caso
+    o usuário confirme que não é o mesmo documento; por isso não é registrada
+    no índice.
+    """
+    reason = f"{SIMILARITY_REASONS.get(kind, kind)}, {distance} bit(s) de diferença"
+    analysis = {
+        'tipo_documento': (previous.get('analysis') or {}).get('tipo_documento', 'OUTRO'),
+        'confianca': 0.0,
+        'tabela_destino': (previous.get('analysis') or {}).get('tabela_destino'),
+        'dados_extraidos': {},
+        'campos_pendentes': [],
+        'validacao': {
+            'completo': False,
+            'erros': [f"Análise não realizada: '{file_name}' parece ser o mesmo documento que '{previous.get('file_name')}'"],
+            'avisos': [],
+        },
+        'acao_recomendada': 'SOLICITAR_CONFIRMACAO',
+        'analise_pendente': True,
+    }
+    return mark_duplicate(analysis, previous, reason)
+
+
+def add_similarity_warning(analysis: Dict[str, Any], previous: Dict[str, Any], kind: str,
+                           distance: int) -> Dict[str, Any]:
+    """Cópia da análise com aviso de semelhança (sem marcar como duplicata)."""
+    reason = f"{SIMILARITY_REASONS.get(kind, kind)}, {distance} bit(s) de diferença"
+    validation = dict(analysis.get('validacao') or {})
+    validation['avisos'] = list(validation.get('avisos') or []) + [
+        f"Semelhante a '{previous.get('file_name')}' ({reason}): confira se não é o mesmo documento"
+    ]
+    return {**analysis, 'validacao': validation}
+
+
+def find_similar_document(company_cnpj: Optional[str], content_hash: str,
+                          fingerprints: Dict[str, int]) -> Optional[Tuple[Dict[str, Any], str, int]]:
+    """Documento quase idêntico pelas impressões: (anterior, tipo da impressão, distância) ou None."""
+    try:
+        index = get_document_index()
+        company = company_key(company_cnpj)
+        for kind, fingerprint in fingerprints.items():
+            match = index.find_similar(company, kind, fingerprint, exclude_hash=content_hash)
+            if match:
+                previous, distance = match
+                return previous, kind, distance
+    except Exception as e:
+        print(f"⚠️ Erro ao procurar documentos semelhantes: {e}")
+    return None
+
+
+def check_similar(company_cnpj: Optional[str], content_hash: str, file_name: str,
+                  fingerprints: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """Procura documento quase idêntico pelas impressões; devolve a análise provisória ou None."""
+    match = find_similar_document(company_cnpj, content_hash, fingerprints)
+    if match is None:
+        return None
+    previous, kind, distance = match
+    return similar_document_analysis(file_name, previous, kind, distance)
+
+
+def record_document(company_cnpj: Optional[str], content_hash: str, file_name: str, analysis: Dict[str, Any],
+                    fingerprints: Optional[Dict[str, int]] = None):
+    try:
+        index = get_document_index()
+        company = company_key(company_cnpj)
+        index.record(company, content_hash, file_name, analysis)
+        for kind, fingerprint in (fingerprints or {}).items():
+            index.record_fingerprint(company, content_hash, kind, fingerprint)
+    except Exception as e:
+        print(f"⚠️ Erro ao registrar documento no índice: {e}")
+
+
+def approved_analyses(company_cnpj: Optional[str], limit: int = 500) -> List[Dict[str, Any]]:
+    try:
+        return get_document_index().list_analyses(company_key(company_cnpj), STATUS_APPROVED, limit)
+    except Exception as e:
+        print(f"⚠️ Erro ao consultar documentos aprovados: {e}")
+        return []
+
+
+def set_document_status(company_cnpj: Optional[str], content_hash: Optional[str], status: str):
+    if not content_hash:
+        return
+    try:
+        get_document_index().set_status(company_key(company_cnpj), content_hash, status)
+    except Exception as e:
+        print(f"⚠️ Erro ao atualizar documento no índice: {e}")
@@ -0,0 +1,836 @@
+"""
+Leitura determinística de documentos fiscais, sem passar pela IA.
+
+NF-e (modelos 55/65) e NFS-e (ABRASF e padrão nacional) em XML têm layout
+fixo: o arquivo é percorrido em streaming (iterparse), ignorando os
+namespaces, e o resultado já sai no formato da análise da IA
+(tipo_documento, tabela_destino, dados_extraidos, campos_pendentes,
+validacao, acao_recomendada). XMLs fora desses layouts devolvem None e
+seguem para a IA.
+
+Boletos e guias federais (DARF/DAS) são reconhecidos por regras sobre o
+texto extraído do PDF/imagem: a linha digitável tem dígitos verificadores
+e codifica valor e vencimento, e as guias trazem código, período e
+vencimento em rótulos fixos. A confiança é calibrada pelas conferências
+que passaram; se as regras não bastarem, o documento vai para a IA.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+# Tolerância (em reais) na conferência de somas (itens x total, parcelas x total)
+SUM_TOLERANCE = 0.05
+
+# Acima desta confiança (e sem pendências) o cadastro pode ser automático
+AUTO_APPROVE_CONFIDENCE = 0.95
+
+
+# =======================================================
+# 1. UTILITÁRIOS
+# =======================================================
+
+def only_digits(value: Any) -> str:
+    return re.sub(r'\D', '', str(value or ''))
+
+
+def to_amount(value: Any) -> Optional[float]:
+    """Valor decimal com ponto (padrão dos XMLs fiscais) ou vírgula."""
+    text = str(value or '').strip()
+    if not text:
+        return None
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    try:
+        return round(float(text), 2)
+    except ValueError:
+        return None
+
+
+def to_iso_date(value: Any) -> Optional[str]:
+    """Converte 'AAAA-MM-DD[Thh:mm...]' ou 'DD/MM/AAAA' para 'AAAA-MM-DD'."""
+    text = str(value or '').strip()
+    match = re.match(r'(\d{4})-(\d{2})-(\d{2})', text)
+    if match:
+        return match.group(0)
+    match = re.match(r'(\d{2})/(\d{2})/(\d{4})', text)
+    if match:
+        return f"{match.group(3)}-{match.group(2)}-{match.group(1)}"
+    return None
+
+
+def mod11_weighted(digits: str, max_weight: int = 9) -> int:
+    """Soma ponderada da direita para a esquerda com pesos 2..max_weight (módulo 11)."""
+    total, weight = 0, 2
+    for digit in reversed(digits):
+        total += int(digit) * weight
+        weight = 2 if weight == max_weight else weight + 1
+    return total % 11
+
+
+def cnpj_is_valid(cnpj: str) -> bool:
+    digits = only_digits(cnpj)
+    if len(digits) != 14 or digits == digits[0] * 14:
+        return False
+    for size in (12, 13):
+        remainder = mod11_weighted(digits[:size])
+        check = 0 if remainder < 2 else 11 - remainder
+        if int(digits[size]) != check:
+            return False
+    return True
+
+
+def nfe_access_key_is_valid(key: str) -> bool:
+    """Chave de acesso da NF-e: 44 dígitos, o último é o DV em módulo 11."""
+    digits = only_digits(key)
+    if len(digits) != 44:
+        return False
+    remainder = mod11_weighted(digits[:43])
+    check = 0 if remainder < 2 else 11 - remainder
+    return int(digits[43]) == check
+
+
+def _local(tag: Any) -> str:
+    """Nome do elemento sem namespace."""
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+# =======================================================
+# 2. LEITURA DO XML (iterparse)
+# =======================================================
+
+# Elementos que identificam cada layout
+LAYOUT_ROOTS = {
+    'infNFe': 'nfe',
+    'InfNfse': 'nfse',          # ABRASF
+    'infNFSe': 'nfse_nacional',  # Padrão nacional
+}
+
+NFE_IDE_FIELDS = {
+    'nNF': 'number', 'serie': 'series', 'dhEmi': 'emission_date', 'dEmi': 'emission_date',
+    'natOp': 'nature', 'tpNF': 'operation_type', 'mod': 'model',
+}
+NFE_ITEM_FIELDS = {
+    'cProd': 'code', 'xProd': 'description', 'NCM': 'ncm', 'CFOP': 'cfop',
+    'uCom': 'unit', 'qCom': 'quantity', 'vUnCom': 'unit_price', 'vProd': 'total',
+}
+NFE_TOTAL_FIELDS = {
+    'vBC': 'icms_base', 'vICMS': 'icms', 'vST': 'icms_st', 'vProd': 'products',
+    'vFrete': 'freight', 'vSeg': 'insurance', 'vDesc': 'discount', 'vIPI': 'ipi',
+    'vPIS': 'pis', 'vCOFINS': 'cofins', 'vOutro': 'other', 'vNF': 'total',
+    'vTotTrib': 'approximate_taxes',
+}
+NFE_TAX_KEYS = ('icms', 'icms_st', 'ipi', 'pis', 'cofins', 'approximate_taxes')
+
+NFSE_FIELDS = {
+    'Numero': 'number', 'CodigoVerificacao': 'verification_code',
+    'DataEmissao': 'emission_date', 'Competencia': 'reference_period',
+}
+NFSE_VALUE_FIELDS = {
+    'ValorServicos': 'services', 'ValorDeducoes': 'deductions', 'ValorPis': 'pis',
+    'ValorCofins': 'cofins', 'ValorInss': 'inss', 'ValorIr': 'ir', 'ValorCsll': 'csll',
+    'ValorIss': 'iss', 'ValorIssRetido': 'iss_withheld', 'BaseCalculo': 'iss_base',
+    'DescontoIncondicionado': 'discount', 'ValorLiquidoNfse': 'net',
+}
+NFSE_NACIONAL_FIELDS = {
+    'nNFSe': 'number', 'dhEmi': 'emission_date', 'dCompet': 'reference_period',
+    'xDescServ': 'description', 'cTribNac': 'service_code',
+}
+NFSE_NACIONAL_VALUE_FIELDS = {
+    'vServ': 'services', 'vISSQN': 'iss', 'vTotalRet': 'withheld', 'vLiq': 'net',
+}
+NFSE_TAX_KEYS = ('iss', 'pis', 'cofins', 'inss', 'ir', 'csll')
+
+PARTY_FIELDS = {
+    'CNPJ': 'cnpj', 'Cnpj': 'cnpj', 'CPF': 'cpf', 'Cpf': 'cpf',
+    'xNome': 'name', 'RazaoSocial': 'name', 'xFant': 'trade_name', 'NomeFantasia': 'trade_name',
+    'xMun': 'city', 'UF': 'state', 'Uf': 'state',
+}
+
+
+def _nfse_party(stack: List[str]) -> Optional[str]:
+    """Parte da NFS-e ABRASF a que o elemento pertence (prestador ou tomador)."""
+    for name in reversed(stack):
+        if name.startswith('Tomador'):
+            return 'recipient'
+        if name.startswith('Intermediario'):
+            return None
+        if name.startswith('Prestador'):
+            return 'issuer'
+    return None
+
+
+def scan_fiscal_xml(file_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Percorre o XML uma única vez e coleta os campos da nota.
+
+    Returns:
+        Dicionário com 'layout' e os campos encontrados, ou None se o XML for
+        inválido, não estiver em um layout conhecido ou tiver mais de uma nota.
+    """
+    doc: Dict[str, Any] = {
+        'layout': None, 'issuer': {}, 'recipient': {}, 'totals': {},
+        'items': [], 'installments': [], 'billing': {}, 'cancelled': False,
+    }
+    stack: List[str] = []
+    item: Dict[str, Any] = {}
+    installment: Dict[str, Any] = {}
+
+    try:
+        for event, elem in ET.iterparse(BytesIO(file_bytes), events=('start', 'end')):
+            name = _local(elem.tag)
+
+            if event == 'start':
+                stack.append(name)
+                if name in LAYOUT_ROOTS:
+                    if doc['layout'] is not None:
+                        print("⚠️ XML com mais de uma nota: enviado para a IA")
+                        return None
+                    doc['layout'] = LAYOUT_ROOTS[name]
+                    key = only_digits(elem.get('Id'))
+                    if key and name != 'InfNfse':  # No ABRASF o Id é livre, não é chave de acesso
+                        doc['access_key'] = key
+                elif name == 'det':
+                    item = {'number': elem.get('nItem')}
+                elif name == 'dup':
+                    installment = {}
+                elif name == 'NfseCancelamento':
+                    doc['cancelled'] = True
+                continue
+
+            text = (elem.text or '').strip()
+            parent = stack[-2] if len(stack) > 1 else ''
+            layout = doc['layout']
+
+            if layout == 'nfe':
+                if name == 'det':
+                    doc['items'].append(item)
+                    elem.clear()  # Itens podem ser muitos: libera a memória do elemento
+                elif name == 'dup':
+                    doc['installments'].append(installment)
+                elif not text:
+                    pass
+                elif parent == 'ide' and name in NFE_IDE_FIELDS:
+                    doc.setdefault(NFE_IDE_FIELDS[name], text)
+                elif parent in ('emit', 'enderEmit') and name in PARTY_FIELDS:
+                    doc['issuer'].setdefault(PARTY_FIELDS[name], text)
+                elif parent in ('dest', 'enderDest') and name in PARTY_FIELDS:
+                    doc['recipient'].setdefault(PARTY_FIELDS[name], text)
+                elif parent == 'prod' and 'det' in stack and name in NFE_ITEM_FIELDS:
+                    item[NFE_ITEM_FIELDS[name]] = text
+                elif parent == 'ICMSTot' and name in NFE_TOTAL_FIELDS:
+                    doc['totals'][NFE_TOTAL_FIELDS[name]] = to_amount(text)
+                elif parent == 'fat':
+                    doc['billing'][name] = text
+                elif parent == 'dup':
+                    installment[name] = text
+                elif name == 'chNFe':
+                    doc['access_key'] = only_digits(text)
+                elif name == 'infCpl':
+                    doc['additional_info'] = text[:500]
+
+            elif layout == 'nfse':
+                if not text:
+                    pass
+                elif parent == 'InfNfse' and name in NFSE_FIELDS:
+                    doc.setdefault(NFSE_FIELDS[name], text)
+                elif parent in ('Valores', 'ValoresNfse') and name in NFSE_VALUE_FIELDS:
+                    doc['totals'][NFSE_VALUE_FIELDS[name]] = to_amount(text)
+                elif name == 'IssRetido':
+                    doc['iss_withheld_flag'] = text == '1'
+                elif name == 'Discriminacao':
+                    doc.setdefault('description', text)
+                elif name == 'ItemListaServico':
+                    doc.setdefault('service_code', text)
+                elif name in PARTY_FIELDS:
+                    party = _nfse_party(stack)
+                    if party:
+                        doc[party].setdefault(PARTY_FIELDS[name], text)
+
+            elif layout == 'nfse_nacional':
+                if not text:
+                    pass
+                elif name in NFSE_NACIONAL_FIELDS:
+                    doc.setdefault(NFSE_NACIONAL_FIELDS[name], text)
+                elif name in NFSE_NACIONAL_VALUE_FIELDS:
+                    doc['totals'].setdefault(NFSE_NACIONAL_VALUE_FIELDS[name], to_amount(text))
+                elif parent in ('emit', 'prest', 'enderNac') and 'toma' not in stack and name in PARTY_FIELDS:
+                    doc['issuer'].setdefault(PARTY_FIELDS[name], text)
+                elif 'toma' in stack and name in PARTY_FIELDS:
+                    doc['recipient'].setdefault(PARTY_FIELDS[name], text)
+
+            stack.pop()
+    except ET.ParseError as e:
+        print(f"⚠️ XML inválido: {e}")
+        return None
+    except Exception as e:
+        print(f"⚠️ Erro ao ler XML fiscal: {e}")
+        return None
+
+    return doc if doc['layout'] else None
+
+
+# =======================================================
+# 3. MONTAGEM DA ANÁLISE
+# =======================================================
+
+def _party_document(party: Dict[str, str]) -> str:
+    return only_digits(party.get('cnpj') or party.get('cpf'))
+
+
+def _confidence(failed_checks: int, pending_fields: int) -> float:
+    """Confiança da leitura: alta por padrão (layout fixo), reduzida por conferência que falhou."""
+    confidence = 0.99 - 0.1 * failed_checks - 0.05 * pending_fields
+    return round(max(0.5, confidence), 2)
+
+
+def _recommended_action(confidence: float, complete: bool) -> str:
+    if not complete:
+        return 'SOLICITAR_CONFIRMACAO'
+    return 'CADASTRAR_AUTOMATICO' if confidence >= AUTO_APPROVE_CONFIDENCE else 'SOLICITAR_CONFIRMACAO'
+
+
+def build_invoice_analysis(doc: Dict[str, Any], company_cnpj: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Converte a nota lida por scan_fiscal_xml na análise usada pela tela de aprovação.
+
+    A direção (pagar ou receber) vem da comparação do CNPJ da empresa com o
+    emitente e o destinatário da nota.
+    """
+    layout = doc['layout']
+    is_nfe = layout == 'nfe'
+    issuer, recipient, totals = doc['issuer'], doc['recipient'], doc['totals']
+    errors: List[str] = []
+    warnings: List[str] = []
+    pending: List[Dict[str, str]] = []
+    failed_checks = 0
+
+    # Direção: a empresa emitiu (receber) ou recebeu (pagar) a nota
+    company = only_digits(company_cnpj)
+    if company and _party_document(issuer) == company:
+        # Nota de entrada emitida pela própria empresa (ex.: compra de produtor rural) é a pagar
+        incoming = is_nfe and doc.get('operation_type') == '0'
+        table = 'accounts_payable' if incoming else 'accounts_receivable'
+        counterparty = recipient
+    elif company and _party_document(recipient) == company:
+        table, counterparty = 'accounts_payable', issuer
+    else:
+        table, counterparty = 'accounts_payable', issuer
+        warnings.append("CNPJ da empresa não aparece como emitente nem como destinatário da nota")
+        failed_checks += 1
+
+    # Valor: líquido da fatura/nota, ou total
+    if is_nfe:
+        amount = to_amount(doc['billing'].get('vLiq')) or totals.get('total')
+    else:
+        amount = totals.get('net') or totals.get('services')
+
+    installments = [
+        {
+            'number': installment.get('nDup'),
+            'due_date': to_iso_date(installment.get('dVenc')),
+            'amount': to_amount(installment.get('vDup')),
+        }
+        for installment in doc['installments']
+    ]
+    due_dates = sorted(i['due_date'] for i in installments if i['due_date'])
+    emission_date = to_iso_date(doc.get('emission_date'))
+
+    counterparty_name = counterparty.get('name') or counterparty.get('trade_name') or ''
+    kind = 'NF-e' if is_nfe else 'NFS-e'
+    number = (doc.get('number') or '').lstrip('0') or doc.get('number')
+    if is_nfe:
+        description = f"{kind} {number or ''} - {counterparty_name}".strip(' -')
+    else:
+        description = (doc.get('description') or f"{kind} {number or ''} - {counterparty_name}")[:200].strip(' -')
+
+    data: Dict[str, Any] = {
+        'description': description,
+        'amount': amount,
+        'due_date': due_dates[0] if due_dates else None,
+        'emission_date': emission_date,
+        'document_number': number,
+        'access_key': doc.get('access_key'),
+        'issuer': issuer,
+        'recipient': recipient,
+        'totals': totals,
+        'taxes': {key: totals[key] for key in (NFE_TAX_KEYS if is_nfe else NFSE_TAX_KEYS) if totals.get(key)},
+    }
+    if table == 'accounts_receivable':
+        data['customer'] = counterparty_name
+    else:
+        data['supplier'] = counterparty_name
+    if is_nfe:
+        data['series'] = doc.get('series')
+        data['nature'] = doc.get('nature')
+        data['items'] = doc['items']
+        data['installments'] = installments
+        if doc.get('additional_info'):
+            data['notes'] = doc['additional_info']
+    else:
+        data['verification_code'] = doc.get('verification_code')
+        data['service_code'] = doc.get('service_code')
+        data['reference_period'] = to_iso_date(doc.get('reference_period')) or doc.get('reference_period')
+        if doc.get('iss_withheld_flag'):
+            warnings.append("ISS retido pelo tomador")
+
+    # Campos obrigatórios
+    if not amount:
+        errors.append("Valor total não encontrado no XML")
+    if not counterparty_name:
+        pending.append({'campo': 'supplier' if table == 'accounts_payable' else 'customer',
+                        'motivo': 'Nome da outra parte não encontrado no XML', 'sugestao': ''})
+    if not data['due_date']:
+        pending.append({'campo': 'due_date', 'motivo': 'Nota sem duplicatas (vencimento não informado)',
+                        'sugestao': emission_date or ''})
+    if doc['cancelled']:
+        errors.append("Nota cancelada")
+
+    # Conferências
+    issuer_cnpj = only_digits(issuer.get('cnpj'))
+    if issuer_cnpj and not cnpj_is_valid(issuer_cnpj):
+        warnings.append(f"CNPJ do emitente inválido: {issuer_cnpj}")
+        failed_checks += 1
+    if is_nfe:
+        key = doc.get('access_key')
+        if not key:
+            warnings.append("Chave de acesso não encontrada")
+            failed_checks += 1
+        elif not nfe_access_key_is_valid(key):
+            warnings.append("Chave de acesso com dígito verificador inválido")
+            failed_checks += 1
+        elif issuer_cnpj and key[6:20] != issuer_cnpj:
+            warnings.append("CNPJ do emitente não confere com a chave de acesso")
+            failed_checks += 1
+
+        items_total = sum(to_amount(i.get('total')) or 0 for i in doc['items'])
+        if totals.get('products') is not None and abs(items_total - totals['products']) > SUM_TOLERANCE:
+            warnings.append(f"Soma dos itens ({items_total:.2f}) difere do total dos produtos ({totals['products']:.2f})")
+            failed_checks += 1
+        installments_total = sum(i['amount'] or 0 for i in installments)
+        if installments and amount and abs(installments_total - amount) > SUM_TOLERANCE:
+            warnings.append(f"Soma das duplicatas ({installments_total:.2f}) difere do valor da nota ({amount:.2f})")
+            failed_checks += 1
+        if len(installments) > 1:
+            warnings.append(f"Nota com {len(installments)} duplicatas: vencimento da primeira usado no cadastro")
+
+    complete = not errors and not pending
+    confidence = _confidence(failed_checks + len(errors), len(pending))
+    return {
+        'tipo_documento': 'NOTA_FISCAL',
+        'confianca': confidence,
+        'tabela_destino': table,
+        'dados_extraidos': data,
+        'campos_pendentes': pending,
+        'validacao': {'completo': complete, 'erros': errors, 'avisos': warnings},
+        'acao_recomendada': _recommended_action(confidence, complete),
+        'origem': f"parser_{layout}",
+    }
+
+
+def parse_fiscal_xml(file_bytes: bytes, company_cnpj: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Lê NF-e/NFS-e em XML diretamente, sem IA.
+
+    Returns:
+        Análise no formato da IA, ou None para XMLs fora dos layouts conhecidos
+        (que devem ser enviados para a IA).
+    """
+    doc = scan_fiscal_xml(file_bytes)
+    if doc is None:
+        return None
+    try:
+        return build_invoice_analysis(doc, company_cnpj)
+    except Exception as e:
+        print(f"⚠️ Erro ao montar análise do XML fiscal: {e}")
+        return None
+
+
+# =======================================================
+# 4. LINHA DIGITÁVEL (BOLETO BANCÁRIO E ARRECADAÇÃO)
+# =======================================================
+
+# Fator de vencimento: dias desde 07/10/1997; após o fator 9999 (21/02/2025)
+# a contagem recomeçou em 1000 (22/02/2025)
+BOLETO_BASE_DATE = date(1997, 10, 7)
+BOLETO_RESTART_DATE = date(2025, 2, 22)
+
+# Sequências de dígitos (com pontos, hífens e espaços) candidatas a linha digitável
+PAYMENT_LINE_CANDIDATE = re.compile(r'\d[\d.\- \t\n]{44,200}\d')
+
+
+def mod10_digit(digits: str) -> int:
+    """DV em módulo 10 (pesos 2 e 1 alternados da direita para a esquerda)."""
+    total, weight = 0, 2
+    for digit in reversed(digits):
+        product = int(digit) * weight
+        total += product // 10 + product % 10
+        weight = 1 if weight == 2 else 2
+    return (10 - total % 10) % 10
+
+
+def bank_slip_general_digit(digits: str) -> int:
+    """DV geral do código de barras do boleto bancário (módulo 11, 43 dígitos sem o DV)."""
+    check = 11 - mod11_weighted(digits)
+    return 1 if check in (0, 10, 11) else check
+
+
+def collection_digit(digits: str, use_mod10: bool) -> int:
+    """DV dos documentos de arrecadação (concessionárias e tributos)."""
+    if use_mod10:
+        return mod10_digit(digits)
+    remainder = mod11_weighted(digits)
+    return 0 if remainder in (0, 1) else 11 - remainder
+
+
+def boleto_due_date(factor: int, reference: Optional[date] = None) -> Optional[date]:
+    """
+    Vencimento a partir do fator. Como o fator recomeçou em 2025, escolhe entre
+    a contagem antiga e a nova a data mais próxima da referência (emissão ou hoje).
+    """
+    if factor <= 0:
+        return None
+    reference = reference or date.today()
+    candidates = [BOLETO_BASE_DATE + timedelta(days=factor)]
+    if factor >= 1000:
+        candidates.append(BOLETO_RESTART_DATE + timedelta(days=factor - 1000))
+    return min(candidates, key=lambda candidate: abs((candidate - reference).days))
+
+
+def parse_bank_slip_line(digits: str) -> Optional[Dict[str, Any]]:
+    """Linha digitável do boleto bancário (47 dígitos): confere os DVs e decodifica."""
+    if len(digits) != 47:
+        return None
+    fields = [(digits[0:9], digits[9]), (digits[10:20], digits[20]), (digits[21:31], digits[31])]
+    if any(mod10_digit(body) != int(check) for body, check in fields):
+        return None
+
+    barcode = digits[0:4] + digits[32] + digits[33:47] + digits[4:9] + digits[10:20] + digits[21:31]
+    if bank_slip_general_digit(barcode[:4] + barcode[5:]) != int(barcode[4]):
+        return None
+
+    return {
+        'kind': 'bancario',
+        'line': digits,
+        'barcode': barcode,
+        'bank_code': digits[:3],
+        'due_factor': int(digits[33:37]),
+        'amount': int(digits[37:47]) / 100 or None,
+    }
+
+
+def parse_collection_line(digits: str) -> Optional[Dict[str, Any]]:
+    """Linha digitável de arrecadação (48 dígitos, começa com 8): confere os DVs e decodifica."""
+    if len(digits) != 48 or digits[0] != '8' or digits[2] not in '6789':
+        return None
+    use_mod10 = digits[2] in '67'
+    blocks = [(digits[i:i + 11], digits[i + 11]) for i in range(0, 48, 12)]
+    if any(collection_digit(body, use_mod10) != int(check) for body, check in blocks):
+        return None
+
+    barcode = "".join(body for body, _ in blocks)
+    if collection_digit(barcode[:3] + barcode[4:], use_mod10) != int(barcode[3]):
+        return None
+
+    # Identificador 6/8: valor efetivo; 7/9: valor de referência (não é o valor a pagar)
+    amount = int(barcode[4:15]) / 100 if digits[2] in '68' else 0
+    return {
+        'kind': 'arrecadacao',
+        'line': digits,
+        'barcode': barcode,
+        'segment': barcode[1],
+        'amount': amount or None,
+    }
+
+
+def find_payment_line(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Procura no texto uma linha digitável válida (boleto ou arrecadação).
+
+    Só são testadas sequências que começam no início de um grupo de dígitos,
+    e só é aceita a que passar em todos os dígitos verificadores.
+    """
+    for match in PAYMENT_LINE_CANDIDATE.finditer(text):
+        groups = re.findall(r'[\d.\-]+', match.group(0))
+        for index in range(len(groups)):
+            digits = only_digits("".join(groups[index:]))
+            if len(digits) < 47:
+                break
+            parsed = parse_bank_slip_line(digits[:47]) or parse_collection_line(digits[:48])
+            if parsed:
+                return parsed
+    return None
+
+
+# =======================================================
+# 5. BOLETOS E GUIAS (DARF/DAS) A PARTIR DO TEXTO
+# =======================================================
+
+AMOUNT_PATTERN = r'(\d{1,3}(?:\.\d{3})*,\d{2})'
+DATE_PATTERN = r'(\d{2}/\d{2}/\d{4})'
+CNPJ_PATTERN = r'(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2})'
+
+MONTHS_PT = {
+    'janeiro': 1, 'fevereiro': 2, 'marco': 3, 'março': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+    'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12,
+}
+
+# Códigos de receita mais comuns em DARF
+DARF_REVENUE_CODES = {
+    '0561': 'IRRF - Trabalho Assalariado', '1708': 'IRRF - Serviços PJ', '2089': 'IRPJ - Lucro Presumido',
+    '2372': 'CSLL - Lucro Presumido', '0220': 'IRPJ - Lucro Real', '2484': 'CSLL - Lucro Real',
+    '8109': 'PIS', '2172': 'COFINS', '5952': 'CSRF (PIS/COFINS/CSLL retidos)', '1138': 'Contribuição Previdenciária',
+}
+
+# Pesos das conferências na confiança (somados a CONFIDENCE_BASE, limitado a CONFIDENCE_MAX)
+CONFIDENCE_BASE = 0.5
+CONFIDENCE_MAX = 0.99
+BANK_SLIP_EVIDENCE = {'line_valid': 0.35, 'amount_matches': 0.07, 'due_matches': 0.05, 'payee_found': 0.02}
+TAX_GUIDE_EVIDENCE = {
+    'required_found': 0.2, 'line_valid': 0.15, 'amount_matches': 0.1,
+    'period_found': 0.02, 'company_matches': 0.02,
+}
+
+
+def find_after(text: str, label: str, pattern: str, window: int = 150) -> Optional[str]:
+    """Primeiro valor no formato `pattern` logo após o rótulo (na mesma linha ou nas seguintes)."""
+    for match in re.finditer(label, text, re.IGNORECASE):
+        value = re.search(pattern, text[match.end():match.end() + window])
+        if value:
+            return value.group(1)
+    return None
+
+
+def find_party_after(text: str, label: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Nome e CNPJ/CPF da parte indicada pelo rótulo (ex.: 'Beneficiário'),
+    no resto da linha ou na linha seguinte.
+    """
+    for match in re.finditer(label, text, re.IGNORECASE):
+        rest = text[match.end():].lstrip(' :-\t')
+        lines = [line.strip() for line in rest.split('\n')[:2]]
+        for line in lines:
+            if re.search(r'ag[eê]ncia|c[oó]digo|endere[cç]o', line, re.IGNORECASE):
+                continue
+            document = re.search(CNPJ_PATTERN, line)
+            name = re.split(r'\s*(?:CNPJ|CPF|CNPJ/CPF)\b|\s*' + CNPJ_PATTERN, line)[0].strip(' :-')
+            if sum(char.isalpha() for char in name) >= 3:
+                return name[:120], only_digits(document.group(1)) if document else None
+    return None, None
+
+
+def _parse_br_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return datetime.strptime(value, '%d/%m/%Y').date() if value else None
+    except ValueError:
+        return None
+
+
+def _normalize_period(value: Optional[str]) -> Optional[str]:
+    """Período de apuração como 'MM/AAAA' (aceita 'DD/MM/AAAA', 'MM/AAAA' e 'Abril/2024')."""
+    if not value:
+        return None
+    match = re.fullmatch(r'(?:\d{2}/)?(\d{2})/(\d{4})', value)
+    if match:
+        return f"{match.group(1)}/{match.group(2)}"
+    match = re.fullmatch(r'([A-Za-zçÇ]+)/(\d{4})', value)
+    if match and match.group(1).lower() in MONTHS_PT:
+        return f"{MONTHS_PT[match.group(1).lower()]:02d}/{match.group(2)}"
+    return None
+
+
+def _score(evidence: Dict[str, bool], weights: Dict[str, float], pending_fields: int) -> float:
+    confidence = CONFIDENCE_BASE + sum(weights[name] for name, passed in evidence.items() if passed)
+    return round(max(0.3, min(CONFIDENCE_MAX, confidence) - 0.05 * pending_fields), 2)
+
+
+def _amounts_match(first: Optional[float], second: Optional[float]) -> bool:
+    return first is not None and second is not None and abs(first - second) <= 0.01
+
+
+def parse_tax_guide(text: str, company_cnpj: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """DARF/DAS: tipo, código da receita, período, vencimento e valor. None se não for guia ou faltar valor/vencimento."""
+    if re.search(r'Simples\s+Nacional', text, re.IGNORECASE) and re.search(r'\bDAS\b|Documento\s+de\s+Arrecada', text, re.IGNORECASE):
+        obligation_type = 'DAS'
+    elif re.search(r'\bDARF\b|Receitas\s+Federais', text, re.IGNORECASE):
+        obligation_type = 'DARF'
+    else:
+        return None
+
+    due = _parse_br_date(find_after(text, r'(?:Data\s+de\s+)?Vencimento|Pagar\s+(?:este\s+documento\s+)?at[eé]', DATE_PATTERN))
+    amount = to_amount(find_after(text, r'Valor\s+Total(?:\s+do\s+Documento)?|Valor\s+a\s+Pagar', AMOUNT_PATTERN))
+    line = find_payment_line(text)
+    if line and line['kind'] != 'arrecadacao':
+        line = None
+    if amount is None and line:
+        amount = line['amount']
+    if amount is None or due is None:
+        return None
+
+    period = _normalize_period(find_after(
+        text, r'Per[ií]odo\s+de\s+Apura[cç][aã]o', r'(\d{2}/\d{2}/\d{4}|\d{2}/\d{4}|[A-Za-zçÇ]+/\d{4})'
+    ))
+    revenue_code = find_after(text, r'C[oó]digo\s+(?:da\s+)?Receita', r'\b(\d{4})\b') if obligation_type == 'DARF' else None
+    document_number = find_after(text, r'N[uú]mero\s+(?:do\s+)?Documento', r'(\d[\d.\-/]{7,}\d)')
+
+    company = only_digits(company_cnpj)
+    guide_cnpjs = {only_digits(value) for value in re.findall(CNPJ_PATTERN, text)}
+    warnings: List[str] = []
+    if company and guide_cnpjs and company not in guide_cnpjs:
+        warnings.append("CNPJ da guia diferente do CNPJ da empresa")
+    if line and not _amounts_match(line['amount'], amount):
+        warnings.append("Valor do código de barras diferente do valor impresso")
+    if not line:
+        warnings.append("Código de barras não encontrado ou inválido")
+
+    if revenue_code:
+        description = DARF_REVENUE_CODES.get(revenue_code)
+        obligation_type = f"DARF {revenue_code}" + (f" - {description}" if description else "")
+
+    pending: List[Dict[str, str]] = []
+    if not period:
+        pending.append({'campo': 'reference_period', 'motivo': 'Período de apuração não encontrado', 'sugestao': ''})
+
+    evidence = {
+        'required_found': True,
+        'line_valid': line is not None,
+        'amount_matches': bool(line) and _amounts_match(line['amount'], amount),
+        'period_found': bool(period),
+        'company_matches': bool(company) and company in guide_cnpjs,
+    }
+    confidence = _score(evidence, TAX_GUIDE_EVIDENCE, len(pending))
+    complete = not pending
+
+    data = {
+        'obligation_type': obligation_type,
+        'due_date': due.isoformat(),
+        'amount': amount,
+        'reference_period': period,
+        'status': 'Pendente',
+        'document_number': document_number,
+    }
+    if line:
+        data['barcode'] = line['barcode']
+
+    return {
+        'tipo_documento': 'GUIA_IMPOSTO',
+        'confianca': confidence,
+        'tabela_destino': 'tax_obligations',
+        'dados_extraidos': data,
+        'campos_pendentes': pending,
+        'validacao': {'completo': complete, 'erros': [], 'avisos': warnings},
+        'acao_recomendada': _recommended_action(confidence, complete),
+        'origem': 'regras_guia',
+    }
+
+
+def parse_bank_slip(text: str, company_cnpj: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Boleto: valor e vencimento da linha digitável, conferidos com o texto impresso. None sem linha válida."""
+    line = find_payment_line(text)
+    if line is None:
+        return None
+
+    emission = _parse_br_date(find_after(text, r'Data\s+(?:do\s+)?Documento|Data\s+(?:de\s+)?Emiss[aã]o', DATE_PATTERN))
+    printed_due = _parse_br_date(find_after(text, r'Vencimento', DATE_PATTERN))
+    printed_amount = to_amount(find_after(text, r'Valor\s+(?:do\s+)?Documento|Valor\s+(?:a\s+)?(?:Pagar|Cobrado)', AMOUNT_PATTERN))
+
+    if line['kind'] == 'bancario':
+        due = boleto_due_date(line['due_factor'], emission or printed_due)
+    else:
+        due = printed_due  # Arrecadação (contas de consumo) não codifica o vencimento
+    amount = line['amount'] or printed_amount
+    due = due or printed_due
+
+    payee, payee_document = find_party_after(text, r'Benefici[aá]rio(?:\s+Final)?|Cedente')
+    payer, _ = find_party_after(text, r'Pagador|Sacado')
+
+    company = only_digits(company_cnpj)
+    if company and payee_document == company:
+        table, counterparty_field, counterparty = 'accounts_receivable', 'customer', payer
+    else:
+        table, counterparty_field, counterparty = 'accounts_payable', 'supplier', payee
+
+    warnings: List[str] = []
+    if printed_amount is not None and amount is not None and not _amounts_match(printed_amount, amount):
+        warnings.append("Valor impresso diferente do valor da linha digitável")
+    if printed_due and due and printed_due != due:
+        warnings.append("Vencimento impresso diferente do vencimento da linha digitável")
+
+    pending: List[Dict[str, str]] = []
+    if not counterparty:
+        pending.append({'campo': counterparty_field, 'motivo': 'Beneficiário/pagador não identificado no texto', 'sugestao': ''})
+    if not due:
+        pending.append({'campo': 'due_date', 'motivo': 'Vencimento não encontrado', 'sugestao': ''})
+    errors = [] if amount else ["Valor não encontrado no boleto"]
+
+    document_number = find_after(text, r'Nosso\s+N[uú]mero', r'(\d[\d/\-. ]{4,}\d)')
+    data = {
+        'description': f"Boleto - {counterparty}" if counterparty else "Boleto",
+        'amount': amount,
+        'due_date': due.isoformat() if due else None,
+        'emission_date': emission.isoformat() if emission else None,
+        counterparty_field: counterparty,
+        'barcode': line['barcode'],
+        'digitable_line': line['line'],
+        'document_number': document_number.strip() if document_number else None,
+    }
+    if line['kind'] == 'bancario':
+        data['bank_code'] = line['bank_code']
+
+    evidence = {
+        'line_valid': True,
+        'amount_matches': _amounts_match(printed_amount, line['amount']),
+        'due_matches': line['kind'] == 'bancario' and printed_due is not None and printed_due == due,
+        'payee_found': bool(counterparty),
+    }
+    confidence = _score(evidence, BANK_SLIP_EVIDENCE, len(pending) + len(errors))
+    complete = not pending and not errors
+
+    return {
+        'tipo_documento': 'BOLETO',
+        'confianca': confidence,
+        'tabela_destino': table,
+        'dados_extraidos': data,
+        'campos_pendentes': pending,
+        'validacao': {'completo': complete, 'erros': errors, 'avisos': warnings},
+        'acao_recomendada': _recommended_action(confidence, complete),
+        'origem': 'regras_boleto',
+    }
+
+
+# Regras por tipo de documento, na ordem em que são tentadas
+RULE_PARSERS = {
+    'GUIA_IMPOSTO': parse_tax_guide,
+    'BOLETO': parse_bank_slip,
+}
+
+
+def parse_document_text(text: str, company_cnpj: Optional[str] = None,
+                        preferred_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Reconhece boletos e guias DARF/DAS no texto extraído, sem IA.
+
+    Todas as regras são tentadas (a conferência dos dígitos verificadores é
+    que decide); preferred_type, o tipo previsto pelo classificador local,
+    só define qual é tentada primeiro.
+
+    Returns:
+        Análise no formato da IA, ou None quando as regras não reconhecem o
+        documento (que então segue para a IA).
+    """
+    if not text or not text.strip():
+        return None
+    if re.search(r'\bDANFE\b|Documento\s+Auxiliar\s+da\s+Nota', text, re.IGNORECASE):
+        return None  # Nota fiscal impressa: fica com a IA
+    order = sorted(RULE_PARSERS, key=lambda document_type: document_type != preferred_type)
+    try:
+        for document_type in order:
+            analysis = RULE_PARSERS[document_type](text, company_cnpj)
+            if analysis is not None:
+                return analysis
+        return None
+    except Exception as e:
+        print(f"⚠️ Erro nas regras de boleto/guia: {e}")
+        return None
@@ -0,0 +1,793 @@
+"""
+Análise de documentos enviados: extração de texto, regras determinísticas e IA.
+
+Vários arquivos são analisados ao mesmo tempo em um pool de threads; as
+chamadas à IA respeitam, por provedor, um limite de chamadas simultâneas e
+de tokens por minuto, e erros 429/5xx são repetidos com espera exponencial
+(ou o Retry-After do provedor). Os resultados são entregues à medida que
+cada arquivo termina.
+
+Não importa o Streamlit: as funções daqui rodam fora da thread da interface.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from ai_providers import PROMPT_CACHE_BREAK, chat_with_ai, estimate_tokens, get_error_status, get_retry_after, is_retryable_error
+from document_index import add_similarity_warning, check_duplicate, check_similar, find_similar_document, record_document
+from document_classifier import classify_document, document_terms
+from document_parsers import parse_document_text, parse_fiscal_xml, to_amount, to_iso_date
+from document_templates import extract_with_template, learn_template
+from extraction_cache import get_extraction_cache
+from fingerprints import compute_fingerprints
+from json_repair import loads_tolerant
+from model_cascade import cascade_stages, run_cascade
+from ocr import ocr_settings
+from pdf_text import OCR_PAGE_ERROR_MARKER
+from shared_cache import get_shared_cache
+from token_budget import fit_content
+
+# Arquivos analisados em paralelo
+DOCUMENT_WORKERS = int(os.getenv('CONTAI_DOCUMENT_WORKERS', '4'))
+
+# Novas tentativas em erros 429/5xx (espera exponencial com jitter, limitada)
+AI_MAX_RETRIES = int(os.getenv('CONTAI_AI_MAX_RETRIES', '4'))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Limites padrão por provedor: (chamadas simultâneas, tokens por minuto).
+# Podem ser alterados com CONTAI_AI_CONCURRENCY_<PROVEDOR> e CONTAI_AI_TPM_<PROVEDOR>.
+PROVIDER_LIMITS = {
+    'gemini': (4, 1_000_000),
+    'openai': (8, 200_000),
+    'groq': (2, 6_000),
+    'anthropic': (4, 40_000),
+}
+
+# Tokens de resposta reservados para cada análise
+ANALYSIS_OUTPUT_TOKENS = 1000
+
+# Linhas lidas de um CSV (o prompt recebe só o que couber no orçamento de tokens)
+CSV_MAX_ROWS = 5000
+
+XML_TYPES = ["text/xml", "application/xml"]
+IMAGE_TYPES = ["image/jpeg", "image/png", "image/jpg"]
+
+
+# =======================================================
+# 1. LIMITES POR PROVEDOR
+# =======================================================
+
+class ProviderLimiter:
+    """
+    Limita as chamadas a um provedor: no máximo `max_concurrency` ao mesmo
+    tempo e `tokens_per_minute` tokens (estimados) em qualquer janela de 60s.
+    Um 429 pausa todas as chamadas do provedor pelo tempo de espera.
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._window = deque()  # (instante, tokens)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def _reserve_tokens(self, tokens: int):
+        tokens = min(tokens, self.tokens_per_minute)  # Uma chamada maior que o limite não pode esperar para sempre
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    self._window.popleft()
+                used = sum(reserved for _, reserved in self._window)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if used + tokens <= self.tokens_per_minute:
+                        self._window.append((now, tokens))
+                        return
+                    wait = 60 - (now - self._window[0][0])
+            time.sleep(min(max(wait, 0.05), 5.0))
+
+    @contextmanager
+    def acquire(self, tokens: int):
+        with self._semaphore:
+            self._reserve_tokens(tokens)
+            yield
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_provider_limiter(model_type: str) -> ProviderLimiter:
+    """Limitador único por provedor no processo."""
+    with _limiters_lock:
+        if model_type not in _limiters:
+            concurrency, tpm = PROVIDER_LIMITS.get(model_type, (4, 100_000))
+            name = (model_type or '').upper()
+            concurrency = int(os.getenv(f'CONTAI_AI_CONCURRENCY_{name}', concurrency))
+            tpm = int(os.getenv(f'CONTAI_AI_TPM_{name}', tpm))
+            _limiters[model_type] = ProviderLimiter(max(1, concurrency), max(1, tpm))
+        return _limiters[model_type]
+
+
+def call_ai_with_retry(client, model_type: str, system_prompt: str, user_message: str,
+                       output_tokens: int = ANALYSIS_OUTPUT_TOKENS, model: Optional[str] = None,
+                       json_schema: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Chama a IA dentro dos limites do provedor, repetindo erros 429/5xx.
+    `model` escolhe outro modelo do provedor (estágios da cascata) e
+    `json_schema` pede a resposta no modo JSON nativo do provedor.
+
+    Raises:
+        A exceção do provedor quando o erro não é temporário ou as tentativas acabam.
+    """
+    limiter = get_provider_limiter(model_type)
+    tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message) + output_tokens
+
+    for attempt in range(AI_MAX_RETRIES + 1):
+        try:
+            with limiter.acquire(tokens):
+                response, _ = chat_with_ai(client, model_type, system_prompt, user_message, None,
+                                           raise_errors=True, model=model, json_schema=json_schema)
+            return response
+        except Exception as e:
+            if attempt >= AI_MAX_RETRIES or not is_retryable_error(e):
+                raise
+            status = get_error_status(e)
+            delay = get_retry_after(e) or random.uniform(0.5, 1.0) * min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            if status == 429:
+                limiter.pause(delay)
+            print(f"⏳ {model_type}: erro {status}, nova tentativa em {delay:.1f}s ({attempt + 1}/{AI_MAX_RETRIES})")
+            time.sleep(delay)
+
+
+# =======================================================
+# 2. EXTRAÇÃO DE TEXTO E PROMPT DE ANÁLISE
+# =======================================================
+
+# Validade das análises de documentos no cache compartilhado (o arquivo é identificado pelo hash)
+AI_ANALYSIS_CACHE_TTL = 7 * 24 * 3600
+
+
+# Campos esperados por tipo de documento (tabela de destino e descrição de cada campo)
+DOCUMENT_FIELD_MAPPINGS = {
+    'NOTA_FISCAL': """**NOTA FISCAL → accounts_payable (se compra) ou accounts_receivable (se venda)**
+- description: Descrição da NF
+- amount: Valor total
+- due_date: Data de vencimento
+- emission_date: Data de emissão
+- supplier/customer: Fornecedor ou Cliente
+- document_number: Número da NF
+- category: Categoria fiscal""",
+    'EXTRATO_BANCARIO': """**EXTRATO BANCÁRIO → bank_transactions**
+- transaction_date: Data da transação
+- description: Descrição
+- amount: Valor (positivo=entrada, negativo=saída)
+- balance: Saldo
+- category: Categoria da transação""",
+    'GUIA_IMPOSTO': """**GUIA DE IMPOSTO → tax_obligations**
+- obligation_type: Tipo (DAS, DARF, etc)
+- due_date: Vencimento
+- amount: Valor
+- reference_period: Período de referência
+- status: Situação""",
+    'BOLETO': """**BOLETO → accounts_payable**
+- description: Descrição do boleto
+- amount: Valor
+- due_date: Vencimento
+- supplier: Beneficiário
+- barcode: Código de barras
+- document_number: Nosso número""",
+}
+
+
+# Marca onde o conteúdo do documento entra no prompt (substituída depois de medir o restante)
+CONTENT_PLACEHOLDER = "<<CONTEUDO_DO_DOCUMENTO>>"
+
+
+def create_document_analysis_prompt(file_name: str, file_type: str, content_preview: str = "",
+                                    document_type: Optional[str] = None, target_table: Optional[str] = None,
+                                    model_type: Optional[str] = None) -> str:
+    """
+    Cria prompt para o agente de análise de documentos.
+
+    Com document_type (previsto pelo classificador local), o prompt é menor:
+    pula a identificação do tipo e traz só o mapeamento de campos desse tipo.
+    O conteúdo entra reduzido ao orçamento de tokens do provedor (ver token_budget).
+    Instruções, formato e mapeamento vêm antes de PROMPT_CACHE_BREAK (prefixo
+    reaproveitado pelo cache de prompt do provedor em todo o lote); o
+    documento atual vem depois.
+    """
+    specific = document_type in DOCUMENT_FIELD_MAPPINGS
+
+    if specific:
+        documents_section = f"""📋 DOCUMENTO JÁ CLASSIFICADO:
+Tipo: **{document_type}**{f" → tabela `{target_table}`" if target_table else ""}
+Confirme o tipo; se o conteúdo claramente não corresponder, informe o tipo correto e reduza a confiança.
+
+⚙️ PROTOCOLO DE ANÁLISE:
+
+**PASSO 1: EXTRAÇÃO DE DADOS**
+Extraia TODAS as informações relevantes em formato JSON estruturado.
+
+**PASSO 2: VALIDAÇÃO**
+Verifique se todos os campos obrigatórios foram identificados.
+Se algum campo estiver FALTANDO ou INCERTO, marque como "PENDENTE_CONFIRMACAO"."""
+        mapping_section = DOCUMENT_FIELD_MAPPINGS[document_type]
+        type_example = document_type
+        table_example = target_table or "accounts_payable | accounts_receivable | bank_transactions | tax_obligations"
+    else:
+        documents_section = """📋 TIPOS DE DOCUMENTOS QUE VOCÊ PROCESSA:
+1. **Notas Fiscais** (NF-e, NFS-e) - XML ou PDF
+2. **Extratos Bancários** - PDF ou CSV
+3. **Guias de Impostos** (DAS, DARF, GPS, GARE) - PDF
+4. **Boletos Bancários** - PDF
+5. **Recibos e Comprovantes** - PDF, imagem
+
+⚙️ PROTOCOLO DE ANÁLISE:
+
+**PASSO 1: IDENTIFICAÇÃO DO DOCUMENTO**
+Identifique o tipo de documento analisando:
+- Cabeçalhos e títulos
+- Campos obrigatórios
+- Layout e estrutura
+- Palavras-chave específicas
+
+**PASSO 2: EXTRAÇÃO DE DADOS**
+Extraia TODAS as informações relevantes em formato JSON estruturado.
+
+**PASSO 3: VALIDAÇÃO**
+Verifique se todos os campos obrigatórios foram identificados.
+Se algum campo estiver FALTANDO ou INCERTO, marque como "PENDENTE_CONFIRMACAO".
+
+**PASSO 4: MAPEAMENTO PARA BANCO DE DADOS**
+Determine a tabela de destino e os campos correspondentes."""
+        mapping_section = "\n\n".join(DOCUMENT_FIELD_MAPPINGS.values())
+        type_example = "NOTA_FISCAL | EXTRATO_BANCARIO | GUIA_IMPOSTO | BOLETO | RECIBO | OUTRO"
+        table_example = "accounts_payable | accounts_receivable | bank_transactions | tax_obligations"
+    
+    prompt = f"""Você é um AGENTE ESPECIALISTA em CIÊNCIA DE DADOS e ANÁLISE DOCUMENTAL FISCAL/CONTÁBIL.
+
+🎯 SUA MISSÃO:
+Analisar documentos fiscais, contábeis e financeiros e extrair informações estruturadas para cadastro em banco de dados.
+
+{documents_section}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📊 FORMATO DE RESPOSTA ESPERADO:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+Responda APENAS com um JSON no seguinte formato:
+
+{{
+    "tipo_documento": "{type_example}",
+    "confianca": 0.95,
+    "tabela_destino": "{table_example}",
+    "dados_extraidos": {{
+        "campo1": "valor1",
+        "campo2": "valor2",
+        ...
+    }},
+    "campos_pendentes": [
+        {{
+            "campo": "nome_do_campo",
+            "motivo": "Não encontrado no documento",
+            "sugestao": "Valor sugerido (se houver)"
+        }}
+    ],
+    "validacao": {{
+        "completo": true/false,
+        "erros": ["lista de erros se houver"],
+        "avisos": ["lista de avisos se houver"]
+    }},
+    "acao_recomendada": "CADASTRAR_AUTOMATICO | SOLICITAR_CONFIRMACAO | SOLICITAR_APROVACAO"
+}}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🗂️ MAPEAMENTO DE CAMPOS{" DO TIPO" if specific else " POR TIPO"}:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+{mapping_section}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⚠️ REGRAS CRÍTICAS:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+1. SEMPRE responda APENAS com JSON válido (sem explicações adicionais)
+2. Se não tiver CERTEZA (confiança < 70%), marque como PENDENTE_CONFIRMACAO
+3. Datas devem estar no formato YYYY-MM-DD
+4. Valores monetários devem ser números decimais (sem R$, pontos ou vírgulas)
+5. Para campos obrigatórios ausentes, SEMPRE peça confirmação
+6. Se o documento for ilegível ou corrompido, retorne erro claro
+{PROMPT_CACHE_BREAK}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📄 DOCUMENTO ATUAL:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+Nome do Arquivo: {file_name}
+Tipo de Arquivo: {file_type}
+
+{f"Conteúdo do Documento (trechos selecionados):\n{CONTENT_PLACEHOLDER}" if content_preview else ""}
+
+Agora analise o documento e retorne o JSON estruturado.
+"""
+    
+    if content_preview:
+        content = fit_content(prompt.replace(CONTENT_PLACEHOLDER, ""), content_preview, model_type)
+        prompt = prompt.replace(CONTENT_PLACEHOLDER, content)
+    return prompt
+
+
+def is_extraction_error(text: str) -> bool:
+    """Indica se o resultado da extração é uma mensagem de erro (não deve ir para o cache)"""
+    return not text.strip() or text.startswith("[Erro") or text.startswith("[Não foi possível")
+
+
+def is_cacheable_extraction(text: str) -> bool:
+    """Só vai para o cache a extração completa: nem erro, nem página com OCR falho no meio do texto"""
+    return not is_extraction_error(text) and OCR_PAGE_ERROR_MARKER not in text
+
+
+def extract_text_from_pdf(file_bytes) -> str:
+    """Extrai texto de PDF, reaproveitando o cache em disco quando o mesmo arquivo já foi processado"""
+    return get_extraction_cache().get_or_extract(
+        file_bytes, 'pdf', extract_text_from_pdf_uncached,
+        should_store=is_cacheable_extraction,
+        **ocr_settings()
+    )
+
+
+def extract_text_from_pdf_uncached(file_bytes) -> str:
+    """
+    Extrai texto de PDF decidindo página a página: camada de texto (backend mais rápido
+    disponível) onde existe e OCR apenas nas páginas escaneadas, com DPI adaptado ao tamanho da página
+    """
+    try:
+        from pdf_text import extract_pdf_text
+        
+        text = extract_pdf_text(file_bytes)
+        return text if text else "[Não foi possível extrair texto do PDF]"
+    except Exception as e:
+        print(f"⚠️ Erro ao extrair texto do PDF: {str(e)}. Tentando OCR...")
+        return extract_text_from_pdf_with_ocr(file_bytes)
+
+
+def extract_text_from_pdf_with_ocr(file_bytes) -> str:
+    """Extrai texto de PDF usando OCR (para PDFs escaneados)"""
+    try:
+        from ocr import ocr_pdf
+        
+        # Rasteriza e aplica OCR página a página em paralelo (pool de processos)
+        text = ocr_pdf(file_bytes)
+        
+        return text if text.strip() else "[Não foi possível extrair texto do PDF]"
+    except Exception as e:
+        return f"[Erro ao aplicar OCR no PDF: {str(e)}. Instale o Tesseract-OCR em seu sistema]"
+
+
+def extract_text_from_image(file_bytes) -> str:
+    """Extrai texto de imagem, reaproveitando o cache em disco quando o mesmo arquivo já foi processado"""
+    return get_extraction_cache().get_or_extract(
+        file_bytes, 'image', extract_text_from_image_uncached,
+        should_store=is_cacheable_extraction,
+        **ocr_settings()
+    )
+
+
+def extract_text_from_image_uncached(file_bytes) -> str:
+    """Extrai texto de imagem usando OCR (com pré-processamento da imagem)"""
+    try:
+        from ocr import ocr_image
+        
+        # Normaliza a imagem (rotação, escala, inclinação, binarização) e aplica OCR
+        text = ocr_image(file_bytes)
+        
+        return text if text.strip() else "[Não foi possível extrair texto da imagem]"
+    except Exception as e:
+        return f"[Erro ao aplicar OCR na imagem: {str(e)}. Instale o Tesseract-OCR em seu sistema]"
+
+
+def extract_text_from_xml(file_bytes) -> str:
+    """
+    Conteúdo do XML como linhas 'elemento: valor' (sem tags nem namespaces),
+    o documento inteiro; o corte para o prompt é feito pelo orçamento de tokens
+    """
+    try:
+        import xml.etree.ElementTree as ET
+        from io import BytesIO
+        
+        lines = []
+        try:
+            for _, element in ET.iterparse(BytesIO(file_bytes), events=('end',)):
+                value = (element.text or '').strip()
+                if value:
+                    lines.append(f"{element.tag.rsplit('}', 1)[-1]}: {value}")
+                element.clear()
+        except ET.ParseError:
+            # XML inválido ou truncado: remove as tags do que houver
+            xml_text = bytes(file_bytes).decode('utf-8', errors='ignore')
+            lines = [line.strip() for line in re.sub(r'<[^>]*(?:>|$)', '\n', xml_text).splitlines() if line.strip()]
+        return "\n".join(lines)
+    except:
+        return "[Erro ao ler XML]"
+
+
+def extract_text_from_csv(file_bytes) -> str:
+    """Conteúdo do CSV como tabela de texto (extratos longos são resumidos pelo orçamento de tokens)"""
+    try:
+        import pandas as pd
+        from io import BytesIO
+        
+        df = pd.read_csv(BytesIO(file_bytes), nrows=CSV_MAX_ROWS)
+        return df.to_string()
+    except:
+        return "[Erro ao ler CSV]"
+
+
+def extract_document_text(file_type: str, file_bytes: bytes) -> str:
+    """Extrai o texto conforme o tipo do arquivo"""
+    if file_type == "application/pdf":
+        return extract_text_from_pdf(file_bytes)
+    elif file_type in XML_TYPES:
+        return extract_text_from_xml(file_bytes)
+    elif file_type == "text/csv":
+        return extract_text_from_csv(file_bytes)
+    elif file_type in IMAGE_TYPES:
+        return extract_text_from_image(file_bytes)
+    return "[Tipo de arquivo não suportado para extração automática]"
+
+
+def parse_analysis_response(response: str) -> Dict[str, Any]:
+    """Converte a resposta da IA em dicionário, reparando JSON malformado (ver json_repair)"""
+    analysis = loads_tolerant(response)
+    if not isinstance(analysis, dict):
+        raise ValueError("A resposta da IA não é um objeto JSON")
+    return analysis
+
+
+# =======================================================
+# 3. RESPOSTA ESTRUTURADA E CONFERÊNCIA DOS CAMPOS
+# =======================================================
+
+DOCUMENT_TYPES = ['NOTA_FISCAL', 'EXTRATO_BANCARIO', 'GUIA_IMPOSTO', 'BOLETO', 'RECIBO', 'OUTRO']
+DESTINATION_TABLES = ['accounts_payable', 'accounts_receivable', 'bank_transactions', 'tax_obligations']
+RECOMMENDED_ACTIONS = ['CADASTRAR_AUTOMATICO', 'SOLICITAR_CONFIRMACAO', 'SOLICITAR_APROVACAO']
+
+# Campos de dados_extraidos conferidos (e corrigidos localmente quando possível)
+AMOUNT_FIELDS = ('amount', 'balance')
+DATE_FIELDS = ('due_date', 'emission_date', 'transaction_date')
+
+# Novas perguntas à IA, só com os campos que falharam na conferência
+MAX_FIELD_REASKS = 1
+
+# Schema da análise, usado no modo de resposta estruturada de cada provedor
+ANALYSIS_SCHEMA = {
+    'title': 'analise_documento',
+    'description': 'Resultado da análise do documento fiscal/contábil',
+    'type': 'object',
+    'properties': {
+        'tipo_documento': {'type': 'string', 'enum': DOCUMENT_TYPES},
+        'confianca': {'type': 'number', 'minimum': 0, 'maximum': 1},
+        'tabela_destino': {'type': ['string', 'null'], 'enum': DESTINATION_TABLES + [None]},
+        'dados_extraidos': {'type': 'object'},
+        'campos_pendentes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'campo': {'type': 'string'},
+                    'motivo': {'type': 'string'},
+                    'sugestao': {'type': 'string'},
+                },
+                'required': ['campo', 'motivo'],
+            },
+        },
+        'validacao': {
+            'type': 'object',
+            'properties': {
+                'completo': {'type': 'boolean'},
+                'erros': {'type': 'array', 'items': {'type': 'string'}},
+                'avisos': {'type': 'array', 'items': {'type': 'string'}},
+            },
+            'required': ['completo', 'erros', 'avisos'],
+        },
+        'acao_recomendada': {'type': 'string', 'enum': RECOMMENDED_ACTIONS},
+    },
+    'required': ['tipo_documento', 'confianca', 'tabela_destino', 'dados_extraidos',
+                 'campos_pendentes', 'validacao', 'acao_recomendada'],
+}
+
+
+def _is_calendar_date(iso_date: str) -> bool:
+    try:
+        datetime.strptime(iso_date, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+
+def normalize_analysis(analysis: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Corrige localmente o que não precisa da IA (estrutura, valores em formato
+    brasileiro, datas DD/MM/AAAA, confiança em %) e devolve os campos que
+    continuam inválidos: {campo: motivo}. Campos de dados_extraidos usam o
+    caminho 'dados_extraidos.<campo>'.
+    """
+    invalid = {}
+
+    document_type = str(analysis.get('tipo_documento') or '').strip().upper().replace(' ', '_')
+    if document_type in DOCUMENT_TYPES:
+        analysis['tipo_documento'] = document_type
+    else:
+        invalid['tipo_documento'] = f"deve ser um de {', '.join(DOCUMENT_TYPES)}"
+
+    try:
+        confidence = float(str(analysis.get('confianca')).strip().rstrip('%'))
+        analysis['confianca'] = confidence / 100 if 1 < confidence <= 100 else confidence
+        if not 0 <= analysis['confianca'] <= 1:
+            invalid['confianca'] = "deve ser um número entre 0 e 1"
+    except (TypeError, ValueError):
+        invalid['confianca'] = "deve ser um número entre 0 e 1"
+
+    table = analysis.get('tabela_destino')
+    if table not in DESTINATION_TABLES and not (table is None and analysis.get('tipo_documento') == 'OUTRO'):
+        invalid['tabela_destino'] = f"deve ser uma de {', '.join(DESTINATION_TABLES)}"
+
+    if not isinstance(analysis.get('dados_extraidos'), dict):
+        analysis['dados_extraidos'] = {}
+        invalid['dados_extraidos'] = "deve ser um objeto com os campos do documento"
+    data = analysis['dados_extraidos']
+    for field in AMOUNT_FIELDS:
+        if field in data and data[field] not in (None, '') and not isinstance(data[field], (int, float)):
+            amount = to_amount(re.sub(r'[^\d.,\-]', '', str(data[field])))
+            if amount is None:
+                invalid[f'dados_extraidos.{field}'] = "valor monetário deve ser um número decimal"
+            else:
+                data[field] = amount
+    for field in DATE_FIELDS:
+        if field in data and data[field] not in (None, ''):
+            iso_date = to_iso_date(data[field])
+            if iso_date is None or not _is_calendar_date(iso_date):
+                invalid[f'dados_extraidos.{field}'] = "data deve estar no formato AAAA-MM-DD"
+            else:
+                data[field] = iso_date
+
+    if not isinstance(analysis.get('campos_pendentes'), list):
+        analysis['campos_pendentes'] = []
+    analysis['campos_pendentes'] = [
+        pending for pending in analysis['campos_pendentes'] if isinstance(pending, dict) and pending.get('campo')
+    ]
+    validation = analysis.get('validacao') if isinstance(analysis.get('validacao'), dict) else {}
+    analysis['validacao'] = {
+        'completo': bool(validation.get('completo', not analysis['campos_pendentes'])),
+        'erros': list(validation.get('erros') or []),
+        'avisos': list(validation.get('avisos') or []),
+    }
+    if analysis.get('acao_recomendada') not in RECOMMENDED_ACTIONS:
+        analysis['acao_recomendada'] = 'SOLICITAR_CONFIRMACAO'
+    return invalid
+
+
+def create_field_reask_message(analysis: Dict[str, Any], invalid: Dict[str, str]) -> str:
+    """Pedido de correção só dos campos inválidos (o prompt de sistema continua o da análise)"""
+    current = {}
+    for path in invalid:
+        if path.startswith('dados_extraidos.'):
+            field = path.split('.', 1)[1]
+            current.setdefault('dados_extraidos', {})[field] = analysis['dados_extraidos'].get(field)
+        else:
+            current[path] = analysis.get(path)
+    problems = "\n".join(f"- {path}: {reason}" for path, reason in invalid.items())
+    return (
+        "Na sua análise anterior estes campos ficaram inválidos:\n"
+        f"{problems}\n\n"
+        f"Valores enviados:\n{json.dumps(current, ensure_ascii=False, default=str)}\n\n"
+        "Responda APENAS com um JSON contendo somente esses campos corrigidos, na mesma estrutura."
+    )
+
+
+def merge_corrections(analysis: Dict[str, Any], corrections: Dict[str, Any], invalid: Dict[str, str]):
+    """Aplica na análise apenas as correções dos campos que estavam inválidos"""
+    for path in invalid:
+        if path.startswith('dados_extraidos.'):
+            field = path.split('.', 1)[1]
+            value = (corrections.get('dados_extraidos') or {}).get(field, corrections.get(field))
+            if value is not None:
+                analysis['dados_extraidos'][field] = value
+        elif path in corrections:
+            analysis[path] = corrections[path]
+
+
+def analyze_with_model(client, model_type: str, model: Optional[str], system_prompt: str,
+                       user_message: str) -> Dict[str, Any]:
+    """
+    Uma análise completa em um modelo: resposta estruturada, leitura tolerante,
+    correções locais e, para o que continuar inválido, nova pergunta só com
+    esses campos. Campos que nem assim ficarem válidos viram avisos.
+    """
+    response = call_ai_with_retry(client, model_type, system_prompt, user_message,
+                                  model=model, json_schema=ANALYSIS_SCHEMA)
+    analysis = parse_analysis_response(response)
+    invalid = normalize_analysis(analysis)
+
+    for _ in range(MAX_FIELD_REASKS):
+        if not invalid:
+            break
+        try:
+            reask = call_ai_with_retry(client, model_type, system_prompt, create_field_reask_message(analysis, invalid),
+                                       output_tokens=ANALYSIS_OUTPUT_TOKENS // 4, model=model)
+            merge_corrections(analysis, parse_analysis_response(reask), invalid)
+        except Exception as e:
+            print(f"⚠️ Erro ao pedir correção de campos ({', '.join(invalid)}): {e}")
+            break
+        invalid = normalize_analysis(analysis)
+
+    if invalid:
+        analysis['validacao']['avisos'].extend(f"Campo {path} inválido: {reason}" for path, reason in invalid.items())
+        analysis['validacao']['completo'] = False
+        analysis['acao_recomendada'] = 'SOLICITAR_CONFIRMACAO'
+    return analysis
+
+
+# =======================================================
+# 4. ANÁLISE DE UM DOCUMENTO
+# =======================================================
+
+def analyze_document(file_name: str, file_type: str, file_bytes: bytes, client, model_type: str,
+                     company_cnpj: Optional[str] = None, check_similar_documents: bool = True) -> Dict[str, Any]:
+    """
+    Analisa um documento: leitura direta de XML fiscal, regras de boleto/guia,
+    modelo aprendido do fornecedor e, se nada disso reconhecer o arquivo, a IA
+    (com cache compartilhado). O classificador local define a ordem das
+    regras e, na IA, o prompt específico do tipo.
+
+    Antes de tudo o arquivo é procurado no índice de documentos da empresa;
+    toda análise nova é registrada nele e conferida pela chave de negócio.
+    Se o texto (antes da IA) for quase idêntico ao de um documento já
+    enviado, devolve uma análise provisória marcada como duplicata, sem gastar
+    a análise; a imagem quase idêntica (que pode ser só o mesmo layout) apenas
+    acrescenta um aviso. check_similar_documents=False (o usuário confirmou
+    que não é duplicata) desliga essas verificações.
+
+    Returns:
+        Item da fila de aprovação ({'file_name', 'analysis', 'file_bytes', 'processed'});
+        em caso de erro, 'analysis' é None e 'error' traz a mensagem.
+    """
+    def queued(analysis):
+        return {'file_name': file_name, 'analysis': analysis, 'file_bytes': file_bytes, 'processed': False}
+
+    fingerprints = {}
+    terms = []
+    image_match = []
+
+    def indexed(analysis):
+        if terms:
+            analysis = {**analysis, 'termos_documento': terms}  # Exemplo de treino do classificador local
+        # Mesmo documento (chave de acesso, código de barras...) já enviado em outro arquivo
+        analysis = check_duplicate(company_cnpj, content_hash, analysis) or analysis
+        if image_match and not analysis.get('duplicata_de'):
+            analysis = add_similarity_warning(analysis, *image_match[0])
+        record_document(company_cnpj, content_hash, file_name, analysis, fingerprints)
+        return queued(analysis)
+
+    def similar(new_fingerprints):
+        fingerprints.update(new_fingerprints)
+        if not check_similar_documents or not new_fingerprints:
+            return None
+        return check_similar(company_cnpj, content_hash, file_name, new_fingerprints)
+
+    try:
+        # Mesmo arquivo já analisado para a empresa: devolve a análise anterior, sem OCR nem IA
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        previous_analysis = check_duplicate(company_cnpj, content_hash)
+        if previous_analysis is not None:
+            return queued(previous_analysis)
+
+        # NF-e/NFS-e em XML: leitura direta do layout, sem IA
+        if file_type in XML_TYPES:
+            xml_analysis = parse_fiscal_xml(file_bytes, company_cnpj)
+            if xml_analysis is not None:
+                return indexed(xml_analysis)
+
+        # Imagem parecida com a de um documento já enviado (mesmo papel ou só o mesmo layout,
+        # como as contas mensais de um fornecedor): vira aviso, a análise segue normalmente
+        if file_type == "application/pdf" or file_type in IMAGE_TYPES:
+            image_fingerprints = compute_fingerprints(file_type, file_bytes=file_bytes)
+            fingerprints.update(image_fingerprints)
+            if check_similar_documents and image_fingerprints:
+                match = find_similar_document(company_cnpj, content_hash, image_fingerprints)
+                if match:
+                    image_match.append(match)
+
+        content_preview = extract_document_text(file_type, file_bytes)
+        has_text = not is_extraction_error(content_preview)
+
+        # Tipo previsto pelo classificador local (treinado com os documentos aprovados)
+        classification = None
+        if has_text:
+            terms.extend(document_terms(content_preview))
+            classification = classify_document(company_cnpj, content_preview)
+
+        # Boletos e guias DARF/DAS: regras com conferência dos dígitos verificadores, sem IA
+        # (sempre tentadas; o tipo previsto só escolhe a primeira regra)
+        if has_text and (file_type == "application/pdf" or file_type in IMAGE_TYPES):
+            rules_analysis = parse_document_text(
+                content_preview, company_cnpj,
+                preferred_type=classification['tipo_documento'] if classification else None
+            )
+            if rules_analysis is not None:
+                return indexed(rules_analysis)
+
+        # Fornecedor com layout já aprendido: extração local pelo modelo, sem IA
+        if has_text:
+            template_analysis = extract_with_template(company_cnpj, content_preview)
+            if template_analysis is not None:
+                return indexed(template_analysis)
+
+        # Mesmo texto (com ruído de OCR) de um documento já enviado: compara antes de chamar a IA
+        if has_text:
+            similar_analysis = similar(compute_fingerprints(file_type, text=content_preview))
+            if similar_analysis is not None:
+                return queued(similar_analysis)
+
+        # Tipo já conhecido: prompt menor, só com os campos desse tipo
+        analysis_prompt = create_document_analysis_prompt(
+            file_name, file_type, content_preview,
+            document_type=classification['tipo_documento'] if classification else None,
+            target_table=classification['tabela_destino'] if classification else None,
+            model_type=model_type
+        )
+
+        # Análise já feita (em qualquer processo) para o mesmo arquivo, modelo e prompt
+        analysis_cache_key = get_shared_cache().make_key(
+            'document_analysis', 'ai_analysis', None,
+            content_hash,
+            model_type,
+            cascade_stages(model_type),
+            hashlib.sha256(analysis_prompt.encode('utf-8')).hexdigest()
+        )
+        cached_analysis = get_shared_cache().get(analysis_cache_key)
+        if cached_analysis is not None:
+            return indexed(cached_analysis)
+
+        # Modelo rápido primeiro; só resultados duvidosos vão para o modelo forte
+        user_message = f"Analise o documento: {file_name}"
+        analysis_result = run_cascade(
+            model_type,
+            estimate_tokens(analysis_prompt) + estimate_tokens(user_message),
+            lambda model: analyze_with_model(client, model_type, model, analysis_prompt, user_message)
+        )
+        get_shared_cache().set(analysis_cache_key, analysis_result, ttl=AI_ANALYSIS_CACHE_TTL)
+        return indexed(analysis_result)
+
+    except Exception as e:
+        return {'file_name': file_name, 'analysis': None, 'error': str(e), 'processed': False}
+
+
+def learn_document_template(file_name: str, file_type: str, file_bytes, analysis: Dict[str, Any],
+                            company_cnpj: Optional[str] = None) -> bool:
+    """Aprende o modelo do fornecedor com um documento aprovado (o texto vem do cache de extração)."""
+    if file_type in XML_TYPES or file_type == "text/csv":
+        return False
+    try:
+        text = extract_document_text(file_type, file_bytes)
+        if is_extraction_error(text):
+            return False
+        return learn_template(company_cnpj, text, analysis, file_name)
+    except Exception as e:
+        print(f"⚠️ Erro ao aprender modelo do documento: {e}")
+        return False
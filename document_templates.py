@@ -0,0 +1,460 @@
+"""
+Modelos de extração aprendidos por fornecedor (SQLite).
+
+Boa parte dos documentos vem dos mesmos fornecedores, com layout fixo.
+Quando um usuário Senior aprova um documento analisado pela IA, o texto é
+comparado com os dados aprovados e, para cada campo, guarda-se onde o valor
+aparece: o rótulo que o antecede (âncora), se o valor está na mesma linha
+ou na seguinte (região) e a posição entre os valores do mesmo formato.
+
+Documentos seguintes com o CNPJ do fornecedor e layout parecido são
+extraídos localmente por esse modelo; se algum campo não for encontrado ou
+não passar na conferência, o documento segue para a IA. Campos aprovados
+que não aparecem no texto voltam como pendentes para o usuário preencher;
+só campos de classificação (ex.: categoria) são repetidos como aprovados.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from document_parsers import (AMOUNT_PATTERN, CNPJ_PATTERN, DATE_PATTERN, cnpj_is_valid, only_digits,
+                              parse_bank_slip_line, parse_collection_line, to_amount, to_iso_date)
+from fingerprints import hamming_distance, text_simhash
+
+TEMPLATES_DB_PATH = os.getenv('CONTAI_TEMPLATES_PATH') or os.path.join(tempfile.gettempdir(), 'contai_templates.sqlite3')
+
+# Confiança atribuída à extração por modelo (abaixo do cadastro automático: o usuário confere)
+TEMPLATE_CONFIDENCE = 0.9
+
+# Diferença máxima (bits) entre os SimHash do "esqueleto" do layout (texto sem números)
+LAYOUT_MAX_DISTANCE = 12
+
+# Campos que precisam ser localizados no texto para o modelo ser aprendido
+REQUIRED_FIELDS = ('amount',)
+
+# Campos de classificação repetidos como aprovados quando não aparecem no texto. Os demais
+# textos (descrição, período de referência...) mudam a cada documento e ficam pendentes
+CONSTANT_FIELDS = ('category', 'categoria', 'obligation_type')
+
+# Análises que não vêm da IA não precisam de modelo (XML e regras já são determinísticos)
+DETERMINISTIC_ORIGINS = ('parser_', 'regras_')
+
+VALUE_PATTERNS = {
+    'amount': AMOUNT_PATTERN,
+    'date': DATE_PATTERN,
+    'cnpj': CNPJ_PATTERN,
+    'digits': r'(\d[\d.\-/ ]*\d)',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS document_templates (
+    company TEXT NOT NULL,
+    supplier TEXT NOT NULL,
+    tipo_documento TEXT NOT NULL,
+    tabela_destino TEXT,
+    layout TEXT,
+    fields TEXT NOT NULL,
+    constants TEXT NOT NULL,
+    pending TEXT NOT NULL DEFAULT '[]',
+    source_file TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (company, supplier, tipo_documento)
+);
+"""
+
+# Colunas acrescentadas depois da primeira versão da tabela
+MIGRATIONS = {
+    'pending': "ALTER TABLE document_templates ADD COLUMN pending TEXT NOT NULL DEFAULT '[]'",
+}
+
+
+# =======================================================
+# 1. ÂNCORAS E VALORES NO TEXTO
+# =======================================================
+
+def _label(prefix: str) -> str:
+    """Rótulo no fim do trecho (última sequência sem dígitos, começando por letra), normalizado."""
+    match = re.search(r'([^\W\d_][^\d\n]*)$', prefix)
+    label = re.sub(r'\s+', ' ', match.group(1)).strip(' :-=|$\t').casefold() if match else ''
+    return label if sum(char.isalpha() for char in label) >= 3 else ''
+
+
+def _anchor_regex(anchor: str) -> str:
+    return r'\s+'.join(re.escape(word) for word in anchor.split())
+
+
+def layout_skeleton(text: str) -> str:
+    """Texto fixo do layout: sem números, que mudam de um documento para outro."""
+    return re.sub(r'\d+', ' ', text or '')
+
+
+def value_kind(path: str, value: Any) -> Optional[str]:
+    """Formato do valor aprovado: amount, date, cnpj, digits ou text (None se não for localizável)."""
+    if isinstance(value, bool) or value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return 'amount'
+    text = str(value).strip()
+    if re.fullmatch(r'\d{4}-\d{2}-\d{2}', text):
+        return 'date'
+    digits = only_digits(text)
+    if len(digits) == 14 and cnpj_is_valid(digits) and re.fullmatch(r'[\d./\-]+', text):
+        return 'cnpj'
+    if len(digits) >= 4 and re.fullmatch(r'[\d.\-/ ]+', text):
+        return 'digits'
+    return 'text' if len(text) >= 3 else None
+
+
+def _normalize(kind: str, raw: str) -> Any:
+    if kind == 'amount':
+        return to_amount(raw)
+    if kind == 'date':
+        return to_iso_date(raw)
+    if kind in ('cnpj', 'digits'):
+        return only_digits(raw)
+    return re.sub(r'\s+', ' ', raw).strip(' :-\t')
+
+
+def _find_value(text: str, kind: str, value: Any) -> Optional[Tuple[int, int]]:
+    """Posição (início, fim) da primeira ocorrência do valor aprovado no texto."""
+    if kind == 'text':
+        words = str(value).split()
+        match = re.search(r'\s+'.join(re.escape(word) for word in words), text, re.IGNORECASE)
+        return match.span() if match else None
+    expected = _normalize(kind, str(value)) if kind != 'amount' else round(float(value), 2)
+    for match in re.finditer(VALUE_PATTERNS[kind], text):
+        found = _normalize(kind, match.group(1))
+        if found is not None and (found == expected if kind != 'amount' else abs(abs(found) - abs(expected)) < 0.01):
+            return match.span(1)
+    return None
+
+
+def _line_bounds(text: str, position: int) -> Tuple[int, int]:
+    start = text.rfind('\n', 0, position) + 1
+    end = text.find('\n', position)
+    return start, len(text) if end < 0 else end
+
+
+def _occurrence(segment: str, kind: str, offset: int) -> Optional[int]:
+    """Ordem do valor (que começa em `offset`) entre os valores do mesmo formato no trecho."""
+    if kind == 'text':
+        return 0
+    for index, match in enumerate(re.finditer(VALUE_PATTERNS[kind], segment)):
+        if match.start(1) == offset:
+            return index
+    return None
+
+
+def locate_field(text: str, kind: str, value: Any) -> Optional[Dict[str, Any]]:
+    """Âncora e região do valor: rótulo na mesma linha ou linha anterior com o rótulo."""
+    span = _find_value(text, kind, value)
+    if span is None:
+        return None
+    line_start, line_end = _line_bounds(text, span[0])
+
+    anchor = _label(text[line_start:span[0]])
+    if anchor:
+        anchor_match = None
+        for anchor_match in re.finditer(_anchor_regex(anchor), text[line_start:span[0]], re.IGNORECASE):
+            pass
+        segment_start = line_start + anchor_match.end()
+        occurrence = _occurrence(text[segment_start:line_end], kind, span[0] - segment_start)
+        if occurrence is not None:
+            return {'kind': kind, 'anchor': anchor, 'region': 'same_line', 'occurrence': occurrence}
+
+    previous_lines = [line for line in text[:line_start].split('\n') if line.strip()]
+    if previous_lines and not text[line_start:span[0]].strip():
+        anchor = _label(previous_lines[-1])
+        occurrence = _occurrence(text[line_start:line_end], kind, span[0] - line_start)
+        if anchor and anchor == re.sub(r'\s+', ' ', previous_lines[-1]).strip(' :-=|$\t').casefold() \
+                and occurrence is not None:
+            return {'kind': kind, 'anchor': anchor, 'region': 'next_line', 'occurrence': occurrence}
+    return None
+
+
+def extract_field(text: str, field: Dict[str, Any]) -> Any:
+    """Valor do campo segundo a âncora/região do modelo; None se não encontrado ou inválido."""
+    kind = field['kind']
+    for match in re.finditer(_anchor_regex(field['anchor']), text, re.IGNORECASE):
+        line_start, line_end = _line_bounds(text, match.start())
+        if field['region'] == 'same_line':
+            segment = text[match.end():line_end]
+        else:
+            if text[match.end():line_end].strip(' :-=|$\t'):
+                continue  # O rótulo do modelo ocupa a linha inteira
+            following = [line for line in text[line_end + 1:line_end + 1000].split('\n') if line.strip()]
+            if not following:
+                continue
+            segment = following[0]
+
+        if kind == 'text':
+            value = _normalize(kind, segment)
+        else:
+            values = [match.group(1) for match in re.finditer(VALUE_PATTERNS[kind], segment)]
+            value = _normalize(kind, values[field['occurrence']]) if field['occurrence'] < len(values) else None
+        if _value_is_valid(kind, value):
+            return value
+    return None
+
+
+def _value_is_valid(kind: str, value: Any) -> bool:
+    if value is None or value == '':
+        return False
+    if kind == 'amount':
+        return value > 0
+    if kind == 'text':
+        return sum(char.isalpha() for char in value) >= 3
+    if kind == 'cnpj':
+        return cnpj_is_valid(value)
+    if kind == 'digits' and len(value) in (47, 48):
+        # Linha digitável: os dígitos verificadores precisam conferir
+        return (parse_bank_slip_line(value) if len(value) == 47 else parse_collection_line(value)) is not None
+    return True
+
+
+def _same_value(kind: str, found: Any, approved: Any) -> bool:
+    if found is None:
+        return False
+    if kind == 'amount':
+        return abs(found - abs(float(approved))) < 0.01
+    return found == _normalize(kind, str(approved))
+
+
+def flatten(data: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """Campos do dados_extraidos como caminho -> valor (um nível de dicionários; listas ignoradas)."""
+    flat = {}
+    for key, value in (data or {}).items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and not prefix:
+            flat.update(flatten(value, f"{path}."))
+        elif not isinstance(value, (dict, list)):
+            flat[path] = value
+    return flat
+
+
+def unflatten(flat: Dict[str, Any]) -> Dict[str, Any]:
+    data: Dict[str, Any] = {}
+    for path, value in flat.items():
+        if '.' in path:
+            parent, child = path.split('.', 1)
+            data.setdefault(parent, {})[child] = value
+        else:
+            data[path] = value
+    return data
+
+
+def text_suppliers(text: str, company_cnpj: Optional[str] = None) -> List[str]:
+    """CNPJs válidos no texto, na ordem em que aparecem, sem o da própria empresa."""
+    own = only_digits(company_cnpj)
+    suppliers = []
+    for match in re.finditer(CNPJ_PATTERN, text or ''):
+        digits = only_digits(match.group(1))
+        if digits != own and digits not in suppliers and cnpj_is_valid(digits):
+            suppliers.append(digits)
+    return suppliers
+
+
+# =======================================================
+# 2. ARMAZENAMENTO DOS MODELOS
+# =======================================================
+
+class TemplateStore:
+    """Modelos por empresa, fornecedor (CNPJ) e tipo de documento."""
+
+    def __init__(self, path: str = TEMPLATES_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(document_templates)")}
+        for column, statement in MIGRATIONS.items():
+            if columns and column not in columns:
+                conn.execute(statement)
+        conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def save(self, company: str, template: Dict[str, Any]):
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO document_templates (company, supplier, tipo_documento, tabela_destino, layout, fields, constants, "
+            "pending, source_file, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (company, supplier, tipo_documento) DO UPDATE SET tabela_destino = excluded.tabela_destino, "
+            "layout = excluded.layout, fields = excluded.fields, constants = excluded.constants, "
+            "pending = excluded.pending, source_file = excluded.source_file, misses = 0, updated_at = excluded.updated_at",
+            (company, template['supplier'], template['tipo_documento'], template.get('tabela_destino'),
+             template.get('layout'), json.dumps(template['fields'], ensure_ascii=False),
+             json.dumps(template['constants'], ensure_ascii=False, default=str),
+             json.dumps(template.get('pending', []), ensure_ascii=False), template.get('source_file'), now, now)
+        )
+
+    def find(self, company: str, suppliers: List[str]) -> List[Dict[str, Any]]:
+        """Modelos dos fornecedores informados, os mais usados primeiro."""
+        if not suppliers:
+            return []
+        rows = self._connect().execute(
+            f"SELECT * FROM document_templates WHERE company = ? AND supplier IN ({','.join('?' * len(suppliers))}) "
+            "ORDER BY hits DESC, updated_at DESC",
+            [company] + list(suppliers)
+        ).fetchall()
+        templates = []
+        for row in rows:
+            template = dict(row)
+            template['fields'] = json.loads(template['fields'])
+            template['constants'] = json.loads(template['constants'])
+            template['pending'] = json.loads(template.get('pending') or '[]')
+            templates.append(template)
+        return templates
+
+    def count_use(self, company: str, template: Dict[str, Any], success: bool):
+        column = 'hits' if success else 'misses'
+        self._connect().execute(
+            f"UPDATE document_templates SET {column} = {column} + 1 WHERE company = ? AND supplier = ? AND tipo_documento = ?",
+            (company, template['supplier'], template['tipo_documento'])
+        )
+
+
+_template_store: Optional[TemplateStore] = None
+_template_store_lock = threading.Lock()
+
+
+def get_template_store() -> TemplateStore:
+    global _template_store
+    with _template_store_lock:
+        if _template_store is None:
+            _template_store = TemplateStore()
+        return _template_store
+
+
+# =======================================================
+# 3. APRENDIZADO E EXTRAÇÃO
+# =======================================================
+
+def build_template(text: str, analysis: Dict[str, Any], company_cnpj: Optional[str] = None,
+                   file_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Modelo a partir do texto e da análise aprovada. None se não houver CNPJ de
+    fornecedor no texto ou se os campos obrigatórios não forem localizados.
+    Campos aprovados não localizados (exceto os de CONSTANT_FIELDS) ficam em
+    'pending' e voltam como campos pendentes a cada extração.
+    """
+    suppliers = text_suppliers(text, company_cnpj)
+    if not suppliers or not analysis.get('tipo_documento'):
+        return None
+
+    fields, constants, pending = {}, {}, []
+    for path, value in flatten(analysis.get('dados_extraidos') or {}).items():
+        kind = value_kind(path, value)
+        if kind is None:
+            continue
+        field = locate_field(text, kind, value)
+        if field is not None and _same_value(kind, extract_field(text, field), value):
+            fields[path] = field  # Só fica a âncora que, aplicada ao próprio documento, devolve o valor aprovado
+        elif kind == 'text' and _is_constant_field(path):
+            constants[path] = value  # Classificação que não aparece no texto: repetida como aprovada
+        else:
+            pending.append(path)  # Muda a cada documento e não foi localizado: o usuário preenche
+
+    if any(required not in fields for required in REQUIRED_FIELDS):
+        return None
+    layout = text_simhash(layout_skeleton(text))
+    return {
+        'supplier': suppliers[0],
+        'tipo_documento': analysis['tipo_documento'],
+        'tabela_destino': analysis.get('tabela_destino'),
+        'layout': format(layout, '016x') if layout is not None else None,
+        'fields': fields,
+        'constants': constants,
+        'pending': pending,
+        'source_file': file_name,
+    }
+
+
+def _is_constant_field(path: str) -> bool:
+    return path.rsplit('.', 1)[-1] in CONSTANT_FIELDS
+
+
+def apply_template(text: str, template: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Análise extraída pelo modelo, ou None se o layout não bater ou algum campo falhar."""
+    if template.get('layout'):
+        layout = text_simhash(layout_skeleton(text))
+        if layout is not None and hamming_distance(layout, int(template['layout'], 16)) > LAYOUT_MAX_DISTANCE:
+            return None
+
+    extracted = {}
+    for path, field in template['fields'].items():
+        value = extract_field(text, field)
+        if value is None:
+            return None
+        extracted[path] = value
+
+    # Modelos antigos guardavam qualquer texto como constante: só a classificação é repetida
+    constants = {path: value for path, value in template['constants'].items() if _is_constant_field(path)}
+    pending_paths = list(template.get('pending') or [])
+    pending_paths += [path for path in template['constants'] if path not in constants and path not in pending_paths]
+    pending = [
+        {'campo': path, 'motivo': 'Não localizado pelo modelo do fornecedor', 'sugestao': ''}
+        for path in pending_paths if path not in extracted
+    ]
+
+    data = unflatten({**constants, **extracted})
+    return {
+        'tipo_documento': template['tipo_documento'],
+        'confianca': TEMPLATE_CONFIDENCE,
+        'tabela_destino': template.get('tabela_destino'),
+        'dados_extraidos': data,
+        'campos_pendentes': pending,
+        'validacao': {
+            'completo': not pending,
+            'erros': [],
+            'avisos': [f"Extraído pelo modelo do fornecedor aprendido com '{template.get('source_file')}'"],
+        },
+        'acao_recomendada': 'SOLICITAR_CONFIRMACAO',
+        'origem': 'modelo_fornecedor',
+    }
+
+
+def learn_template(company_cnpj: Optional[str], text: str, analysis: Dict[str, Any],
+                   file_name: Optional[str] = None) -> bool:
+    """Aprende (ou atualiza) o modelo do fornecedor a partir de um documento aprovado."""
+    if not analysis or str(analysis.get('origem', '')).startswith(DETERMINISTIC_ORIGINS):
+        return False
+    try:
+        template = build_template(text, analysis, company_cnpj, file_name)
+        if template is None:
+            return False
+        get_template_store().save(only_digits(company_cnpj) or 'sem_cnpj', template)
+        return True
+    except Exception as e:
+        print(f"⚠️ Erro ao aprender modelo do fornecedor: {e}")
+        return False
+
+
+def extract_with_template(company_cnpj: Optional[str], text: str) -> Optional[Dict[str, Any]]:
+    """Extrai o documento pelo modelo do fornecedor; None se não houver modelo ou a validação falhar."""
+    try:
+        company = only_digits(company_cnpj) or 'sem_cnpj'
+        store = get_template_store()
+        for template in store.find(company, text_suppliers(text, company_cnpj)):
+            analysis = apply_template(text, template)
+            store.count_use(company, template, analysis is not None)
+            if analysis is not None:
+                return analysis
+    except Exception as e:
+        print(f"⚠️ Erro ao aplicar modelo do fornecedor: {e}")
+    return None
@@ -0,0 +1,87 @@
+"""
+Barramento de eventos de escrita do CONT-AI (dentro do processo).
+
+Toda escrita no banco publica o que mudou — empresa, entidade e, quando
+conhecido, o período afetado — e as camadas de cache se inscrevem para
+invalidar apenas o que ficou desatualizado.
+
+Entidades usadas: 'dre', 'bank', 'bank_transactions', 'payables',
+'receivables', 'obligations', 'invoices', 'employees', 'payroll',
+'third_parties', 'categories', 'companies', 'users', 'approvals',
+'file_uploads'.
+"""
+
+import threading
+import weakref
+from datetime import date, datetime
+from typing import Any, Callable, Optional
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def _to_date(value: Any) -> Optional[date]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def subscribe(callback: Callable[..., None]):
+    """
+    Inscreve um callback(company_id, entity, start, end, scope) nos eventos de escrita.
+
+    Métodos de objetos são guardados por referência fraca: quando o objeto
+    (ex.: o cache de uma sessão encerrada) é coletado, a inscrição some.
+    Funções comuns são guardadas normalmente.
+    """
+    if hasattr(callback, '__self__') and hasattr(callback, '__func__'):
+        ref = weakref.WeakMethod(callback)
+    else:
+        ref = lambda: callback
+    with _lock:
+        _subscribers.append(ref)
+
+
+def unsubscribe(callback: Callable[..., None]):
+    with _lock:
+        _subscribers[:] = [ref for ref in _subscribers if ref() not in (None, callback)]
+
+
+def publish(company_id: Optional[str], entity: str, start: Any = None, end: Any = None, scope: Any = None):
+    """
+    Anuncia uma escrita.
+
+    Args:
+        company_id: Empresa afetada (None = desconhecida, invalida a entidade de todas as empresas)
+        entity: Entidade alterada (ex.: 'payables')
+        start: Início do período afetado (None = período desconhecido/todos)
+        end: Fim do período afetado (padrão: igual a start)
+        scope: Chave de escopo quando não é a empresa (ex.: conta bancária em 'bank_transactions')
+    """
+    start_date = _to_date(start)
+    end_date = _to_date(end) or start_date
+    if scope is None:
+        scope = company_id
+
+    with _lock:
+        callbacks = []
+        alive = []
+        for ref in _subscribers:
+            callback = ref()
+            if callback is not None:
+                callbacks.append(callback)
+                alive.append(ref)
+        _subscribers[:] = alive
+
+    for callback in callbacks:
+        try:
+            callback(company_id, entity, start_date, end_date, scope)
+        except Exception as e:
+            print(f"⚠️ Erro ao propagar escrita ({entity}): {e}")
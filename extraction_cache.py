@@ -0,0 +1,140 @@
+"""
+Cache em disco do texto extraído de documentos (PDF/imagem/OCR).
+
+A chave é o SHA-256 do arquivo mais o nome/versão do extrator e as
+configurações usadas (ocr.ocr_settings: DPI, idioma, pré-processamento,
+recorte automático e motor de OCR): o mesmo arquivo enviado de novo
+(nova tentativa, outro usuário, outro processo) devolve o texto na hora.
+Ao mudar o extrator, incremente EXTRACTOR_VERSION para descartar o cache.
+
+O tamanho total é limitado (CONTAI_EXTRACTION_CACHE_MB); as entradas
+lidas há mais tempo são removidas primeiro (LRU pela data de modificação,
+atualizada a cada leitura).
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+# Incrementar sempre que a lógica de extração mudar
+EXTRACTOR_VERSION = 4
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'contai_extraction_cache')
+DEFAULT_MAX_BYTES = int(os.getenv('CONTAI_EXTRACTION_CACHE_MB', '256')) * 1024 * 1024
+
+
+def extraction_key(file_bytes: bytes, extractor: str, **settings) -> str:
+    """Chave do cache: hash do conteúdo + extrator + versão + configurações."""
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+    settings_repr = ",".join(f"{name}={settings[name]}" for name in sorted(settings))
+    return hashlib.sha256(f"{content_hash}|{extractor}|v{EXTRACTOR_VERSION}|{settings_repr}".encode('utf-8')).hexdigest()
+
+
+class ExtractionCache:
+    """Armazena textos extraídos em arquivos, com limite de tamanho e despejo LRU."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # Calculado na primeira gravação
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path, None)  # Marca como usado recentemente
+            return text
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ Erro ao ler cache de extração: {e}")
+            return None
+
+    def set(self, key: str, text: str):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)  # Gravação atômica (outros processos nunca leem arquivo pela metade)
+
+            with self._lock:
+                if self._total_bytes is None:
+                    self._total_bytes = self._scan_total()
+                else:
+                    self._total_bytes += os.path.getsize(path)
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar cache de extração: {e}")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def _scan_total(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _evict(self):
+        """Remove as entradas usadas há mais tempo até ficar em 90% do limite."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def get_or_extract(self, file_bytes: bytes, extractor: str, extract: Callable[[bytes], str],
+                       should_store: Callable[[str], bool] = bool, **settings) -> str:
+        """
+        Retorna o texto do cache ou executa a extração e guarda o resultado.
+
+        Args:
+            file_bytes: Conteúdo do arquivo
+            extractor: Nome do extrator (ex.: 'pdf', 'image')
+            extract: Função de extração (bytes -> texto)
+            should_store: Decide se o texto deve ser guardado (ex.: não guardar mensagens de erro)
+            **settings: Configurações que alteram o resultado (DPI, idioma...)
+        """
+        key = extraction_key(file_bytes, extractor, **settings)
+        text = self.get(key)
+        if text is not None:
+            return text
+
+        text = extract(file_bytes)
+        if should_store(text):
+            self.set(key, text)
+        return text
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Instância única do cache de extração no processo (diretório em CONTAI_EXTRACTION_CACHE_DIR)."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache(os.getenv('CONTAI_EXTRACTION_CACHE_DIR') or DEFAULT_CACHE_DIR)
+    return _extraction_cache
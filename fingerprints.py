@@ -0,0 +1,158 @@
+"""
+Impressões digitais aproximadas de documentos, para achar quase-duplicatas.
+
+- Hash perceptual (pHash, 64 bits) da imagem ou da primeira página do PDF:
+  reescaneamentos e novas fotos do mesmo papel ficam a poucos bits de
+  distância. Em documentos de texto ele capta sobretudo o layout (contas
+  mensais do mesmo fornecedor também ficam próximas), por isso só gera aviso.
+- SimHash (64 bits) das trigramas de palavras do texto extraído: o mesmo
+  conteúdo com ruído de OCR também fica a poucos bits.
+
+A busca usa LSH por faixas: o hash é dividido em faixas e, se a distância
+de Hamming for no máximo (faixas - 1), ao menos uma faixa é idêntica
+(princípio da casa dos pombos). Assim só os documentos com alguma faixa
+igual são comparados.
+
+Somente Pillow (já usado no OCR); sem numpy.
+"""
+
+import hashlib
+import math
+import re
+from io import BytesIO
+from typing import Dict, List, Optional
+
+HASH_BITS = 64
+
+# Distância máxima para considerar duplicata e número de faixas do índice (faixas = distância + 1)
+PHASH_MAX_DISTANCE = 6
+SIMHASH_MAX_DISTANCE = 3
+BANDS = {'phash': PHASH_MAX_DISTANCE + 1, 'simhash': SIMHASH_MAX_DISTANCE + 1}
+MAX_DISTANCE = {'phash': PHASH_MAX_DISTANCE, 'simhash': SIMHASH_MAX_DISTANCE}
+
+# Resolução da primeira página do PDF para o hash perceptual (só a forma geral importa)
+FINGERPRINT_DPI = 40
+
+# SimHash: texto mínimo para ter significado e trecho máximo usado (o início do documento basta)
+MIN_SIMHASH_TOKENS = 30
+MAX_SIMHASH_CHARS = 20000
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+_COSINES = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _PHASH_SIZE)) for x in range(_PHASH_SIZE)]
+    for u in range(_PHASH_LOW)
+]
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return bin(first ^ second).count('1')
+
+
+def band_values(fingerprint: int, bands: int) -> List[int]:
+    """Divide o hash de 64 bits em `bands` faixas contíguas (as últimas podem ter um bit a mais)."""
+    values, start = [], 0
+    for band in range(bands):
+        width = HASH_BITS // bands + (1 if band >= bands - HASH_BITS % bands else 0)
+        values.append((fingerprint >> start) & ((1 << width) - 1))
+        start += width
+    return values
+
+
+# =======================================================
+# 1. HASH PERCEPTUAL (IMAGENS E PDF)
+# =======================================================
+
+def perceptual_hash(image) -> int:
+    """pHash: DCT da imagem 32x32 em tons de cinza; bit = coeficiente 8x8 acima da mediana."""
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image).convert('L').resize((_PHASH_SIZE, _PHASH_SIZE), Image.LANCZOS)
+    pixels = list(image.getdata())
+    rows = [pixels[y * _PHASH_SIZE:(y + 1) * _PHASH_SIZE] for y in range(_PHASH_SIZE)]
+
+    # DCT separável: primeiro nas linhas, depois nas colunas (apenas as 8 frequências mais baixas)
+    row_dct = [[sum(c * p for c, p in zip(_COSINES[u], row)) for u in range(_PHASH_LOW)] for row in rows]
+    coefficients = [
+        sum(_COSINES[v][y] * row_dct[y][u] for y in range(_PHASH_SIZE))
+        for v in range(_PHASH_LOW) for u in range(_PHASH_LOW)
+    ]
+
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]  # Sem o componente contínuo
+    fingerprint = 0
+    for bit, value in enumerate(coefficients):
+        if value > median:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def render_first_page(file_bytes, dpi: int = FINGERPRINT_DPI):
+    """Primeira página do PDF como imagem em baixa resolução (pypdfium2 ou pdf2image)."""
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        from pdf2image import convert_from_bytes
+        return convert_from_bytes(bytes(file_bytes), dpi=dpi, first_page=1, last_page=1)[0]
+
+    pdf = pdfium.PdfDocument(file_bytes if isinstance(file_bytes, bytes) else BytesIO(file_bytes))
+    try:
+        page = pdf[0]
+        try:
+            return page.render(scale=dpi / 72).to_pil()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+
+
+def file_perceptual_hash(file_type: str, file_bytes) -> Optional[int]:
+    """pHash de uma imagem ou da primeira página de um PDF; None para outros tipos ou em caso de erro."""
+    try:
+        from PIL import Image
+
+        if file_type == "application/pdf":
+            return perceptual_hash(render_first_page(file_bytes))
+        if file_type.startswith("image/"):
+            with Image.open(BytesIO(file_bytes)) as image:
+                return perceptual_hash(image)
+    except Exception as e:
+        print(f"⚠️ Não foi possível calcular o hash perceptual: {e}")
+    return None
+
+
+# =======================================================
+# 2. SIMHASH DO TEXTO
+# =======================================================
+
+def text_simhash(text: str) -> Optional[int]:
+    """SimHash das trigramas de palavras (texto normalizado); None se o texto for curto demais."""
+    tokens = re.findall(r'\w+', (text or '')[:MAX_SIMHASH_CHARS].lower())
+    if len(tokens) < MIN_SIMHASH_TOKENS:
+        return None
+
+    weights = [0] * HASH_BITS
+    for index in range(len(tokens) - 2):
+        shingle = " ".join(tokens[index:index + 3]).encode('utf-8')
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+        for bit in range(HASH_BITS):
+            weights[bit] += 1 if (value >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def compute_fingerprints(file_type: str, file_bytes=None, text: Optional[str] = None) -> Dict[str, int]:
+    """Impressões disponíveis para o arquivo e/ou texto: {'phash': ..., 'simhash': ...}"""
+    fingerprints = {}
+    if file_bytes is not None:
+        phash = file_perceptual_hash(file_type, file_bytes)
+        if phash is not None:
+            fingerprints['phash'] = phash
+    if text is not None:
+        simhash = text_simhash(text)
+        if simhash is not None:
+            fingerprints['simhash'] = simhash
+    return fingerprints
@@ -0,0 +1,442 @@
+"""
+Fila persistente de processamento de documentos (SQLite).
+
+Cada arquivo enviado vira um job gravado em SQLite. Processos de trabalho,
+iniciados pelo servidor do Streamlit, fazem a extração e a análise fora da
+thread da interface; a interface apenas consulta o estado dos jobs. As
+análises concluídas ficam no banco até o documento ser aprovado ou
+rejeitado, então fechar a aba ou reconectar não perde o trabalho.
+
+O conteúdo dos arquivos fica no armazenamento de uploads (upload_store);
+o job guarda apenas o identificador.
+
+A chave da API nunca é gravada: ela segue com o job pela fila em memória
+dos processos. Jobs que ficaram na fila sem chave (ex.: servidor
+reiniciado) são reenviados quando o usuário volta com a IA configurada.
+
+Os processos de trabalho importam este módulo (spawn), não o app.py.
+"""
+
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from upload_store import get_upload_store
+
+JOBS_DB_PATH = os.getenv('CONTAI_JOBS_PATH') or os.path.join(tempfile.gettempdir(), 'contai_jobs.sqlite3')
+
+# Processos de trabalho; cada um analisa até CONTAI_DOCUMENT_WORKERS arquivos ao mesmo tempo
+# (os limites por provedor de IA valem por processo)
+JOB_WORKERS = int(os.getenv('CONTAI_JOB_WORKERS', '1'))
+
+# Os processos de trabalho renovam o sinal de vida dos seus jobs a cada JOB_HEARTBEAT_SECONDS;
+# job em execução sem sinal há mais que JOB_STALE_SECONDS (processo travado ou perdido) volta para a fila
+JOB_HEARTBEAT_SECONDS = 15
+JOB_STALE_SECONDS = 120
+
+# Jobs finalizados são apagados depois deste prazo
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS document_jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    company_cnpj TEXT,
+    file_name TEXT NOT NULL,
+    file_type TEXT,
+    upload_id TEXT,
+    force_analysis INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    worker_pid INTEGER,
+    heartbeat_at REAL,
+    result TEXT,
+    error TEXT,
+    consumed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_document_jobs_owner ON document_jobs (owner, consumed);
+CREATE INDEX IF NOT EXISTS idx_document_jobs_status ON document_jobs (status);
+"""
+
+# Colunas acrescentadas depois da primeira versão da tabela
+MIGRATIONS = {
+    'upload_id': "ALTER TABLE document_jobs ADD COLUMN upload_id TEXT",
+    'force_analysis': "ALTER TABLE document_jobs ADD COLUMN force_analysis INTEGER NOT NULL DEFAULT 0",
+    'worker_pid': "ALTER TABLE document_jobs ADD COLUMN worker_pid INTEGER",
+    'heartbeat_at': "ALTER TABLE document_jobs ADD COLUMN heartbeat_at REAL",
+}
+
+# Colunas devolvidas nas listagens (sem o conteúdo do arquivo)
+JOB_COLUMNS = "id, owner, file_name, file_type, upload_id, status, result, error, consumed, created_at, started_at, finished_at"
+
+
+# =======================================================
+# 1. ARMAZENAMENTO DOS JOBS
+# =======================================================
+
+class JobStore:
+    """Tabela de jobs em SQLite (WAL), com uma conexão por thread."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(document_jobs)")}
+        for column, statement in MIGRATIONS.items():
+            if columns and column not in columns:
+                conn.execute(statement)
+        conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        if job.get('result'):
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def create(self, owner: str, company_cnpj: Optional[str], file_name: str, file_type: str, upload_id: str,
+               force_analysis: bool = False) -> str:
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO document_jobs (id, owner, company_cnpj, file_name, file_type, upload_id, force_analysis, status, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, owner, company_cnpj, file_name, file_type, upload_id, int(force_analysis), STATUS_QUEUED, time.time())
+        )
+        return job_id
+
+    def claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Passa o job da fila para execução; None se outro processo já o pegou."""
+        conn = self._connect()
+        now = time.time()
+        cursor = conn.execute(
+            "UPDATE document_jobs SET status = ?, started_at = ?, heartbeat_at = ?, worker_pid = ? "
+            "WHERE id = ? AND status = ?",
+            (STATUS_RUNNING, now, now, os.getpid(), job_id, STATUS_QUEUED)
+        )
+        if cursor.rowcount != 1:
+            return None
+        row = conn.execute(
+            "SELECT id, company_cnpj, file_name, file_type, upload_id, force_analysis FROM document_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    # finish/fail só valem para quem ainda executa o job: se ele voltou para a fila (requeue_stale)
+    # e outro processo o pegou, o resultado atrasado deste processo é descartado
+
+    def finish(self, job_id: str, analysis: Dict[str, Any]) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE document_jobs SET status = ?, result = ?, error = NULL, finished_at = ? "
+            "WHERE id = ? AND status = ? AND worker_pid = ?",
+            (STATUS_DONE, json.dumps(analysis, ensure_ascii=False, default=str), time.time(),
+             job_id, STATUS_RUNNING, os.getpid())
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, error: str) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE document_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ? AND worker_pid = ?",
+            (STATUS_ERROR, error, time.time(), job_id, STATUS_RUNNING, os.getpid())
+        )
+        return cursor.rowcount == 1
+
+    def list_jobs(self, owner: str, include_consumed: bool = False) -> List[Dict[str, Any]]:
+        """Jobs do dono (usuário + empresa) em ordem de envio."""
+        query = f"SELECT {JOB_COLUMNS} FROM document_jobs WHERE owner = ?"
+        if not include_consumed:
+            query += " AND consumed = 0"
+        rows = self._connect().execute(query + " ORDER BY created_at", (owner,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def mark_consumed(self, job_id: str):
+        """Documento aprovado/rejeitado: o arquivo não é mais necessário (se nenhum outro job pendente usar)."""
+        conn = self._connect()
+        conn.execute("UPDATE document_jobs SET consumed = 1 WHERE id = ?", (job_id,))
+        row = conn.execute("SELECT upload_id FROM document_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and row['upload_id'] and row['upload_id'] not in self.pending_upload_ids():
+            get_upload_store().delete(row['upload_id'])
+
+    def pending_upload_ids(self) -> Set[str]:
+        """Uploads ainda usados por jobs não consumidos."""
+        rows = self._connect().execute(
+            "SELECT DISTINCT upload_id FROM document_jobs WHERE consumed = 0 AND upload_id IS NOT NULL"
+        ).fetchall()
+        return {row['upload_id'] for row in rows}
+
+    def heartbeat(self, worker_pid: int):
+        """Sinal de vida dos jobs em execução no processo."""
+        self._connect().execute(
+            "UPDATE document_jobs SET heartbeat_at = ? WHERE worker_pid = ? AND status = ?",
+            (time.time(), worker_pid, STATUS_RUNNING)
+        )
+
+    def fail_worker_jobs(self, worker_pid: int, error: str) -> int:
+        """Jobs em execução de um processo de trabalho que morreu viram erro."""
+        cursor = self._connect().execute(
+            "UPDATE document_jobs SET status = ?, error = ?, finished_at = ? WHERE worker_pid = ? AND status = ?",
+            (STATUS_ERROR, error, time.time(), worker_pid, STATUS_RUNNING)
+        )
+        return cursor.rowcount
+
+    def requeue_stale(self) -> List[str]:
+        """Jobs em execução sem sinal de vida recente voltam para a fila; devolve os ids."""
+        conn = self._connect()
+        limit = time.time() - JOB_STALE_SECONDS
+        condition = "status = ? AND COALESCE(heartbeat_at, started_at) < ?"
+        rows = conn.execute(f"SELECT id FROM document_jobs WHERE {condition}", (STATUS_RUNNING, limit)).fetchall()
+        requeued = []
+        for row in rows:
+            cursor = conn.execute(
+                f"UPDATE document_jobs SET status = ?, started_at = NULL, heartbeat_at = NULL, worker_pid = NULL "
+                f"WHERE id = ? AND {condition}",
+                (STATUS_QUEUED, row['id'], STATUS_RUNNING, limit)
+            )
+            if cursor.rowcount == 1:
+                requeued.append(row['id'])
+        return requeued
+
+    def purge_old(self) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM document_jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (STATUS_DONE, STATUS_ERROR, time.time() - JOB_RETENTION_SECONDS)
+        )
+        return cursor.rowcount
+
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+        return _store
+
+
+# =======================================================
+# 2. PROCESSOS DE TRABALHO
+# =======================================================
+
+def _run_job(store: JobStore, job_id: str, model_type: str, api_key: str,
+             clients: Dict[Tuple[str, str], Any], clients_lock: threading.Lock):
+    from ai_providers import create_ai_client
+    from document_pipeline import analyze_document
+
+    job = store.claim(job_id)
+    if job is None:
+        return
+    try:
+        client_key = (model_type, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+        with clients_lock:
+            if client_key not in clients:
+                clients[client_key] = create_ai_client(model_type, api_key)
+            client = clients[client_key]
+
+        # Análise forçada: o usuário confirmou que o documento semelhante não é duplicata
+        check_similar = not job.get('force_analysis')
+        # Arquivo lido por mmap só durante a análise
+        with get_upload_store().open(job['upload_id']) as file_bytes:
+            result = analyze_document(job['file_name'], job['file_type'], file_bytes, client, model_type,
+                                      job['company_cnpj'], check_similar_documents=check_similar)
+        if result.get('analysis') is not None:
+            store.finish(job_id, result['analysis'])
+        else:
+            store.fail(job_id, result.get('error') or 'Erro desconhecido')
+    except Exception as e:
+        store.fail(job_id, str(e))
+
+
+def _worker_main(tasks, db_path: str):
+    """Laço do processo de trabalho: recebe (job_id, provedor, chave) pela fila em memória."""
+    from document_pipeline import DOCUMENT_WORKERS
+
+    store = JobStore(db_path)
+    clients: Dict[Tuple[str, str], Any] = {}  # Clientes de IA reaproveitados entre jobs
+    clients_lock = threading.Lock()
+
+    def send_heartbeats():
+        pid = os.getpid()
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                store.heartbeat(pid)
+            except Exception as e:
+                print(f"⚠️ Erro ao registrar sinal de vida dos jobs: {e}")
+
+    threading.Thread(target=send_heartbeats, name='contai-job-heartbeat', daemon=True).start()
+    with ThreadPoolExecutor(max_workers=max(1, DOCUMENT_WORKERS), thread_name_prefix='contai-job') as pool:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            pool.submit(_run_job, store, *task, clients, clients_lock)
+
+
+class JobWorkerPool:
+    """Processos de trabalho do servidor; recriados se algum morrer."""
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self._context = multiprocessing.get_context('spawn')
+        self._tasks = self._context.Queue()
+        self._processes: List[multiprocessing.Process] = []
+        self._dispatched = set()  # Jobs já enviados aos processos nesta execução do servidor
+        self._lock = threading.Lock()
+
+    def _prune_dead(self):
+        """Remove os processos que morreram; os jobs que eles executavam viram erro."""
+        alive = []
+        for process in self._processes:
+            if process.is_alive():
+                alive.append(process)
+                continue
+            failed = get_job_store().fail_worker_jobs(
+                process.pid,
+                f"Processamento interrompido: o processo de trabalho terminou inesperadamente "
+                f"(código {process.exitcode}). Envie o arquivo novamente."
+            )
+            if failed:
+                print(f"⚠️ Processo de trabalho {process.pid} terminou (código {process.exitcode}); {failed} job(s) com erro")
+        self._processes = alive
+
+    def _ensure_started(self):
+        self._prune_dead()
+        while len(self._processes) < self.workers:
+            # Não é daemon: o OCR do processo de trabalho cria o seu próprio pool de processos
+            process = self._context.Process(target=_worker_main, args=(self._tasks, self.db_path),
+                                            name='contai-job-worker')
+            process.start()
+            self._processes.append(process)
+
+    def submit(self, job_id: str, model_type: str, api_key: str):
+        with self._lock:
+            self._ensure_started()
+            self._dispatched.add(job_id)
+            self._tasks.put((job_id, model_type, api_key))
+
+    def is_dispatched(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._dispatched
+
+    def reap(self):
+        with self._lock:
+            self._prune_dead()
+
+    def forget(self, job_ids: List[str]):
+        """Jobs que voltaram para a fila podem ser enviados de novo."""
+        with self._lock:
+            self._dispatched.difference_update(job_ids)
+
+    def shutdown(self):
+        with self._lock:
+            for _ in self._processes:
+                self._tasks.put(None)
+            for process in self._processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+
+
+_pool: Optional[JobWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_job_pool() -> JobWorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            store = get_job_store()
+            requeued = store.requeue_stale()
+            if requeued:
+                print(f"🔁 {len(requeued)} job(s) de documento interrompido(s) voltaram para a fila")
+            store.purge_old()
+            get_upload_store().cleanup(keep=store.pending_upload_ids())
+            _pool = JobWorkerPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+# =======================================================
+# 3. API USADA PELA INTERFACE
+# =======================================================
+
+def submit_document_jobs(owner: str, company_cnpj: Optional[str], files: List[Tuple[str, str, str]],
+                         model_type: str, api_key: str, force_analysis: bool = False) -> List[str]:
+    """
+    Grava um job por arquivo (nome, tipo, identificador do upload) e envia para os processos de trabalho.
+
+    force_analysis=True analisa mesmo que o documento pareça com outro já enviado.
+    """
+    store, pool = get_job_store(), get_job_pool()
+    job_ids = []
+    for file_name, file_type, upload_id in files:
+        job_id = store.create(owner, company_cnpj, file_name, file_type, upload_id, force_analysis)
+        pool.submit(job_id, model_type, api_key)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def resume_document_jobs(owner: str, model_type: str, api_key: str) -> int:
+    """Reenvia os jobs na fila que este servidor ainda não despachou (ex.: após reiniciar)."""
+    pool = get_job_pool()
+    resumed = 0
+    for job in get_job_store().list_jobs(owner):
+        if job['status'] == STATUS_QUEUED and not pool.is_dispatched(job['id']):
+            pool.submit(job['id'], model_type, api_key)
+            resumed += 1
+    return resumed
+
+
+_last_recovery = 0.0
+
+
+def recover_document_jobs() -> int:
+    """
+    Trata os jobs presos em execução (chamado periodicamente pela interface):
+    os de processos de trabalho que morreram viram erro e os sem sinal de
+    vida voltam para a fila, para resume_document_jobs reenviar.
+
+    Returns:
+        Quantos jobs voltaram para a fila.
+    """
+    global _last_recovery
+    now = time.time()
+    if now - _last_recovery < JOB_HEARTBEAT_SECONDS:
+        return 0
+    _last_recovery = now
+    pool = get_job_pool()
+    pool.reap()
+    requeued = get_job_store().requeue_stale()
+    if requeued:
+        pool.forget(requeued)
+        print(f"🔁 {len(requeued)} job(s) de documento sem sinal de vida voltaram para a fila")
+    return len(requeued)
@@ -0,0 +1,118 @@
+"""
+Leitura tolerante de JSON devolvido por modelos de linguagem.
+
+Aceita o que os modelos costumam produzir em volta ou dentro do JSON:
+blocos ```json, texto antes/depois do objeto, vírgulas sobrando, comentários,
+literais do Python (True/False/None), aspas simples e respostas cortadas no
+meio (strings, listas e objetos são fechados). Se mesmo assim o texto não
+puder ser lido, levanta json.JSONDecodeError como o json.loads.
+"""
+
+import json
+import re
+from typing import Any
+
+_PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+def strip_code_fences(text: str) -> str:
+    """Conteúdo do primeiro bloco ```json (ou ```) se houver."""
+    if "```json" in text:
+        return text.split("```json", 1)[1].split("```", 1)[0]
+    if "```" in text:
+        return text.split("```", 1)[1].split("```", 1)[0]
+    return text
+
+
+def _first_container(text: str) -> str:
+    """Texto a partir do primeiro '{' (ou '[')."""
+    starts = [position for position in (text.find('{'), text.find('[')) if position >= 0]
+    return text[min(starts):] if starts else text
+
+
+def repair_json(text: str) -> str:
+    """Reescreve o texto como JSON válido quando possível (sem garantir: use loads_tolerant)."""
+    text = _first_container(strip_code_fences(text or '').strip())
+    output = []
+    stack = []
+    quote = None
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if quote:
+            if char == '\\':
+                output.append(text[index:index + 2])
+                index += 2
+                continue
+            if char == quote:
+                output.append('"')
+                quote = None
+            elif char == '"':
+                output.append('\\"')  # Aspas duplas dentro de string com aspas simples
+            elif char == '\n':
+                output.append('\\n')
+            else:
+                output.append(char)
+            index += 1
+            continue
+
+        if char in '"\'':
+            quote = char
+            output.append('"')
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            output.append(char)
+        elif char in '}]':
+            _drop_trailing_comma(output)
+            if stack:
+                output.append(stack.pop())
+            if not stack:
+                break  # Fim do objeto principal: ignora o texto depois dele
+        elif text.startswith('//', index):
+            newline = text.find('\n', index)
+            index = len(text) if newline < 0 else newline
+            continue
+        elif text.startswith('/*', index):
+            end = text.find('*/', index + 2)
+            index = len(text) if end < 0 else end + 2
+            continue
+        else:
+            literal = re.match(r'True|False|None', text[index:])
+            if literal and not re.match(r'\w', text[index - 1:index] or ' '):
+                output.append(_PYTHON_LITERALS[literal.group(0)])
+                index += len(literal.group(0))
+                continue
+            output.append(char)
+        index += 1
+
+    # Resposta cortada: fecha a string e os objetos/listas abertos
+    if quote:
+        output.append('"')
+    repaired = ''.join(output).rstrip()
+    repaired = re.sub(r'[,:]\s*$', '', repaired)
+    repaired = re.sub(r',\s*"[^"]*"\s*$', '', repaired)  # Chave sem valor no fim
+    return repaired + ''.join(reversed(stack))
+
+
+def _drop_trailing_comma(output: list):
+    while output and output[-1].isspace():
+        output.pop()
+    if output and output[-1] == ',':
+        output.pop()
+
+
+def loads_tolerant(text: str) -> Any:
+    """json.loads que tenta reparar o texto antes de desistir.
+
+    O texto original é tentado primeiro, sem mexer nas cercas de código, para
+    não alterar JSON válido cujo conteúdo contenha ```.
+    """
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        pass
+    try:
+        return json.loads(strip_code_fences(text).strip())
+    except (json.JSONDecodeError, TypeError):
+        pass
+    return json.loads(repair_json(text))
@@ -6,6 +6,7 @@ Launcher para executar a aplicação Streamlit
 import os
 import sys
 import subprocess
+import multiprocessing
 from pathlib import Path
 
 def main():
@@ -56,4 +57,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Necessário para o pool de processos do OCR no executável do Windows
+    multiprocessing.freeze_support()
     main()
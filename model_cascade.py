@@ -0,0 +1,216 @@
+"""
+Cascata de modelos na análise de documentos.
+
+A primeira tentativa usa o modelo rápido e barato do provedor; o resultado só
+é refeito no modelo mais forte quando a confiança é baixa, a validação traz
+erros, há campos pendentes ou a resposta não pôde ser lida. Cada estágio
+registra chamadas, tempo, custo estimado e escalonamentos em um SQLite
+compartilhado pelos processos de análise, exibido no painel de diagnóstico.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ai_providers import AI_MODELS, estimate_tokens
+
+CASCADE_ENABLED = os.getenv('CONTAI_AI_CASCADE', '1') == '1'
+
+# (modelo rápido, modelo forte) por provedor; alteráveis com CONTAI_AI_FAST_MODEL_<PROVEDOR>
+# e CONTAI_AI_STRONG_MODEL_<PROVEDOR>
+CASCADE_MODELS = {
+    'gemini': ('gemini-1.5-flash-8b', 'gemini-1.5-pro'),
+    'openai': ('gpt-4o-mini', 'gpt-4o'),
+    'groq': ('llama-3.1-8b-instant', 'llama-3.3-70b-versatile'),
+    'anthropic': ('claude-3-5-haiku-20241022', 'claude-sonnet-4-20250514'),
+}
+
+# Preço aproximado em US$ por milhão de tokens (entrada, saída), para o custo estimado
+MODEL_PRICES = {
+    'gemini-1.5-flash-8b': (0.0375, 0.15),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'llama-3.1-8b-instant': (0.05, 0.08),
+    'llama-3.3-70b-versatile': (0.59, 0.79),
+    'claude-3-5-haiku-20241022': (0.80, 4.00),
+    'claude-sonnet-4-20250514': (3.00, 15.00),
+}
+
+# Abaixo desta confiança o resultado do modelo rápido vai para o modelo forte
+ESCALATION_CONFIDENCE = 0.8
+
+STAGE_FAST = 'rapido'
+STAGE_STRONG = 'forte'
+STAGE_SINGLE = 'unico'
+
+STATS_DB_PATH = os.getenv('CONTAI_AI_STATS_PATH') or os.path.join(tempfile.gettempdir(), 'contai_ai_stats.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cascade_stats (
+    model_type TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    escalations INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (model_type, stage, model)
+);
+"""
+
+
+def cascade_stages(model_type: str) -> List[Tuple[str, str]]:
+    """Estágios (nome, modelo) usados na análise de documentos do provedor."""
+    if not CASCADE_ENABLED or model_type not in CASCADE_MODELS:
+        return [(STAGE_SINGLE, AI_MODELS.get(model_type, ''))]
+    fast, strong = CASCADE_MODELS[model_type]
+    name = model_type.upper()
+    fast = os.getenv(f'CONTAI_AI_FAST_MODEL_{name}', fast)
+    strong = os.getenv(f'CONTAI_AI_STRONG_MODEL_{name}', strong)
+    if fast == strong:
+        return [(STAGE_SINGLE, fast)]
+    return [(STAGE_FAST, fast), (STAGE_STRONG, strong)]
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def escalation_reasons(analysis: Dict[str, Any], min_confidence: float = ESCALATION_CONFIDENCE) -> List[str]:
+    """Motivos para refazer a análise no modelo forte (lista vazia: resultado aceito)."""
+    reasons = []
+    try:
+        confidence = float(analysis.get('confianca') or 0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    if confidence < min_confidence:
+        reasons.append(f"confiança {confidence:.2f}")
+    if (analysis.get('validacao') or {}).get('erros'):
+        reasons.append("erros de validação")
+    if analysis.get('campos_pendentes'):
+        reasons.append(f"{len(analysis['campos_pendentes'])} campo(s) pendente(s)")
+    if not analysis.get('dados_extraidos'):
+        reasons.append("nenhum dado extraído")
+    return reasons
+
+
+# =======================================================
+# CONTADORES POR ESTÁGIO
+# =======================================================
+
+class CascadeStats:
+    """Contadores acumulados por provedor, estágio e modelo (SQLite, uma conexão por thread)."""
+
+    def __init__(self, path: str = STATS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, model_type: str, stage: str, model: str, seconds: float, input_tokens: int,
+               output_tokens: int, escalated: bool = False, failed: bool = False):
+        self._connect().execute(
+            "INSERT INTO cascade_stats (model_type, stage, model, calls, failures, escalations, seconds, "
+            "input_tokens, output_tokens, cost, updated_at) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (model_type, stage, model) DO UPDATE SET calls = calls + 1, "
+            "failures = failures + excluded.failures, escalations = escalations + excluded.escalations, "
+            "seconds = seconds + excluded.seconds, input_tokens = input_tokens + excluded.input_tokens, "
+            "output_tokens = output_tokens + excluded.output_tokens, cost = cost + excluded.cost, "
+            "updated_at = excluded.updated_at",
+            (model_type, stage, model, int(failed), int(escalated), seconds, input_tokens, output_tokens,
+             estimate_cost(model, input_tokens, output_tokens), time.time())
+        )
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Por estágio: chamadas, latência média, custo estimado e taxa de escalonamento."""
+        rows = self._connect().execute("SELECT * FROM cascade_stats ORDER BY model_type, stage").fetchall()
+        summary = []
+        for row in rows:
+            stats = dict(row)
+            stats['avg_seconds'] = stats['seconds'] / stats['calls'] if stats['calls'] else 0.0
+            stats['escalation_rate'] = stats['escalations'] / stats['calls'] if stats['calls'] else 0.0
+            summary.append(stats)
+        return summary
+
+
+_stats: Optional[CascadeStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_cascade_stats() -> CascadeStats:
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = CascadeStats()
+        return _stats
+
+
+def _record(model_type: str, stage: str, model: str, started: float, prompt_tokens: int,
+            analysis: Optional[Dict[str, Any]], escalated: bool = False, failed: bool = False):
+    try:
+        output_tokens = estimate_tokens(json.dumps(analysis, ensure_ascii=False, default=str)) if analysis else 0
+        get_cascade_stats().record(model_type, stage, model, time.perf_counter() - started, prompt_tokens,
+                                   output_tokens, escalated, failed)
+    except Exception as e:
+        print(f"⚠️ Erro ao registrar estatísticas da cascata: {e}")
+
+
+# =======================================================
+# EXECUÇÃO DA CASCATA
+# =======================================================
+
+def run_cascade(model_type: str, prompt_tokens: int, analyze: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Executa os estágios até um resultado aceito (o último estágio é sempre aceito).
+
+    Args:
+        prompt_tokens: tokens estimados da entrada (para o custo)
+        analyze: recebe o nome do modelo e devolve a análise (levanta exceção
+            se a resposta não puder ser lida)
+
+    Returns:
+        Análise com 'cascata' = {'estagio', 'modelo', 'motivos_escalonamento'}.
+    """
+    stages = cascade_stages(model_type)
+    previous_reasons: List[str] = []
+    for position, (stage, model) in enumerate(stages):
+        last = position == len(stages) - 1
+        started = time.perf_counter()
+        try:
+            analysis = analyze(model)
+        except Exception as e:
+            if last:
+                _record(model_type, stage, model, started, prompt_tokens, None, failed=True)
+                raise
+            _record(model_type, stage, model, started, prompt_tokens, None, escalated=True, failed=True)
+            previous_reasons = [f"resposta inválida ({e})"]
+            continue
+
+        reasons = [] if last else escalation_reasons(analysis)
+        _record(model_type, stage, model, started, prompt_tokens, analysis, escalated=bool(reasons))
+        if reasons:
+            print(f"⬆️ {model}: análise escalonada para o modelo forte ({', '.join(reasons)})")
+            previous_reasons = reasons
+            continue
+
+        analysis['cascata'] = {'estagio': stage, 'modelo': model, 'motivos_escalonamento': previous_reasons}
+        return analysis
@@ -0,0 +1,488 @@
+"""
+OCR de PDFs escaneados do CONT-AI.
+
+As páginas são rasterizadas e reconhecidas em um pool de processos (um por
+CPU). Cada processo converte apenas a página que vai ler, a partir de um
+arquivo temporário, de modo que nunca há mais bitmaps em memória do que
+processos no pool. O texto final mantém a ordem das páginas.
+
+Antes do Tesseract as imagens passam por um pré-processamento com Pillow
+(rotação EXIF, tons de cinza, redução de resolução, correção de
+inclinação, binarização e, opcionalmente, recorte do documento).
+
+O reconhecimento usa o tesserocr (Tesseract dentro do processo, um motor
+já inicializado por processo/thread) quando instalado, ou o pytesseract
+(um processo `tesseract` por chamada) como alternativa; a saída dos dois é
+normalizada para o mesmo formato.
+
+Este módulo não importa o Streamlit: os processos do pool o importam ao
+iniciar (no Windows os processos são criados por spawn).
+"""
+
+import atexit
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+OCR_DPI = 300
+OCR_LANG = 'por'
+
+# Número de processos do pool (padrão: número de CPUs)
+OCR_WORKERS = int(os.getenv('CONTAI_OCR_WORKERS', '0')) or (os.cpu_count() or 1)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Motores tesserocr abertos por idioma em cada processo (padrão: número de CPUs)
+TESSEROCR_MAX_ENGINES = int(os.getenv('CONTAI_TESSEROCR_ENGINES', '0')) or (os.cpu_count() or 1)
+
+
+# Pré-processamento das imagens antes do Tesseract
+OCR_PREPROCESS = os.getenv('CONTAI_OCR_PREPROCESS', '1') != '0'
+OCR_AUTOCROP = os.getenv('CONTAI_OCR_AUTOCROP', '0') == '1'
+OCR_ENGINE = os.getenv('CONTAI_OCR_ENGINE', 'auto').lower()
+MAX_LONG_SIDE_PX = 3300  # ≈ A4 a 300 DPI; fotos maiores são reduzidas
+MIN_FILE_DPI = 150  # DPI do arquivo abaixo disso (ex.: 72 das câmeras) não descreve o papel e é ignorado
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+
+
+# =======================================================
+# 1. PRÉ-PROCESSAMENTO DE IMAGENS (Pillow)
+# =======================================================
+
+def otsu_threshold(image) -> int:
+    """Limiar de Otsu calculado pelo histograma de uma imagem em tons de cinza."""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    if not total:
+        return 128
+    sum_total = sum(i * count for i, count in enumerate(histogram))
+
+    best_threshold, best_variance = 128, -1.0
+    weight_background, sum_background = 0, 0.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_total - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance, best_threshold = variance, threshold
+    return best_threshold
+
+
+def binarize(image):
+    """Converte para preto e branco pelo limiar de Otsu."""
+    threshold = otsu_threshold(image)
+    return image.point(lambda pixel: 255 if pixel > threshold else 0)
+
+
+def estimate_skew_angle(image) -> float:
+    """
+    Estima a inclinação do texto (graus) pelo perfil de projeção horizontal:
+    o ângulo que deixa as linhas de texto mais "marcadas" maximiza a variância das somas por linha.
+    """
+    from PIL import Image, ImageOps
+
+    small = image.copy()
+    small.thumbnail((800, 800))
+    inverted = ImageOps.invert(binarize(small))  # Texto em branco (valores altos)
+
+    best_angle, best_score = 0.0, -1.0
+    steps = int(DESKEW_MAX_ANGLE / DESKEW_STEP)
+    for step in range(-steps, steps + 1):
+        angle = step * DESKEW_STEP
+        rotated = inverted.rotate(angle, resample=Image.NEAREST, fillcolor=0)
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(rows) / len(rows)
+        score = sum((value - mean) ** 2 for value in rows)
+        if score > best_score:
+            best_score, best_angle = score, angle
+    return best_angle
+
+
+def crop_to_document(image):
+    """Recorta a região clara do documento (ex.: recibo fotografado sobre uma mesa)."""
+    from PIL import ImageFilter
+
+    small = image.copy()
+    small.thumbnail((600, 600))
+    scale = image.width / small.width
+    threshold = otsu_threshold(small)
+    mask = small.filter(ImageFilter.MedianFilter(5)).point(lambda pixel: 255 if pixel > threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+
+    left, top, right, bottom = bbox
+    # Só recorta se a região encontrada for plausível (nem minúscula, nem a imagem inteira)
+    area_ratio = ((right - left) * (bottom - top)) / float(small.width * small.height)
+    if area_ratio < 0.2 or area_ratio > 0.95:
+        return image
+    margin = 4
+    return image.crop((
+        max(0, int((left - margin) * scale)),
+        max(0, int((top - margin) * scale)),
+        min(image.width, int((right + margin) * scale)),
+        min(image.height, int((bottom + margin) * scale))
+    ))
+
+
+def preprocess_image(image, source_dpi: Optional[int] = None, target_dpi: int = OCR_DPI,
+                     autocrop: bool = OCR_AUTOCROP, deskew: bool = True, threshold: bool = True):
+    """
+    Normaliza a imagem para o Tesseract: rotação EXIF, tons de cinza, recorte opcional
+    do documento, redução para o DPI alvo, correção de inclinação e binarização.
+
+    Args:
+        image: Imagem PIL
+        source_dpi: DPI de origem, quando conhecido (ex.: página rasterizada do PDF);
+                    senão usa o DPI do arquivo, se plausível. O maior lado é
+                    sempre limitado a MAX_LONG_SIDE_PX
+        target_dpi: DPI desejado para o OCR (a imagem nunca é ampliada)
+    """
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+
+    if autocrop:
+        image = crop_to_document(image)
+
+    # Redução (nunca amplia)
+    file_dpi = image.info.get('dpi', (0, 0))[0] if isinstance(image.info.get('dpi'), tuple) else 0
+    dpi = source_dpi or (int(file_dpi) if file_dpi and file_dpi >= MIN_FILE_DPI else 0)
+    scale = min(1.0, MAX_LONG_SIDE_PX / float(max(image.size)))
+    if dpi:
+        scale = min(scale, target_dpi / float(dpi))
+    if scale < 1.0:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+
+    if deskew:
+        angle = estimate_skew_angle(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    if threshold:
+        image = binarize(image)
+
+    return image
+
+
+# =======================================================
+# 2. MOTORES DE OCR
+# =======================================================
+
+def normalize_ocr_text(text: str) -> str:
+    """
+    Formato único da saída, qualquer que seja o motor: sem o separador de página
+    (form feed) que o executável do Tesseract acrescenta e com quebras de linha no padrão Unix.
+    """
+    return (text or "").replace('\r\n', '\n').rstrip('\x0c')
+
+
+class TesseractCliEngine:
+    """pytesseract: executa o programa tesseract a cada chamada (recarrega o idioma toda vez)."""
+
+    name = 'pytesseract'
+
+    def __init__(self):
+        import pytesseract
+        tesseract_cmd = os.getenv('TESSERACT_CMD')
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self._pytesseract = pytesseract
+
+    def image_to_string(self, image, lang: str = OCR_LANG) -> str:
+        return normalize_ocr_text(self._pytesseract.image_to_string(image, lang=lang))
+
+
+class TesserocrEngine:
+    """
+    tesserocr: API do Tesseract dentro do processo. A API não é thread-safe:
+    cada chamada pega um motor livre do idioma e o devolve ao terminar. Os
+    motores são reutilizados e limitados a `max_engines` por idioma (cada um
+    ocupa dezenas de MB), qualquer que seja o número de threads que usam o OCR.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, max_engines: int = TESSEROCR_MAX_ENGINES):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._tessdata_path = os.getenv('CONTAI_TESSDATA_PATH') or os.getenv('TESSDATA_PREFIX')
+        self._max_engines = max(1, max_engines)
+        self._free: Dict[str, queue.Queue] = {}
+        self._created: Dict[str, int] = {}
+        self._all_apis = []
+        self._lock = threading.Lock()
+        self._release(OCR_LANG, self._acquire(OCR_LANG))  # Falha aqui (e cai no pytesseract) se o idioma não estiver instalado
+
+    def _acquire(self, lang: str):
+        """Motor livre do idioma; cria outro se o limite permitir, senão espera um ser devolvido."""
+        with self._lock:
+            free = self._free.setdefault(lang, queue.Queue())
+            try:
+                return free.get_nowait()
+            except queue.Empty:
+                pass
+            if self._created.get(lang, 0) < self._max_engines:
+                if self._tessdata_path:
+                    api = self._tesserocr.PyTessBaseAPI(path=self._tessdata_path, lang=lang)
+                else:
+                    api = self._tesserocr.PyTessBaseAPI(lang=lang)
+                self._created[lang] = self._created.get(lang, 0) + 1
+                self._all_apis.append(api)
+                return api
+        return free.get()
+
+    def _release(self, lang: str, api):
+        self._free[lang].put(api)
+
+    def image_to_string(self, image, lang: str = OCR_LANG) -> str:
+        api = self._acquire(lang)
+        try:
+            api.SetImage(image)
+            return normalize_ocr_text(api.GetUTF8Text())
+        finally:
+            api.Clear()
+            self._release(lang, api)
+
+    def close(self):
+        with self._lock:
+            for api in self._all_apis:
+                try:
+                    api.End()
+                except Exception:
+                    pass
+            self._all_apis = []
+            self._free = {}
+            self._created = {}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def create_ocr_engine(preferred: Optional[str] = None):
+    """
+    Cria o motor de OCR (variável CONTAI_OCR_ENGINE: auto, tesserocr ou pytesseract).
+    No modo auto usa o tesserocr quando instalado e cai para o pytesseract caso contrário.
+    """
+    preferred = (preferred or OCR_ENGINE).lower()
+    if preferred in ('auto', 'tesserocr'):
+        try:
+            return TesserocrEngine()
+        except Exception as e:
+            if preferred == 'tesserocr':
+                print(f"⚠️ tesserocr indisponível ({e}), usando pytesseract")
+    return TesseractCliEngine()
+
+
+def ocr_settings(lang: str = OCR_LANG) -> Dict[str, object]:
+    """Configurações que alteram o texto reconhecido (entram na chave do cache de extração)."""
+    return {
+        'dpi': OCR_DPI,
+        'lang': lang,
+        'preprocess': OCR_PREPROCESS,
+        'autocrop': OCR_AUTOCROP,
+        'engine': OCR_ENGINE,
+    }
+
+
+def get_ocr_engine():
+    """Motor de OCR do processo (cada processo do pool mantém o seu, já inicializado)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_ocr_engine()
+                atexit.register(getattr(_engine, 'close', lambda: None))
+    return _engine
+
+
+# =======================================================
+# 3. TRABALHO POR PÁGINA (executado nos processos do pool)
+# =======================================================
+
+def ocr_pdf_page(pdf_path: str, page_number: int, dpi: int = OCR_DPI, lang: str = OCR_LANG) -> str:
+    """Rasteriza e aplica OCR em uma única página (1 = primeira) do PDF."""
+    from pdf2image import convert_from_path
+
+    engine = get_ocr_engine()
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    try:
+        if not images:
+            return ""
+        image = preprocess_image(images[0], source_dpi=dpi, target_dpi=dpi, autocrop=False) if OCR_PREPROCESS else images[0]
+        return engine.image_to_string(image, lang)
+    finally:
+        for image in images:
+            image.close()
+
+
+def ocr_image(file_bytes: bytes, lang: str = OCR_LANG) -> str:
+    """Aplica OCR em uma imagem (foto/escaneamento), com pré-processamento."""
+    from io import BytesIO
+    from PIL import Image
+
+    engine = get_ocr_engine()
+    with Image.open(BytesIO(file_bytes)) as image:
+        prepared = preprocess_image(image) if OCR_PREPROCESS else image
+        return engine.image_to_string(prepared, lang)
+
+
+# =======================================================
+# 4. POOL DE PROCESSOS
+# =======================================================
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if OCR_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+            except Exception as e:
+                print(f"⚠️ Pool de OCR indisponível ({e}), processando páginas em sequência")
+                return None
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(_reset_pool)
+
+
+# =======================================================
+# 5. OCR DO DOCUMENTO
+# =======================================================
+
+def count_pdf_pages(pdf_path: str) -> int:
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path)['Pages'])
+
+
+def format_pages(page_texts: List[str]) -> str:
+    """Junta os textos das páginas no formato '--- Página N ---'."""
+    return "".join(f"\n--- Página {i + 1} ---\n{page_text}\n" for i, page_text in enumerate(page_texts))
+
+
+def _write_temp_pdf(file_bytes: bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+        tmp.write(file_bytes)
+        return tmp.name
+
+
+def _ocr_pages_from_path(pdf_path: str, pages: List[Tuple[int, int]], lang: str,
+                         errors: Optional[Dict[int, str]] = None) -> Dict[int, str]:
+    """
+    OCR das páginas [(número, dpi), ...] do arquivo, em paralelo quando possível.
+
+    Com `errors`, a falha de uma página fica registrada nele ({número: mensagem})
+    e as demais páginas continuam; sem ele, a primeira falha é levantada.
+    """
+    texts = {}
+    failed = errors if errors is not None else {}
+
+    def record_failure(page: int, error: Exception):
+        if errors is None:
+            raise error
+        failed[page] = str(error)
+
+    pending = list(pages)
+    pool = _get_pool() if len(pages) > 1 else None
+    if pool is not None:
+        try:
+            # Cada processo rasteriza somente a página que está lendo
+            futures = [(page, pool.submit(ocr_pdf_page, pdf_path, page, dpi, lang)) for page, dpi in pages]
+            for page, future in futures:
+                try:
+                    texts[page] = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    record_failure(page, e)
+            return texts
+        except BrokenProcessPool as e:
+            print(f"⚠️ Pool de OCR interrompido ({e}), processando páginas em sequência")
+            _reset_pool()
+            pending = [(page, dpi) for page, dpi in pages if page not in texts and page not in failed]
+
+    for page, dpi in pending:
+        try:
+            texts[page] = ocr_pdf_page(pdf_path, page, dpi, lang)
+        except Exception as e:
+            record_failure(page, e)
+    return texts
+
+
+def ocr_pdf_pages(file_bytes: bytes, pages: List[Tuple[int, int]], lang: str = OCR_LANG,
+                  errors: Optional[Dict[int, str]] = None) -> Dict[int, str]:
+    """
+    Aplica OCR apenas nas páginas informadas, cada uma com seu DPI.
+
+    Args:
+        file_bytes: Conteúdo do PDF
+        pages: Lista de (número da página começando em 1, dpi)
+        lang: Idioma do Tesseract
+        errors: Se informado, recebe {número da página: mensagem} das páginas
+            que falharam, em vez de levantar a exceção
+
+    Returns:
+        Dict {número da página: texto} das páginas lidas
+    """
+    if not pages:
+        return {}
+    pdf_path = _write_temp_pdf(file_bytes)
+    try:
+        return _ocr_pages_from_path(pdf_path, pages, lang, errors)
+    finally:
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
+
+
+def ocr_pdf(file_bytes: bytes, dpi: int = OCR_DPI, lang: str = OCR_LANG) -> str:
+    """
+    Aplica OCR em todas as páginas do PDF, em paralelo quando possível.
+
+    Args:
+        file_bytes: Conteúdo do PDF
+        dpi: Resolução da rasterização
+        lang: Idioma do Tesseract
+
+    Returns:
+        Texto de todas as páginas, na ordem, separado por '--- Página N ---'
+
+    Raises:
+        Exception: Erros do pdf2image/Tesseract (ex.: Poppler ou Tesseract não instalados)
+    """
+    pdf_path = _write_temp_pdf(file_bytes)
+    try:
+        page_count = count_pdf_pages(pdf_path)
+        texts = _ocr_pages_from_path(pdf_path, [(page, dpi) for page in range(1, page_count + 1)], lang)
+        return format_pages([texts[page] for page in range(1, page_count + 1)])
+    finally:
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
@@ -0,0 +1,364 @@
+"""
+Extração de texto de PDFs com decisão por página.
+
+Páginas com camada de texto suficiente usam o texto do próprio PDF; apenas
+as páginas sem texto (ou que são essencialmente uma imagem, como um
+comprovante escaneado anexado a uma nota digital) passam pelo OCR, com DPI
+escolhido pelo tamanho da página.
+
+A camada de texto é lida por backends intercambiáveis (pypdfium2, PyPDF2,
+pdfplumber): usa-se o mais rápido instalado e, se o texto dele não passar
+na verificação de qualidade, o próximo.
+"""
+
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from ocr import OCR_LANG, format_pages, ocr_pdf_pages
+
+# Mínimo de caracteres alfanuméricos para considerar a camada de texto da página suficiente
+MIN_PAGE_CHARS = 25
+
+# Páginas cobertas por imagem nesta proporção são reconhecidas por OCR se tiverem pouco texto
+IMAGE_COVERAGE_OCR = 0.5
+MIN_TEXT_CHARS_WITH_IMAGE = 200
+
+# DPI adaptativo: o maior lado da página rasterizada fica perto deste número de pixels
+# (≈ A4 a 300 DPI), limitado ao intervalo abaixo
+TARGET_LONG_SIDE_PX = 3300
+MIN_OCR_DPI = 150
+MAX_OCR_DPI = 400
+
+# Proporção máxima de caracteres inválidos aceita na verificação de qualidade do texto
+MAX_BAD_CHAR_RATIO = 0.05
+
+# Início do aviso deixado no texto quando o OCR de uma página falha (resultado parcial)
+OCR_PAGE_ERROR_MARKER = "[Erro ao aplicar OCR na página"
+
+
+def adaptive_dpi(width_pt: float, height_pt: float) -> int:
+    """DPI para rasterizar a página, a partir do tamanho em pontos (1/72 de polegada)."""
+    long_side_in = max(width_pt, height_pt) / 72 if width_pt and height_pt else 0
+    if long_side_in <= 0:
+        return 300
+    return int(min(MAX_OCR_DPI, max(MIN_OCR_DPI, TARGET_LONG_SIDE_PX / long_side_in)))
+
+
+def count_text_chars(text: str) -> int:
+    return sum(1 for char in text if char.isalnum())
+
+
+def page_needs_ocr(text: str, image_coverage: float = 0.0) -> bool:
+    """Decide se a página precisa de OCR pela quantidade de texto e pela área ocupada por imagens."""
+    chars = count_text_chars(text or "")
+    if chars < MIN_PAGE_CHARS:
+        return True
+    return image_coverage >= IMAGE_COVERAGE_OCR and chars < MIN_TEXT_CHARS_WITH_IMAGE
+
+
+# =======================================================
+# BACKENDS DE TEXTO
+# =======================================================
+
+class PdfTextBackend:
+    """
+    Backend de leitura da camada de texto do PDF.
+
+    extract_pages devolve, para cada página, (texto, largura_pt, altura_pt,
+    fração_da_área_com_imagens). A cobertura de imagens é usada para decidir
+    o OCR de páginas escaneadas com pouco texto.
+    """
+
+    name = ''
+    module = ''
+    estimated_ms_per_page = 100  # Estimativa usada até haver medições reais
+
+    def is_available(self) -> bool:
+        try:
+            __import__(self.module)
+            return True
+        except Exception:
+            return False
+
+    def extract_pages(self, file_bytes: bytes) -> List[Tuple[str, float, float, float]]:
+        raise NotImplementedError
+
+
+class PdfiumBackend(PdfTextBackend):
+    """pypdfium2 (PDFium, em C): o mais rápido."""
+
+    name = 'pypdfium2'
+    estimated_ms_per_page = 2
+    module = 'pypdfium2'
+
+    def extract_pages(self, file_bytes):
+        import pypdfium2 as pdfium
+        import pypdfium2.raw as pdfium_c
+
+        pages = []
+        # Conteúdo mapeado em memória (mmap) é lido como arquivo
+        pdf = pdfium.PdfDocument(file_bytes if isinstance(file_bytes, bytes) else BytesIO(file_bytes))
+        try:
+            for index in range(len(pdf)):
+                page = pdf[index]
+                try:
+                    width, height = page.get_size()
+                    text_page = page.get_textpage()
+                    text = text_page.get_text_range()
+                    text_page.close()
+
+                    image_area = 0.0
+                    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+                        left, bottom, right, top = obj.get_pos()
+                        image_area += abs(right - left) * abs(top - bottom)
+                    coverage = min(1.0, image_area / (width * height)) if width and height else 0.0
+
+                    pages.append((text.replace('\r\n', '\n'), width, height, coverage))
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+        return pages
+
+
+class PyPDF2Backend(PdfTextBackend):
+    """PyPDF2 (Python puro, já em requirements.txt)."""
+
+    name = 'PyPDF2'
+    estimated_ms_per_page = 20
+    module = 'PyPDF2'
+
+    def extract_pages(self, file_bytes):
+        from PyPDF2 import PdfReader
+
+        pages = []
+        for page in PdfReader(BytesIO(file_bytes)).pages:
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            try:
+                coverage = _placed_image_coverage(page, width, height)
+            except Exception:
+                coverage = 0.0  # Posição das imagens desconhecida: decide só pela quantidade de texto
+            pages.append((page.extract_text() or "", width, height, coverage))
+        return pages
+
+
+def _multiply_matrix(m: Tuple[float, ...], ctm: Tuple[float, ...]) -> Tuple[float, ...]:
+    """Concatena a matriz do operador cm à matriz de transformação atual (m × ctm)."""
+    a, b, c, d, e, f = m
+    ca, cb, cc, cd, ce, cf = ctm
+    return (a * ca + b * cc, a * cb + b * cd,
+            c * ca + d * cc, c * cb + d * cd,
+            e * ca + f * cc + ce, e * cb + f * cd + cf)
+
+
+def _placed_image_coverage(page, width: float, height: float) -> float:
+    """
+    Fração da página ocupada por imagens (PyPDF2): cada XObject de imagem
+    desenhado (operador Do) ocupa o quadrado unitário transformado pela matriz
+    em vigor (operadores cm, q e Q). Logotipos e assinaturas cobrem pouco;
+    uma página escaneada, quase tudo. XObjects de formulário não são abertos.
+    """
+    if not width or not height or '/Resources' not in page:
+        return 0.0
+    resources = page['/Resources'].get_object()
+    xobjects = resources['/XObject'].get_object() if '/XObject' in resources else {}
+    images = {name for name in xobjects if xobjects[name].get_object().get('/Subtype') == '/Image'}
+    contents = page.get_contents() if images else None
+    if contents is None:
+        return 0.0
+
+    identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    ctm, stack, image_area = identity, [], 0.0
+    for operands, operator in contents.operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else identity
+        elif operator == b'cm' and len(operands) == 6:
+            ctm = _multiply_matrix(tuple(float(value) for value in operands), ctm)
+        elif operator == b'Do' and operands and operands[0] in images:
+            a, b, c, d = ctm[:4]
+            image_area += abs(a * d - b * c)
+    return min(1.0, image_area / (width * height))
+
+
+class PdfplumberBackend(PdfTextBackend):
+    """pdfplumber (mais lento, melhor para layouts complexos)."""
+
+    name = 'pdfplumber'
+    estimated_ms_per_page = 100
+    module = 'pdfplumber'
+
+    def extract_pages(self, file_bytes):
+        import pdfplumber
+
+        pages = []
+        with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+            for page in pdf.pages:
+                pages.append((page.extract_text() or "", float(page.width), float(page.height), _image_coverage(page)))
+        return pages
+
+
+def _image_coverage(page) -> float:
+    """Fração da área da página ocupada por imagens (pdfplumber)."""
+    try:
+        page_area = float(page.width) * float(page.height)
+        if page_area <= 0:
+            return 0.0
+        image_area = sum(
+            abs(float(image['x1']) - float(image['x0'])) * abs(float(image['bottom']) - float(image['top']))
+            for image in page.images
+        )
+        return min(1.0, image_area / page_area)
+    except Exception:
+        return 0.0
+
+
+# Backends conhecidos; a ordem de uso segue os tempos medidos (ou estimados)
+BACKENDS: List[PdfTextBackend] = [PdfiumBackend(), PyPDF2Backend(), PdfplumberBackend()]
+
+_timings: Dict[str, Dict[str, float]] = {}
+_timings_lock = threading.Lock()
+
+
+def _record_timing(backend_name: str, pages: int, seconds: float, failed: bool = False):
+    with _timings_lock:
+        stats = _timings.setdefault(backend_name, {'documents': 0, 'pages': 0, 'seconds': 0.0, 'failures': 0})
+        if failed:
+            stats['failures'] += 1
+        else:
+            stats['documents'] += 1
+            stats['pages'] += pages
+            stats['seconds'] += seconds
+
+
+def get_backend_timings() -> Dict[str, Dict[str, float]]:
+    """Tempos acumulados por backend (documentos, páginas, segundos, falhas e ms por página)."""
+    with _timings_lock:
+        report = {}
+        for name, stats in _timings.items():
+            report[name] = dict(stats)
+            report[name]['ms_per_page'] = (stats['seconds'] * 1000 / stats['pages']) if stats['pages'] else 0.0
+        return report
+
+
+def available_backends() -> List[PdfTextBackend]:
+    """Backends instalados, do mais rápido para o mais lento segundo os tempos medidos."""
+    backends = [backend for backend in BACKENDS if backend.is_available()]
+    timings = get_backend_timings()
+
+    def speed(backend):
+        stats = timings.get(backend.name)
+        if not stats or not stats['pages']:
+            return backend.estimated_ms_per_page  # Ainda sem medição: usa a estimativa
+        return stats['ms_per_page']
+
+    return sorted(backends, key=speed)
+
+
+def text_quality_ok(pages: List[Tuple[str, float, float, float]]) -> bool:
+    """
+    Verifica se o texto extraído é utilizável: poucos caracteres de substituição,
+    glifos sem mapeamento '(cid:N)' ou caracteres de controle. Texto vazio é aceito
+    (a página vai para o OCR).
+    """
+    text = "".join(page[0] for page in pages)
+    if not text.strip():
+        return True
+    bad = text.count('\ufffd') + text.count('(cid:') * 6
+    bad += sum(1 for char in text if not char.isprintable() and char not in '\n\r\t')
+    return bad / len(text) < MAX_BAD_CHAR_RATIO
+
+
+def read_text_layer(file_bytes: bytes) -> Tuple[str, List[Tuple[str, float, float, float]]]:
+    """
+    Lê a camada de texto com o backend mais rápido disponível, passando para o
+    próximo se ele falhar ou se o texto não passar na verificação de qualidade.
+
+    Returns:
+        (nome do backend usado, páginas)
+    """
+    last_error = None
+    for backend in available_backends():
+        started = time.perf_counter()
+        try:
+            pages = backend.extract_pages(file_bytes)
+        except Exception as e:
+            _record_timing(backend.name, 0, 0.0, failed=True)
+            last_error = e
+            continue
+
+        elapsed = time.perf_counter() - started
+        if not text_quality_ok(pages):
+            _record_timing(backend.name, 0, 0.0, failed=True)
+            print(f"⚠️ Texto do PDF com baixa qualidade em {backend.name}, tentando outro backend")
+            continue
+
+        _record_timing(backend.name, len(pages), elapsed)
+        print(f"⏱️ {backend.name}: {len(pages)} página(s) em {elapsed:.2f}s")
+        return backend.name, pages
+
+    raise RuntimeError(f"Nenhum backend de PDF conseguiu ler o arquivo: {last_error}")
+
+
+# =======================================================
+# EXTRAÇÃO HÍBRIDA (TEXTO + OCR)
+# =======================================================
+
+def analyze_pages(file_bytes: bytes) -> List[Tuple[str, bool, int]]:
+    """
+    Lê a camada de texto de cada página.
+
+    Returns:
+        Lista [(texto, precisa_ocr, dpi_para_ocr), ...] na ordem das páginas
+    """
+    _, pages = read_text_layer(file_bytes)
+    return [
+        (text, page_needs_ocr(text, coverage), adaptive_dpi(width, height))
+        for text, width, height, coverage in pages
+    ]
+
+
+def extract_pdf_text(file_bytes: bytes, lang: str = OCR_LANG) -> Optional[str]:
+    """
+    Extrai o texto do PDF usando a camada de texto onde ela existe e OCR só nas páginas sem texto.
+
+    Returns:
+        Texto do documento. Sem OCR, as páginas são apenas concatenadas; se
+        alguma página passou pelo OCR, todas são separadas por '--- Página N ---'.
+        Páginas cujo OCR falhou recebem OCR_PAGE_ERROR_MARKER (texto parcial,
+        que não deve ir para o cache).
+        None se o PDF não tiver nenhum texto aproveitável.
+    """
+    pages = analyze_pages(file_bytes)
+
+    to_ocr = [(number, dpi) for number, (_, needs_ocr, dpi) in enumerate(pages, start=1) if needs_ocr]
+    if not to_ocr:
+        return "".join(text + "\n" for text, _, _ in pages)
+
+    ocr_errors: Dict[int, str] = {}
+    try:
+        ocr_texts = ocr_pdf_pages(file_bytes, to_ocr, lang, errors=ocr_errors)
+    except Exception as e:
+        # Poppler/Tesseract ausentes: as páginas com camada de texto continuam valendo
+        print(f"⚠️ OCR indisponível ({e}), mantendo apenas a camada de texto")
+        ocr_texts = {}
+        ocr_errors = {number: str(e) for number, _ in to_ocr}
+
+    page_texts = []
+    for number, (text, needs_ocr, _) in enumerate(pages, start=1):
+        if needs_ocr and number in ocr_errors:
+            marker = f"{OCR_PAGE_ERROR_MARKER} {number}: {ocr_errors[number]}]"
+            text = f"{text.rstrip()}\n{marker}" if text.strip() else marker
+        elif needs_ocr:
+            ocr_text = ocr_texts.get(number, "")
+            # Mantém o que tiver mais conteúdo (ex.: cabeçalho digital + corpo escaneado)
+            text = ocr_text if count_text_chars(ocr_text) >= count_text_chars(text) else text
+        page_texts.append(text)
+
+    if not any(text.strip() for text, _, _ in pages) and len(ocr_errors) == len(to_ocr):
+        # Nenhuma página legível: o erro segue para quem chamou (OCR do documento inteiro)
+        raise RuntimeError(next(iter(ocr_errors.values())))
+    return format_pages(page_texts) if any(text.strip() for text in page_texts) else None
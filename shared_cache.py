@@ -0,0 +1,397 @@
+"""
+Cache compartilhado entre processos do CONT-AI.
+
+Quando vários processos do Streamlit atendem a mesma empresa, as leituras
+do banco (DRE, saldos, contas a pagar/receber...) e as análises de IA são
+guardadas em um backend comum, de modo que apenas o primeiro processo
+consulta o Supabase.
+
+Backends (variável CONTAI_CACHE_BACKEND):
+  - sqlite (padrão): arquivo local em CONTAI_CACHE_PATH, compartilhado pelos
+    processos da mesma máquina
+  - redis: servidor em CONTAI_REDIS_URL (requer o pacote `redis`)
+  - none: desativa o cache compartilhado
+
+As chaves são versionadas por (entidade, escopo) — o escopo normalmente é a
+empresa. Cada escrita publicada em events.publish incrementa a versão,
+invalidando de uma vez todas as leituras daquela empresa/entidade em todos
+os processos.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from events import subscribe
+
+# Versão do formato das chaves/valores (incrementar ao mudar o formato dos dados cacheados)
+CACHE_SCHEMA_VERSION = 1
+
+DEFAULT_TTL = int(os.getenv('CONTAI_CACHE_TTL', '300'))  # segundos
+LOCK_TTL = 30  # segundos que um processo pode segurar o cálculo de uma chave
+LOCK_WAIT = 10.0  # segundos que os demais processos aguardam o resultado antes de calcular por conta própria
+NONE_MARKER_TTL = 5  # segundos que o aviso "cálculo terminou sem resultado" fica visível para quem aguarda
+
+_MISSING = object()
+
+
+# =======================================================
+# 1. BACKENDS
+# =======================================================
+
+class NullBackend:
+    """Backend vazio (cache compartilhado desativado)."""
+
+    name = 'none'
+
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        pass
+
+    def add(self, key: str, value: bytes, ttl: Optional[int] = None) -> bool:
+        return True
+
+    def delete(self, key: str):
+        pass
+
+    def get_version(self, key: str) -> int:
+        return 0
+
+    def incr_version(self, key: str) -> int:
+        return 0
+
+
+class SQLiteBackend:
+    """Backend em arquivo SQLite (modo WAL), compartilhado pelos processos da máquina."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._sets = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _expires_at(ttl: Optional[int]) -> Optional[float]:
+        return time.time() + ttl if ttl else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(value), self._expires_at(ttl))
+        )
+        # Limpeza periódica das entradas expiradas
+        self._sets += 1
+        if self._sets % 200 == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def add(self, key: str, value: bytes, ttl: Optional[int] = None) -> bool:
+        """Grava apenas se a chave não existir (ou estiver expirada). Retorna True se gravou."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.get(key) is not None:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(value), self._expires_at(ttl))
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def get_version(self, key: str) -> int:
+        row = self._connect().execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr_version(self, key: str) -> int:
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO versions (key, version) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET version = version + 1",
+            (key,)
+        )
+        return self.get_version(key)
+
+
+class RedisBackend:
+    """Backend Redis (ou compatível), compartilhado entre máquinas."""
+
+    name = 'redis'
+
+    def __init__(self, url: str):
+        import redis  # Dependência opcional
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        self.client.set(key, value, ex=ttl or None)
+
+    def add(self, key: str, value: bytes, ttl: Optional[int] = None) -> bool:
+        return bool(self.client.set(key, value, ex=ttl or None, nx=True))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def get_version(self, key: str) -> int:
+        value = self.client.get(key)
+        return int(value) if value else 0
+
+    def incr_version(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+
+def create_backend():
+    """Cria o backend configurado nas variáveis de ambiente (com fallback para SQLite)."""
+    backend_name = os.getenv('CONTAI_CACHE_BACKEND', 'sqlite').lower()
+
+    if backend_name == 'none':
+        return NullBackend()
+
+    if backend_name == 'redis':
+        try:
+            backend = RedisBackend(os.getenv('CONTAI_REDIS_URL', 'redis://localhost:6379/0'))
+            print("✅ Cache compartilhado: Redis")
+            return backend
+        except Exception as e:
+            print(f"⚠️ Redis indisponível ({e}), usando cache em SQLite")
+
+    path = os.getenv('CONTAI_CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'contai_cache.sqlite3')
+    try:
+        return SQLiteBackend(path)
+    except Exception as e:
+        print(f"⚠️ Não foi possível abrir o cache compartilhado em {path}: {e}")
+        return NullBackend()
+
+
+# =======================================================
+# 2. CACHE COMPARTILHADO
+# =======================================================
+
+class SharedCache:
+    """Leitura/gravação de valores (pickle) com TTL e chaves versionadas por entidade/escopo."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.counters = {'hits': 0, 'misses': 0, 'errors': 0, 'invalidations': 0}
+
+    # ----- versões -----
+
+    @staticmethod
+    def _version_key(entity: str, scope: Any = None) -> str:
+        return f"contai:v:{entity}:{'*' if scope is None else scope}"
+
+    def version(self, entity: str, scope: Any = None) -> str:
+        """Versão atual da entidade (global + escopo), usada para compor as chaves."""
+        try:
+            global_version = self.backend.get_version(self._version_key(entity))
+            scope_version = self.backend.get_version(self._version_key(entity, scope)) if scope is not None else 0
+            return f"{global_version}.{scope_version}"
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"⚠️ Erro ao ler versão do cache ({entity}): {e}")
+            return 'x'
+
+    def invalidate(self, entity: str, scope: Any = None):
+        """Invalida todas as leituras da entidade para o escopo (ou de todos os escopos se None)."""
+        try:
+            self.backend.incr_version(self._version_key(entity, scope))
+            self.counters['invalidations'] += 1
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"⚠️ Erro ao invalidar cache ({entity}/{scope}): {e}")
+
+    # ----- valores -----
+
+    def make_key(self, namespace: str, entity: str, scope: Any, *parts: Any) -> str:
+        digest = hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+        return f"contai:{CACHE_SCHEMA_VERSION}:{namespace}:{entity}:{scope}:{self.version(entity, scope)}:{digest}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            raw = self.backend.get(key)
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"⚠️ Erro ao ler cache compartilhado: {e}")
+            return default
+        if raw is None:
+            self.counters['misses'] += 1
+            return default
+        try:
+            value = pickle.loads(raw)
+        except Exception:
+            self.counters['errors'] += 1
+            return default
+        self.counters['hits'] += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = DEFAULT_TTL):
+        try:
+            self.backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"⚠️ Erro ao gravar cache compartilhado: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[int] = DEFAULT_TTL) -> Any:
+        """
+        Retorna o valor da chave ou calcula-o uma única vez entre os processos.
+
+        Enquanto um processo calcula, os demais aguardam o resultado (até
+        LOCK_WAIT segundos) em vez de repetir a consulta. Resultados None
+        (erro) não são gravados: quem calculou deixa um aviso curto para os
+        que aguardam devolverem None na hora, e a próxima chamada tenta de novo.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock_key = f"{key}:lock"
+        none_key = f"{key}:none"
+        try:
+            acquired = self.backend.add(lock_key, b'1', LOCK_TTL)
+        except Exception:
+            acquired = True
+
+        if not acquired:
+            deadline = time.time() + LOCK_WAIT
+            while time.time() < deadline:
+                time.sleep(0.1)
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+                try:
+                    if self.backend.get(none_key) is not None:
+                        return None
+                    if self.backend.get(lock_key) is None:
+                        break  # Quem calculava terminou sem gravar: calcula agora
+                except Exception:
+                    break
+
+        try:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+            elif acquired:
+                try:
+                    self.backend.set(none_key, b'1', NONE_MARKER_TTL)
+                except Exception:
+                    pass
+            return value
+        finally:
+            if acquired:
+                try:
+                    self.backend.delete(lock_key)
+                except Exception:
+                    pass
+
+    def stats(self):
+        return {'backend': self.backend.name, **self.counters}
+
+
+_shared_cache: Optional[SharedCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> SharedCache:
+    """Instância única do cache compartilhado no processo."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = SharedCache()
+    return _shared_cache
+
+
+# =======================================================
+# 3. DECORADOR PARA FUNÇÕES DE LEITURA
+# =======================================================
+
+def shared_cached(entity: str, scope_arg: Optional[str] = 'company_id', ttl: Optional[int] = DEFAULT_TTL,
+                  enabled: Optional[Callable[[], bool]] = None):
+    """
+    Guarda o resultado de uma função de leitura no cache compartilhado.
+
+    Args:
+        entity: Entidade lida (ex.: 'dre', 'payables'); escritas nela invalidam o resultado
+        scope_arg: Nome do argumento usado como escopo da versão (normalmente a empresa)
+        ttl: Validade em segundos (None = sem expiração)
+        enabled: Função que indica se o cache deve ser usado nesta chamada
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        namespace = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if enabled is not None and not enabled():
+                return func(*args, **kwargs)
+
+            try:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = tuple(sorted(bound.arguments.items()))
+            except TypeError:
+                return func(*args, **kwargs)
+
+            scope = bound.arguments.get(scope_arg) if scope_arg else None
+            cache = get_shared_cache()
+            key = cache.make_key(namespace, entity, scope, arguments)
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs), ttl)
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def notify_write(entity: str, scope: Any = None):
+    """Registra uma escrita: invalida as leituras da entidade no escopo (todas, se o escopo for desconhecido)."""
+    get_shared_cache().invalidate(entity, scope)
+
+
+def _invalidate_on_write(company_id, entity, start, end, scope):
+    """Inscrito no barramento de escritas: o período é ignorado, a versão cobre a empresa inteira."""
+    notify_write(entity, scope)
+
+
+subscribe(_invalidate_on_write)
@@ -0,0 +1,238 @@
+"""
+Orçamento de tokens do conteúdo enviado à IA na análise de documentos.
+
+O texto extraído pode ter dezenas de páginas de OCR; o prompt recebe só o
+que cabe no orçamento do provedor, priorizando as linhas que costumam ter
+os campos procurados (totais, vencimentos, CNPJ/CPF, linha digitável, chave
+de acesso) com uma linha de contexto em volta, além do cabeçalho do
+documento. Só quando o texto não cabe no orçamento, cabeçalhos/rodapés
+repetidos nas páginas ('--- Página N ---') e as linhas de lançamento de
+extratos longos são resumidos antes da seleção; documentos que cabem vão
+inteiros, com todas as linhas (itens repetidos de um cupom são itens).
+
+A contagem usa o tiktoken para a OpenAI quando instalado; nos demais casos,
+uma estimativa por caracteres calibrada por provedor.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Orçamento total (prompt + conteúdo) por requisição, em tokens de entrada.
+# Pode ser alterado com CONTAI_PROMPT_TOKENS_<PROVEDOR>.
+PROMPT_TOKEN_BUDGETS = {
+    'gemini': 12000,
+    'openai': 8000,
+    'groq': 3000,
+    'anthropic': 8000,
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 6000
+
+# Mínimo de tokens reservado ao conteúdo, mesmo com prompts grandes
+MIN_CONTENT_TOKENS = 300
+
+# Caracteres por token (texto em português, com números) quando não há tokenizador local
+CHARS_PER_TOKEN = {
+    'gemini': 3.8,
+    'openai': 3.6,
+    'groq': 3.4,
+    'anthropic': 3.3,
+}
+
+# Linhas iniciais mantidas (título, emitente, tipo do documento), até uma fração do orçamento
+HEADER_LINES = 12
+HEADER_BUDGET_SHARE = 0.25
+
+# Extratos: lançamentos mantidos no início e no fim quando há muitos
+STATEMENT_ROWS_KEPT = 15
+
+# Cabeçalho/rodapé de página: linha presente uma vez por página em ao menos esta fração das
+# páginas (mínimo de 2) fica só na primeira ocorrência
+REPEATED_LINE_PAGE_SHARE = 0.8
+MIN_PAGES_FOR_REPEATED_LINES = 2
+
+# Separador de páginas gerado por ocr.format_pages
+PAGE_MARKER = re.compile(r'^\s*--- Página \d+ ---\s*$')
+
+# Sinais de campo procurado e seu peso na seleção das linhas
+FIELD_SIGNALS = [
+    (re.compile(r'\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}'), 5),                               # CNPJ
+    (re.compile(r'\d{3}\.\d{3}\.\d{3}-\d{2}'), 3),                                         # CPF
+    (re.compile(r'(?:\d[\s.]*){44,48}'), 6),                                               # Linha digitável / chave
+    (re.compile(r'total|a pagar|valor (?:do documento|cobrado|l[ií]quido)', re.IGNORECASE), 5),
+    (re.compile(r'venc', re.IGNORECASE), 5),
+    (re.compile(r'emiss[aã]o|compet[eê]ncia|per[ií]odo de apura', re.IGNORECASE), 3),
+    (re.compile(r'benefici[aá]rio|pagador|sacado|emitente|destinat[aá]rio|tomador|prestador|cedente', re.IGNORECASE), 3),
+    (re.compile(r'n[uú]mero|n[º°o]\.?\s*(?:da )?(?:nota|nf|documento)|nosso n', re.IGNORECASE), 2),
+    (re.compile(r'saldo|c[oó]digo da receita|chave de acesso', re.IGNORECASE), 3),
+    (re.compile(r'\d{1,3}(?:\.\d{3})*,\d{2}'), 1),                                         # Valor em R$
+    (re.compile(r'\d{2}/\d{2}/\d{4}'), 1),                                                 # Data
+]
+
+# Linha de lançamento de extrato: data no início e valor no fim
+STATEMENT_ROW = re.compile(r'^\s*\d{2}/\d{2}(?:/\d{2,4})?\b.*\d,\d{2}\s*[-+DC]?\s*$')
+
+_tokenizers: Dict[str, object] = {}
+
+
+def prompt_token_budget(model_type: Optional[str]) -> int:
+    default = PROMPT_TOKEN_BUDGETS.get(model_type or '', DEFAULT_PROMPT_TOKEN_BUDGET)
+    return int(os.getenv(f'CONTAI_PROMPT_TOKENS_{(model_type or "").upper()}', default))
+
+
+def _openai_tokenizer():
+    if 'openai' not in _tokenizers:
+        try:
+            import tiktoken
+            _tokenizers['openai'] = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _tokenizers['openai'] = None
+    return _tokenizers['openai']
+
+
+def count_tokens(text: str, model_type: Optional[str] = None) -> int:
+    """Tokens do texto no provedor (tiktoken para a OpenAI, se instalado; senão estimativa)."""
+    if not text:
+        return 0
+    if model_type == 'openai':
+        tokenizer = _openai_tokenizer()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, disallowed_special=()))
+    return int(len(text) / CHARS_PER_TOKEN.get(model_type or '', 3.5)) + 1
+
+
+# =======================================================
+# REDUÇÃO E SELEÇÃO DAS LINHAS
+# =======================================================
+
+def repeated_page_lines(lines: List[str]) -> set:
+    """
+    Linhas de cabeçalho/rodapé: aparecem exatamente uma vez por página em ao
+    menos REPEATED_LINE_PAGE_SHARE das páginas. Sem separadores de página, nenhuma.
+    """
+    pages: List[Counter] = []
+    for line in lines:
+        if PAGE_MARKER.match(line):
+            pages.append(Counter())
+        elif pages and len(line.strip()) > 3:
+            pages[-1][line.strip()] += 1
+    if len(pages) < MIN_PAGES_FOR_REPEATED_LINES:
+        return set()
+
+    min_pages = max(MIN_PAGES_FOR_REPEATED_LINES, math.ceil(len(pages) * REPEATED_LINE_PAGE_SHARE))
+    pages_with_line = Counter()
+    repeated_within_page = set()
+    for page in pages:
+        for key, count in page.items():
+            pages_with_line[key] += 1
+            if count > 1:
+                repeated_within_page.add(key)
+    return {key for key, count in pages_with_line.items()
+            if count >= min_pages and key not in repeated_within_page}
+
+
+def collapse_repeated_lines(lines: List[str]) -> List[str]:
+    """Remove as repetições dos cabeçalhos/rodapés de página (mantém a primeira ocorrência)."""
+    repeated = repeated_page_lines(lines)
+    if not repeated:
+        return lines
+    seen = set()
+    collapsed = []
+    for line in lines:
+        key = line.strip()
+        if key in repeated:
+            if key in seen:
+                continue
+            seen.add(key)
+        collapsed.append(line)
+    return collapsed
+
+
+def summarize_statement_rows(lines: List[str], keep: int = STATEMENT_ROWS_KEPT) -> List[str]:
+    """
+    Extratos longos: mantém os primeiros e os últimos lançamentos (período e
+    saldo final) e as linhas que não são lançamentos; o miolo vira um resumo.
+    """
+    rows = [index for index, line in enumerate(lines) if STATEMENT_ROW.match(line)]
+    if len(rows) <= 2 * keep:
+        return lines
+    dropped = set(rows[keep:-keep])
+    summarized = []
+    marker_added = False
+    for index, line in enumerate(lines):
+        if index in dropped:
+            if not marker_added:
+                summarized.append(f"[... {len(dropped)} lançamentos intermediários omitidos ...]")
+                marker_added = True
+            continue
+        summarized.append(line)
+    return summarized
+
+
+def line_score(line: str) -> int:
+    return sum(weight for pattern, weight in FIELD_SIGNALS if pattern.search(line))
+
+
+def select_content(text: str, budget_tokens: int, model_type: Optional[str] = None) -> str:
+    """
+    Texto do documento reduzido ao orçamento: cabeçalho + linhas com sinais de
+    campo (com uma linha de contexto), na ordem original, com '[...]' nos cortes.
+    Se o texto já cabe no orçamento, volta sem nenhuma alteração.
+    """
+    if not text:
+        return ""
+    if count_tokens(text, model_type) <= budget_tokens:
+        return text
+
+    lines = summarize_statement_rows(collapse_repeated_lines(text.splitlines()))
+    lines = [line.rstrip() for line in lines if line.strip()]
+    reduced = "\n".join(lines)
+    if count_tokens(reduced, model_type) <= budget_tokens:
+        return reduced
+
+    costs = [count_tokens(line, model_type) + 1 for line in lines]
+    selected = set()
+    used = 0
+
+    def take(index: int, limit: float = budget_tokens) -> bool:
+        nonlocal used
+        if index in selected or not 0 <= index < len(lines):
+            return True
+        if used + costs[index] > limit:
+            return False
+        selected.add(index)
+        used += costs[index]
+        return True
+
+    for index in range(min(HEADER_LINES, len(lines))):
+        if not take(index, budget_tokens * HEADER_BUDGET_SHARE):
+            break
+
+    ranked = sorted((index for index in range(len(lines)) if line_score(lines[index]) > 0),
+                    key=lambda index: (-line_score(lines[index]), index))
+    for index in ranked:
+        if not take(index):
+            continue  # Linha grande demais: tenta as próximas
+        take(index - 1)
+        take(index + 1)
+
+    output = []
+    previous = -1
+    for index in sorted(selected):
+        if index != previous + 1:
+            output.append("[...]")
+        output.append(lines[index])
+        previous = index
+    if previous != len(lines) - 1:
+        output.append("[...]")
+    return "\n".join(output)
+
+
+def fit_content(prompt_without_content: str, content: str, model_type: Optional[str] = None,
+                budget: Optional[int] = None) -> str:
+    """Conteúdo que cabe no orçamento do provedor junto com o restante do prompt."""
+    budget = budget or prompt_token_budget(model_type)
+    available = max(MIN_CONTENT_TOKENS, budget - count_tokens(prompt_without_content, model_type))
+    return select_content(content, available, model_type)
@@ -0,0 +1,131 @@
+"""
+Armazenamento em disco dos arquivos enviados, endereçado pelo conteúdo.
+
+O upload é copiado para o disco em blocos e o SHA-256 é calculado durante a
+cópia; o hash é o identificador (handle) guardado na sessão e nos jobs, no
+lugar dos bytes. Os extratores leem o arquivo por mmap apenas quando
+precisam dele. Arquivos sem job pendente são apagados quando o documento
+é aprovado/rejeitado ou, em último caso, pela idade.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
+
+UPLOAD_DIR = os.getenv('CONTAI_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'contai_uploads')
+
+# Tamanho dos blocos copiados para o disco
+CHUNK_SIZE = 1024 * 1024
+
+# Arquivos mais antigos que isso e sem job pendente são removidos na limpeza
+UPLOAD_RETENTION_SECONDS = 7 * 24 * 3600
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadStore:
+    """Diretório de arquivos nomeados pelo SHA-256 do conteúdo."""
+
+    def __init__(self, directory: str = UPLOAD_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise ValueError(f"Identificador de upload inválido: {upload_id!r}")
+        return os.path.join(self.directory, upload_id[:2], upload_id)
+
+    def spool(self, stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+        """
+        Copia o arquivo para o disco em blocos, calculando o hash durante a cópia.
+
+        Returns:
+            Identificador do upload (SHA-256 do conteúdo). Conteúdo repetido
+            reaproveita o arquivo já gravado.
+        """
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.directory, f".{os.getpid()}.{threading.get_ident()}.{time.time_ns()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            upload_id = digest.hexdigest()
+            path = self.path(upload_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.utime(path, None)  # Mesmo conteúdo já armazenado: só renova a idade
+            else:
+                os.replace(tmp_path, path)  # Gravação atômica
+            return upload_id
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def exists(self, upload_id: str) -> bool:
+        try:
+            return os.path.exists(self.path(upload_id))
+        except ValueError:
+            return False
+
+    @contextmanager
+    def open(self, upload_id: str) -> Iterator[Union[mmap.mmap, bytes]]:
+        """
+        Conteúdo do upload mapeado em memória (somente leitura).
+
+        O objeto devolvido aceita as operações de bytes usadas pelos extratores
+        (hash, fatias, BytesIO, escrita em arquivo) e só é válido dentro do bloco.
+        """
+        with open(self.path(upload_id), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''  # Arquivo vazio não pode ser mapeado
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def delete(self, upload_id: str):
+        try:
+            os.remove(self.path(upload_id))
+        except (OSError, ValueError):
+            pass
+
+    def cleanup(self, keep: Iterable[str] = (), max_age: float = UPLOAD_RETENTION_SECONDS) -> int:
+        """Remove arquivos mais antigos que max_age, exceto os de `keep` (jobs pendentes)."""
+        keep = set(keep)
+        limit = time.time() - max_age
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name not in keep and os.path.getmtime(path) < limit:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+_upload_store: Optional[UploadStore] = None
+_upload_store_lock = threading.Lock()
+
+
+def get_upload_store() -> UploadStore:
+    global _upload_store
+    with _upload_store_lock:
+        if _upload_store is None:
+            _upload_store = UploadStore()
+        return _upload_store